@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Compare the codecs for reference files in the cache directory.
+
+Usage:
+
+    ./cache-codecs.py FILE.gb.bz2 [FILE.gb.bz2 ...]
+
+For every available codec, the files are recompressed to a temporary
+directory and the total disk usage and the time to decompress them (best of
+5 runs) and to decompress and parse them (best of 3 runs) are reported. The
+files should be a representative mix of the references in your cache.
+"""
+
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from mutalyzer import compression
+from mutalyzer.parsers import genbank
+
+
+def main(filenames):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        print '%-6s %12s %12s %12s' % ('Codec', 'Disk (KB)', 'Decode (s)',
+                                       'Parse (s)')
+
+        for codec in compression.CODECS.values():
+            paths = []
+            for filename in filenames:
+                base, current = compression.split(filename)
+                copy = compression.filename(os.path.join(
+                    temp_dir, '%s.%s' % (codec.name, os.path.basename(base))),
+                    current)
+                shutil.copy(filename, copy)
+                paths.append(compression.recompress(copy, codec))
+
+            def decode():
+                for path in paths:
+                    handle = compression.open(path)
+                    handle.read()
+                    handle.close()
+
+            def parse():
+                for path in paths:
+                    genbank.GBparser().create_record(path)
+
+            size = sum(os.path.getsize(path) for path in paths)
+            decode_time = min(timeit.repeat(decode, number=1, repeat=5))
+            parse_time = min(timeit.repeat(parse, number=1, repeat=3))
+
+            print '%-6s %12.1f %12.4f %12.4f' % (codec.name, size / 1024.0,
+                                                 decode_time, parse_time)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    main(sys.argv[1:])
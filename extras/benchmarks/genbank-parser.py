@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""
+Compare our own GenBank reader with BioPython for creating records.
+
+Usage:
+
+    ./genbank-parser.py FILE.gb.bz2 [FILE.gb.bz2 ...]
+
+For every file, the time to create a record with our own reader (see
+:mod:`mutalyzer.parsers.flatfile`) and with BioPython is reported (best of 3
+runs). Transcript-protein links are not retrieved.
+"""
+
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import timeit
+
+from mutalyzer import ncbi
+from mutalyzer.parsers import genbank
+
+
+def _no_link(*args, **kwargs):
+    raise ncbi.NoLinkError()
+
+
+def main(filenames):
+    ncbi.transcript_to_protein = _no_link
+
+    print '%-30s %12s %13s %8s' % ('File', 'Native (s)', 'BioPython (s)',
+                                   'Speedup')
+
+    total_native = total_biopython = 0
+    for filename in filenames:
+        native = min(timeit.repeat(
+            lambda: genbank.GBparser().create_record(filename),
+            number=1, repeat=3))
+        biopython = min(timeit.repeat(
+            lambda: genbank.GBparser().create_record(filename, native=False),
+            number=1, repeat=3))
+        total_native += native
+        total_biopython += biopython
+
+        print '%-30s %12.4f %13.4f %8.2f' % (os.path.basename(filename),
+                                             native, biopython,
+                                             biopython / native)
+
+    print '%-30s %12.4f %13.4f %8.2f' % ('Total', total_native,
+                                         total_biopython,
+                                         total_biopython / total_native)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""
+Compare parsing a GenBank file with loading it from the parsed record cache.
+
+Usage:
+
+    ./parsed-record-cache.py FILE.gb.bz2 [REPEAT]
+
+For each of REPEAT runs (default 5), the file is parsed from scratch (cold)
+and loaded from the parsed record cache (warm). The cache files are written
+to a temporary directory which is removed afterwards.
+"""
+
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from mutalyzer.config import settings
+from mutalyzer.output import Output
+from mutalyzer.parsers import genbank
+from mutalyzer import Retriever
+
+
+def main(filename, repeat=5):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        settings.configure({'CACHE_DIR': cache_dir})
+        retriever = Retriever.GenBankRetriever(Output(__file__))
+
+        def cold():
+            return genbank.GBparser().create_record(filename)
+
+        def warm():
+            return retriever._load_parsed_record('benchmark')
+
+        retriever._store_parsed_record('benchmark', cold())
+        size = os.path.getsize(retriever._parsed_record_file('benchmark'))
+
+        cold_times = timeit.repeat(cold, number=1, repeat=repeat)
+        warm_times = timeit.repeat(warm, number=1, repeat=repeat)
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print 'File:         %s (%d bytes)' % (filename,
+                                          os.path.getsize(filename))
+    print 'Parsed cache: %d bytes' % size
+    print 'Cold parse:   %.4f s (best of %d)' % (min(cold_times), repeat)
+    print 'Warm load:    %.4f s (best of %d)' % (min(warm_times), repeat)
+    print 'Speedup:      %.1fx' % (min(cold_times) / min(warm_times))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        sys.exit(__doc__)
+    main(sys.argv[1], *[int(arg) for arg in sys.argv[2:]])
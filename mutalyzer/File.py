@@ -8,7 +8,7 @@ Module for parsing CSV files and spreadsheets.
 @requires: csv
 @requires: xlrd
 @requires: zipfile
-@requires: xml.dom.minidom
+@requires: lxml
 @requires: os
 @requires: types
 """
@@ -19,12 +19,16 @@ Module for parsing CSV files and spreadsheets.
 from __future__ import unicode_literals
 
 import codecs
+import collections
+import itertools
 import re
+import shutil
+import tempfile
 import magic           # open(), MAGIC_MIME, MAGIC_NONE
 import csv             # Sniffer(), reader(), Error
 import xlrd            # open_workbook()
 import zipfile         # ZipFile()
-import xml.dom.minidom # parseString()
+from lxml import etree # iterparse()
 import chardet
 
 from mutalyzer.config import settings
@@ -34,6 +38,16 @@ from mutalyzer.config import settings
 # read for determining the file type).
 BUFFER_SIZE = 32768
 
+# Namespaces of the table and text elements in OpenDocument Spreadsheet and
+# OpenOffice.org 1.x Calc spreadsheet files.
+_TABLE_NAMESPACES = ('urn:oasis:names:tc:opendocument:xmlns:table:1.0',
+                     'http://openoffice.org/2000/table')
+_TEXT_NAMESPACES = ('urn:oasis:names:tc:opendocument:xmlns:text:1.0',
+                    'http://openoffice.org/2000/text')
+_ROW_TAGS = ['{%s}table-row' % ns for ns in _TABLE_NAMESPACES]
+_CELL_TAGS = ['{%s}table-cell' % ns for ns in _TABLE_NAMESPACES]
+_PARAGRAPH_TAGS = ['{%s}p' % ns for ns in _TEXT_NAMESPACES]
+
 
 class _UniversalNewlinesByteStreamIter(object):
     """
@@ -92,6 +106,22 @@ class _UniversalNewlinesByteStreamIter(object):
         return (line.encode('utf-8') for line in self._readlines())
 
 
+class _Rows(object):
+    """
+    Rows of a parsed file. The rows are not kept in memory, instead they are
+    parsed from the start of the file on every iteration.
+    """
+    def __init__(self, rows):
+        """
+        @arg rows: Function returning an iterator over the rows
+        @type rows: function
+        """
+        self._rows = rows
+
+    def __iter__(self):
+        return self._rows()
+
+
 class File() :
     """
     Parse CSV files and spreadsheets.
@@ -132,11 +162,12 @@ class File() :
         """
         Parse a CSV file. Does not reset the file handle to start.
 
-        @arg handle: CSV file. Must be a seekable binary file object.
+        @arg handle: CSV file. Must be a seekable binary file object, which
+          is read every time the rows are iterated over.
         @type handle: file object
 
-        @return: list of lists
-        @rtype: list
+        @return: Rows of the file (lists)
+        @rtype: iterable
         """
         buf = handle.read(BUFFER_SIZE)
         result = chardet.detect(buf)
@@ -198,50 +229,52 @@ class File() :
 #        if dialect.delimiter == ":":
 #            dialect.delimiter = "\t"
 
+        # Make sure the entire file can be decoded before handing out rows.
         handle.seek(0)
-        reader = csv.reader(handle, dialect)
-
-        ret = []
         try:
-            for i in reader:
-                ret.append([c.decode('utf-8') for c in i])
+            for _ in handle:
+                pass
         except UnicodeDecodeError:
             self.__output.addMessage(__file__, 3, 'EBPARSE',
                                      'Could not decode file (using %s encoding).'
                                      % encoding)
             return None
 
-        return ret
+        def rows():
+            handle.seek(0)
+            for row in csv.reader(handle, dialect):
+                yield [c.decode('utf-8') for c in row]
+
+        return _Rows(rows)
     #__parseCsvFile
 
     def __parseXlsFile(self, handle) :
         """
         Parse an Excel file. Does not reset the file handle to start.
 
+        Only the first sheet is loaded. The file is copied to a temporary
+        file in chunks, which xlrd memory-maps, so the file is never read
+        into memory as a whole.
+
         @arg handle: Excel file. Must be a binary file object.
         @type handle: file object
 
-        @return: A list of lists
-        @rtype: list
+        @return: Rows of the first sheet (lists)
+        @rtype: iterable
         """
-
-        try:
-            workBook = xlrd.open_workbook(file_contents=handle.read())
-        except xlrd.XLRDError:
-            return None
-
-        sheet = workBook.sheet_by_index(0)
-
-        ret = []
-        for i in range(sheet.nrows) :
-            row = []
-            for j in sheet.row_values(i) :
-                row.append(j)
-            #for
-            ret.append(row)
-        #for
-
-        return ret
+        # The mapping stays valid after the temporary file is removed.
+        with tempfile.NamedTemporaryFile(suffix='.xls') as temp:
+            shutil.copyfileobj(handle, temp, BUFFER_SIZE)
+            temp.flush()
+            try:
+                workBook = xlrd.open_workbook(filename=temp.name,
+                                              on_demand=True)
+                sheet = workBook.sheet_by_index(0)
+            except xlrd.XLRDError:
+                return None
+
+        return _Rows(lambda: (sheet.row_values(i)
+                              for i in range(sheet.nrows)))
     #__parseXlsFile
 
     def __parseOdsFile(self, handle) :
@@ -249,32 +282,39 @@ class File() :
         Parse an OpenDocument Spreadsheet file.
         The stream is not rewinded after use.
 
-        @arg handle: A handle to a stream
+        @arg handle: A handle to a stream, which is read every time the rows
+          are iterated over.
         @type handle: stream
 
-        @return: A list of lists
-        @rtype: list
+        @return: Rows of the file (lists)
+        @rtype: iterable
         """
         # Todo: Use a library for this.
 
-        zipFile = zipfile.ZipFile(handle)
-        doc = xml.dom.minidom.parseString(zipFile.read("content.xml"))
-        zipFile.close()
-
-        ret = []
-        for i in doc.getElementsByTagName("table:table-row") :
-            row = []
-            for j in i.getElementsByTagName("table:table-cell") :
-                c = j.getElementsByTagName("text:p")
-                if c :
-                    row.append(c[0].lastChild.data)
-                #if
-            #for
-            if row:
-                ret.append(row)
-        #for
-
-        return ret
+        def rows():
+            zipFile = zipfile.ZipFile(handle)
+            try:
+                content = zipFile.open("content.xml")
+                for _, element in etree.iterparse(content, tag=_ROW_TAGS):
+                    row = []
+                    for cell in element.iter(*_CELL_TAGS):
+                        paragraph = next(cell.iter(*_PARAGRAPH_TAGS), None)
+                        if paragraph is not None:
+                            row.append(unicode(''.join(paragraph.itertext())))
+                    #for
+
+                    # Free the rows we have seen.
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+
+                    if row:
+                        yield row
+                #for
+            finally:
+                zipFile.close()
+
+        return _Rows(rows)
     #__parseOdsFile
 
     def __checkBatchFormat(self, job) :
@@ -284,41 +324,46 @@ class File() :
            - The first and the last element should be non-empty.
            - The first line should be the header defined in the config file.
 
+        The rows are iterated over twice: once to check them, and once more
+        (while the returned entries are consumed) to produce the sanitised
+        entries. They are never all kept in memory.
+
         @todo: Add more new style old style logic
         @todo: if not inputl: try to make something out of it
 
-        @arg job: list of lists
-        @type job: list
+        @arg job: Rows of the file (lists)
+        @type job: iterable
 
-        @return: A sanitised list of lists (without a header or empty lines)
-                 and the number of columns.
-        @rtype: tuple(list, int)
+        @return: The sanitised entries (without a header or empty lines) as
+                 a generator and the number of columns.
+        @rtype: tuple(generator, int)
         """
         columns = 1
         max_column_length = 200
 
-        #store original line numbers line 1 = job[0]
-        jobl = [(l+1, row) for l, row in enumerate(job)]
+        first = next(iter(job), None)
+        if first is None:
+            return (None, columns)
 
         #TODO:  Add more new style old style logic
-        if jobl[0][1] == ['AccNo', 'Genesymbol', 'Mutation']: #Old style NameCheckBatch job
-            ret = []
-            notthree = []
-            emptyfield = []
-            toolong = []
-            for line, job in jobl[1:]:
+        if first == ['AccNo', 'Genesymbol', 'Mutation']: #Old style NameCheckBatch job
+            header = 1
 
+            def check(job):
+                """
+                Entries and errors for a row.
+                """
                 #Empty line
                 if not any(job):
-                    ret.append("~!")
-                    continue
+                    return ["~!"], []
 
+                errors = []
                 inputl = ""
                 if len(job)!=3:     #Need three columns
-                    notthree.append(line)
+                    errors.append('notthree')
                 elif (not(job[0] and job[2])):
                     # First and last column cant be empty
-                    emptyfield.append(line)
+                    errors.append('emptyfield')
                 else:
                     if job[1]:
                         if job[0].startswith("LRG"):
@@ -334,79 +379,108 @@ class File() :
                     inputl+= "|".join(job)
 
                 if len(inputl) > max_column_length:
-                    toolong.append(line)
+                    errors.append('toolong')
+                    return [], errors
+                return [inputl], errors
+        #if
+
+        else:   #No Header, possibly a new BatchType
+            header = 0
+            # Determine number of columns from first line.
+            columns = len(first)
+
+            def check(job):
+                """
+                Entries and errors for a row.
+                """
+                if not any(job):    #Empty line
+                    return ['~!'] * columns, []
+
+                errors = []
+                if len(job) != columns:
+                    errors.append('columns')
+                if any(len(col) > max_column_length for col in job):
+                    errors.append('toolong')
+
+                if 'toolong' in errors:
+                    #Trim too long
+                    entries = ["~!InputFields: " + ('|'.join(job))[:180] + '...']
+                    entries.extend(['~!' for _ in range(columns - 1)])
+                elif errors:
+                    #Dirty Escape BatchEntries
+                    entries = ["~!InputFields: " + '|'.join(job)]
+                    entries.extend(['~!' for _ in range(columns - 1)])
                 else:
-                    ret.append(inputl)
-            #for
+                    entries = [j or '~!' for j in job]
+                return entries, errors
+        #else
 
+        def rows():
+            #store original line numbers line 1 = job[0]
+            return itertools.islice(enumerate(job, 1), header, None)
+
+        # Count the entries and the lines with errors per type of error. For
+        # the messages, we only need the first few line numbers.
+        count = 0
+        errors = collections.Counter()
+        lines = collections.defaultdict(list)
+        for line, row in rows():
+            entries, row_errors = check(row)
+            count += len(entries)
+            for error in row_errors:
+                errors[error] += 1
+                if len(lines[error]) <= 10:
+                    lines[error].append(line)
+
+        if header:
             #Create output Message for incompatible fields
-            if any(notthree):
-                lines = makeList(notthree, 10)
+            if errors['notthree']:
                 self.__output.addMessage(__file__, 3, "EBPARSE",
                         "Wrong amount of columns in %i line(s): %s.\n" %
-                        (len(notthree), lines))
+                        (errors['notthree'], makeList(lines['notthree'], 10)))
 
-            if any(emptyfield):
-                lines = makeList(emptyfield, 10)
+            if errors['emptyfield']:
                 self.__output.addMessage(__file__, 3, "EBPARSE",
                         "The first and last column can't be left empty in "
-                        "%i line(s): %s.\n" % (len(emptyfield), lines))
+                        "%i line(s): %s.\n" %
+                        (errors['emptyfield'], makeList(lines['emptyfield'], 10)))
 
-            if any(toolong):
-                lines = makeList(toolong, 10)
+            if errors['toolong']:
                 self.__output.addMessage(__file__, 3, "EBPARSE",
                         "Batch input field exceeds %d characters in %i line(s): %s.\n" %
-                        (max_column_length, len(toolong), lines))
+                        (max_column_length, errors['toolong'],
+                         makeList(lines['toolong'], 10)))
 
-            errlist = notthree + emptyfield + toolong
-        #if
-
-        else:   #No Header, possibly a new BatchType
-            if len(jobl) == 0:
-                return (None, columns)
-            # Determine number of columns from first line.
-            columns = len(jobl[0][1])
-            # Collect all lines with a different number of columns
-            errlist = [line for line, row in jobl
-                       if any(row) and len(row) != columns]
-            if any(errlist):
+            errcount = (errors['notthree'] + errors['emptyfield'] +
+                        errors['toolong'])
+        else:
+            if errors['columns']:
                 self.__output.addMessage(__file__, 3, "EBPARSE",
                     "New Type Batch jobs (see help) should contain the same "
                     "number of columns on every line, please check %i "
                     "line(s): %s" %
-                    (len(errlist), makeList(errlist)))
+                    (errors['columns'], makeList(lines['columns'])))
 
-            toolong = [line for line, row in jobl
-                       if any(len(col) > max_column_length for col in row)]
-            if any(toolong):
+            if errors['toolong']:
                 self.__output.addMessage(__file__, 3, "EBPARSE",
                     "Batch input field exceeds %d characters in %i line(s): %s" %
-                    (max_column_length, len(toolong), makeList(toolong)))
+                    (max_column_length, errors['toolong'],
+                     makeList(lines['toolong'])))
 
-            ret = []
-            for line, job in jobl:
-                if not any(job):    #Empty line
-                    ret.extend(['~!' for _ in range(columns)])
-                    continue
-                if line in toolong:
-                    #Trim too long
-                    ret.append("~!InputFields: " + ('|'.join(job))[:180] + '...')
-                    ret.extend(['~!' for _ in range(columns - 1)])
-                elif line in errlist:
-                    #Dirty Escape BatchEntries
-                    ret.append("~!InputFields: " + '|'.join(job))
-                    ret.extend(['~!' for _ in range(columns - 1)])
-                else:
-                    ret.extend([j or '~!' for j in job])
-        #else
+            errcount = errors['columns']
 
-        if not ret:
+        if not count:
             #prevent divide by zero
             return (None, columns)
 
-        err = float(len(errlist))/len(ret)
+        def ret():
+            for _, row in rows():
+                for entry in check(row)[0]:
+                    yield entry
+
+        err = float(errcount)/count
         if err == 0:
-            return (ret, columns)
+            return (ret(), columns)
         elif err < settings.BATCH_JOBS_ERROR_THRESHOLD:
             #allow a 5 (default) percent threshold for errors in batchfiles
             self.__output.addMessage(__file__, 3, "EBPARSE",
@@ -414,7 +488,7 @@ class File() :
                     "omitted and your batch is started. Please check the "
                     "batch input file help at the top of this page for "
                     "additional information.")
-            return (ret, columns)
+            return (ret(), columns)
         else:
             return (None, columns)
     #__checkBatchFormat
@@ -456,8 +530,9 @@ class File() :
           object.
         @type handle: file object
 
-        @return: A list of lists, None if an error occured
-        @rtype: list
+        @return: Rows of the file (lists, parsed from the file every time they
+          are iterated over), None if an error occured
+        @rtype: iterable
         """
 
         mimeType = self.getMimeType(handle)
@@ -485,16 +560,17 @@ class File() :
         start.
 
         @arg handle: Batch job input file. Must be a seekable binary file
-          object.
+          object, which must not be closed before the entries are consumed.
         @type handle: file object
 
-        @return: A sanitised list of lists (without a header or empty lines)
-                 (or None if an error occured) and the number of columns.
-        @rtype: tuple(list, int)
+        @return: The sanitised entries (without a header or empty lines) as
+                 a generator (or None if an error occured) and the number of
+                 columns.
+        @rtype: tuple(generator, int)
         """
 
         job = self.parseFileRaw(handle)
-        if job:
+        if job is not None:
             return self.__checkBatchFormat(job)
         return (None, 1)
     #parseBatchFile
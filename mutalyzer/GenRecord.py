@@ -11,12 +11,17 @@ search for them each time.
 #     - PList     ; Store a general location and a list of splice sites.
 #     - Locus     ; Store data about the mRNA and CDS splice sites.
 #     - Gene      ; Store a list of Locus objects and the orientation.
+#     - TranscriptIndex ; Find the transcripts overlapping a region.
 #     - Record    ; Store a geneList and other additional information.
 #     - GenRecord ; Convert a GenBank record to a nested dictionary.
 
 
 from __future__ import unicode_literals
 
+import bisect
+import collections
+import functools
+
 from mutalyzer import util
 from mutalyzer import Crossmap
 
@@ -179,6 +184,7 @@ class Gene(object) :
         self.location = []
         self.longName = ""
         self.__locusTag = "000"
+        self.__lookup = None
     #__init__
 
     def newLocusTag(self) :
@@ -204,6 +210,23 @@ class Gene(object) :
         @return: transcript
         @rtype: object
         """
+        # The table is rebuilt if transcriptList was replaced or changed
+        # length, we fall back to searching the transcripts otherwise.
+        if self.__lookup is None or \
+           self.__lookup[0] is not self.transcriptList or \
+           self.__lookup[1] != len(self.transcriptList) :
+            loci = {}
+            for i in self.transcriptList :
+                loci.setdefault(i.name, i)
+            self.__lookup = (self.transcriptList, len(self.transcriptList),
+                             loci)
+
+        if self.transcriptList :
+            loci = self.__lookup[2]
+            for key in name, "%03i" % int(name) :
+                i = loci.get(key)
+                if i is not None and i.name == key :
+                    return i
 
         for i in self.transcriptList :
             if i.name == name or i.name == "%03i" % int(name):
@@ -243,6 +266,74 @@ class Gene(object) :
     #findLink
 #Gene
 
+class TranscriptIndex(object) :
+    """
+    An interval index over the transcripts of a record, to find the
+    transcripts overlapping a region without visiting all transcripts.
+
+    The region of a transcript is taken from its crossmapper and includes
+    the CDS. Transcripts are sorted by start position, and for every
+    transcript we keep the maximum end position of it and all transcripts
+    before it. A query then only has to look at the transcripts starting
+    before the end of the region, going back until the maximum end position
+    is before the start of the region.
+
+    Special methods:
+        - __init__(transcripts) ; Build the index.
+        - __contains__(transcript) ; Check if a transcript is indexed.
+
+    Public methods:
+        - overlapping(start, stop) ; Transcripts overlapping a region.
+    """
+
+    def __init__(self, transcripts) :
+        """
+        Build the index.
+
+        @arg transcripts: Transcripts with a crossmapper
+        @type transcripts: list(Locus)
+        """
+        regions = []
+        for transcript in transcripts :
+            positions = transcript.CM.RNA + transcript.CM.CDS
+            regions.append((min(positions), max(positions), transcript))
+        regions.sort(key=lambda region: region[0])
+
+        self.__starts = [start for start, _, _ in regions]
+        self.__stops = [stop for _, stop, _ in regions]
+        self.__transcripts = [transcript for _, _, transcript in regions]
+        self.__maxStops = []
+        for stop in self.__stops :
+            self.__maxStops.append(max(stop, self.__maxStops[-1])
+                                   if self.__maxStops else stop)
+        self.__indexed = set(self.__transcripts)
+    #__init__
+
+    def __contains__(self, transcript) :
+        return transcript in self.__indexed
+
+    def overlapping(self, start, stop) :
+        """
+        Find the indexed transcripts overlapping a region.
+
+        @arg start: Start of the region (g. position)
+        @type start: integer
+        @arg stop: End of the region (g. position)
+        @type stop: integer
+
+        @return: Transcripts overlapping the region
+        @rtype: set(Locus)
+        """
+        ret = set()
+        i = bisect.bisect_right(self.__starts, stop) - 1
+        while i >= 0 and self.__maxStops[i] >= start :
+            if self.__stops[i] >= start :
+                ret.add(self.__transcripts[i])
+            i -= 1
+        return ret
+    #overlapping
+#TranscriptIndex
+
 class Record(object) :
     """
     A Record object, to store a geneList and other additional
@@ -259,6 +350,10 @@ class Record(object) :
                       one).
         - source    ; A fake gene that can be used when no gene information
                       is present.
+        - geneIndex ; Genes not in geneList yet (see loadGenes).
+        - geneRegions ; Locations of the genes in geneIndex.
+        - transcriptIndex ; Interval index over the transcripts (see
+                            indexTranscripts).
     """
 
     def __init__(self) :
@@ -278,6 +373,15 @@ class Record(object) :
                           which one).
             - source    ; A fake gene that can be used when no gene
                           information is present.
+            - geneIndex ; Genes that are not in geneList yet, by name, with
+                          the accession numbers of their transcripts and
+                          proteins (see loadGenes).
+            - geneRegions ; Locations of the genes in geneIndex, as start
+                            and stop position (see loadGenesNear).
+            - geneLoader ; Function adding genes from geneIndex to
+                           geneList, given the record and the gene names.
+            - transcriptIndex ; Interval index over the transcripts with a
+                                crossmapper, or None if not built.
         """
 
         self.geneList = []
@@ -293,8 +397,187 @@ class Record(object) :
         self.chromDescription = ""
         self.orientation = 1
         self.recordId = None
+        self.geneIndex = {}
+        self.geneRegions = {}
+        self.geneLoader = None
+        self.transcriptIndex = None
+        self.__lookup = None
+        self.__indexed = {}
+        self.__current = None
     #__init__
 
+    def __lookupTables(self) :
+        """
+        Tables to find genes by name and transcripts by transcript ID.
+
+        The tables are rebuilt if geneList was replaced or changed length.
+        Transcripts added to a gene afterwards are not in the tables, so
+        callers should fall back to searching the genes if they do not find
+        what they are looking for.
+
+        @return: Genes by name and (gene, transcript) tuples by transcript ID
+        @rtype: tuple(dict, dict)
+        """
+        if self.__lookup is None or \
+           self.__lookup[0] is not self.geneList or \
+           self.__lookup[1] != len(self.geneList) :
+            genes = {}
+            transcripts = {}
+            for gene in self.geneList :
+                genes.setdefault(gene.name, gene)
+                for transcript in gene.transcriptList :
+                    if transcript.transcriptID :
+                        transcripts.setdefault(transcript.transcriptID,
+                                               (gene, transcript))
+            self.__lookup = (self.geneList, len(self.geneList), genes,
+                             transcripts)
+        return self.__lookup[2], self.__lookup[3]
+    #__lookupTables
+
+    def indexTranscripts(self) :
+        """
+        Build transcriptIndex over all transcripts with a crossmapper.
+        """
+        transcripts = []
+        self.__indexed = {}
+        self.__current = None
+        for gene in self.geneList :
+            for transcript in gene.transcriptList :
+                if transcript.current :
+                    self.__current = gene, transcript
+                if transcript.CM :
+                    self.__indexed[transcript] = len(transcripts), gene
+                    transcripts.append(transcript)
+        self.transcriptIndex = TranscriptIndex(transcripts)
+    #indexTranscripts
+
+    def transcriptsNear(self, start, stop) :
+        """
+        Find the transcripts with a crossmapper overlapping a region, using
+        transcriptIndex. If the index is not built, all transcripts with a
+        crossmapper are returned.
+
+        @arg start: Start of the region (g. position)
+        @type start: integer
+        @arg stop: End of the region (g. position)
+        @type stop: integer
+
+        @return: Tuples (gene, transcript) in record order
+        @rtype: list(tuple(Gene, Locus))
+        """
+        if self.transcriptIndex is None :
+            return [(gene, transcript) for gene in self.geneList
+                    for transcript in gene.transcriptList if transcript.CM]
+
+        found = sorted((self.__indexed[transcript], transcript)
+                       for transcript in
+                       self.transcriptIndex.overlapping(start, stop))
+        return [(gene, transcript) for (_, gene), transcript in found]
+    #transcriptsNear
+
+    def currentTranscript(self) :
+        """
+        The current transcript (see Locus.current), as found when
+        transcriptIndex was built. If the index is not built, all
+        transcripts are searched.
+
+        @return: Tuple (gene, transcript), or None if there is no current
+            transcript
+        @rtype: tuple(Gene, Locus)
+        """
+        if self.transcriptIndex is None :
+            for gene in self.geneList :
+                for transcript in gene.transcriptList :
+                    if transcript.current :
+                        return gene, transcript
+            return None
+        return self.__current
+    #currentTranscript
+
+    def loadGenes(self, names=None) :
+        """
+        Add genes from geneIndex to geneList. Records created for a
+        selection of genes (see GBparser.create_record) only have Gene
+        objects for the selected genes, the other genes are indexed and
+        loaded on demand.
+
+        Note that genes without transcripts are not added to geneList.
+
+        @arg names: Names of the genes to load (default: all indexed genes)
+        @type names: list(unicode)
+        """
+        if names is None :
+            names = self.geneIndex.keys()
+        names = [name for name in names if name in self.geneIndex]
+        if not names :
+            return
+        for name in names :
+            del self.geneIndex[name]
+            self.geneRegions.pop(name, None)
+        self.geneLoader(self, names)
+    #loadGenes
+
+    def loadGenesNear(self, start, stop) :
+        """
+        Add genes from geneIndex overlapping a region to geneList (see
+        loadGenes). Genes without a location are always added.
+
+        @arg start: Start of the region (g. position)
+        @type start: integer
+        @arg stop: End of the region (g. position)
+        @type stop: integer
+
+        @return: Names of the added genes (including those without
+            transcripts, which are not in geneList)
+        @rtype: list(unicode)
+        """
+        names = []
+        for name in self.geneIndex :
+            location = self.geneRegions.get(name)
+            if not location or (location[0] <= stop and
+                                start <= location[1]) :
+                names.append(name)
+        self.loadGenes(names)
+        return names
+    #loadGenesNear
+
+    def selectGenes(self, selection, region=None) :
+        """
+        Keep only the genes selected by name, transcript or protein
+        accession number, or location in geneList and move the other genes
+        to geneIndex, as in records created for a selection of genes (see
+        GBparser.create_record). This way, a complete record gives the same
+        results as a record parsed for the same selection.
+
+        @arg selection: Gene names and accession numbers (with version)
+        @type selection: iterable(unicode)
+        @kwarg region: Start and stop position (one-based, inclusive)
+        @type region: tuple(int)
+        """
+        if self.geneLoader is not None :
+            return
+        selection = set(selection or [])
+        genes = list(self.geneList)
+        for gene in genes :
+            accessions = set()
+            for transcript in gene.transcriptList :
+                accessions.update(
+                    [transcript.transcriptID, transcript.proteinID])
+            accessions.discard(None)
+            accessions.discard('')
+            if gene.name in selection or accessions & selection :
+                continue
+            if region and gene.location and \
+               gene.location[0] <= region[1] and \
+               region[0] <= gene.location[1] :
+                continue
+            self.geneIndex[gene.name] = accessions
+            self.geneRegions[gene.name] = gene.location
+        self.geneList = [gene for gene in genes
+                         if gene.name not in self.geneIndex]
+        self.geneLoader = functools.partial(_restoreGenes, genes)
+    #selectGenes
+
     def findGene(self, name) :
         """
         Returns a Gene object, given its name.
@@ -305,6 +588,11 @@ class Record(object) :
         @return: Gene object
         @rtype: object
         """
+        self.loadGenes([name])
+
+        gene = self.__lookupTables()[0].get(name)
+        if gene is not None and gene.name == name :
+            return gene
 
         for i in self.geneList :
             if i.name == name :
@@ -320,6 +608,16 @@ class Record(object) :
         @param accession: unicode
         @return: tuple(unicode, unicode)
         """
+        self.loadGenes([name for name, accessions in self.geneIndex.items()
+                        if accession in accessions])
+
+        try:
+            gene, transcript = self.__lookupTables()[1][accession]
+        except KeyError:
+            pass
+        else:
+            if transcript.transcriptID == accession:
+                return gene.name, transcript.name
 
         for gene in self.geneList:
             for transcript in gene.transcriptList:
@@ -335,6 +633,7 @@ class Record(object) :
         @rtype: list
 
         """
+        self.loadGenes()
 
         ret = []
         for i in self.geneList :
@@ -390,6 +689,23 @@ class Record(object) :
     #addToChromDescription
 #Record
 
+def _restoreGenes(genes, record, names) :
+    """
+    Add genes moved to geneIndex by Record.selectGenes back to the gene
+    list of the record (see Record.loadGenes).
+
+    @arg genes: All Gene objects of the record, in record order
+    @type genes: list(Gene)
+    @arg record: The record
+    @type record: Record
+    @arg names: Names of the genes to load
+    @type names: list(unicode)
+    """
+    loaded = dict((gene.name, gene) for gene in record.geneList)
+    record.geneList = [loaded.get(gene.name, gene) for gene in genes
+                       if gene.name in loaded or gene.name in names]
+#_restoreGenes
+
 class GenRecord() :
     """
     Convert a GenBank record to a nested dictionary.
@@ -405,11 +721,17 @@ class GenRecord() :
         Public variable:
             - record    ; A record object
 
+        Private variables:
+            - __named     ; Variants named so far (see name).
+            - __described ; Transcripts described so far, with their gene.
+
         @arg output: an output object
         @type output: object
         """
         self.__output = output
         self.record = None
+        self.__named = []
+        self.__described = collections.OrderedDict()
     #__init__
 
     def __checkExonList(self, exonList, CDSpos) :
@@ -499,18 +821,24 @@ class GenRecord() :
         return string
     #__maybeInvert
 
-    def checkRecord(self) :
+    def checkRecord(self, genes=None) :
         """
         Check if the record in self.record is compatible with mutalyzer.
         Update the mRNA PList with the exon and CDS data.
 
+        @kwarg genes: Only check these genes, e.g., genes added to the record
+            after it was checked (default: all genes)
+        @type genes: list(Gene)
+
         @todo: This function should really check the record for minimal
         requirements
         """
 
         #TODO:  This function should really check
         #       the record for minimal requirements.
-        for i in self.record.geneList :
+        if genes is None :
+            genes = self.record.geneList
+        for i in genes :
             """
             if len(i.transcriptList) == 2 :
                 if i.transcriptList[0].CDS and not i.transcriptList[1].CDS and \
@@ -628,6 +956,8 @@ class GenRecord() :
                 #else
             #for
         #for
+
+        self.record.indexTranscripts()
     #checkRecord
 
     def current_transcript(self):
@@ -647,7 +977,8 @@ class GenRecord() :
     def name(self, start_g, stop_g, varType, arg1, arg2, roll, arg1_reverse=None,
              start_fuzzy=False, stop_fuzzy=False):
         """
-        Generate variant descriptions for all genes, transcripts, etc.
+        Generate variant descriptions for the record and for the
+        transcripts near the variant (see Record.transcriptsNear).
 
         @arg start_g: start position
         @type start_g: integer
@@ -758,82 +1089,144 @@ class GenRecord() :
                 self.record.addToChromDescription("%s%c>%c" % (
                     chromStart, chromArg1, chromArg2))
 
-        for i in self.record.geneList :
-            for j in i.transcriptList :
-                if j.CM :
-                    orientedStart = forwardStart
-                    orientedStop = forwardStop
-                    if i.orientation == -1 :
-                        orientedStart = reverseStart
-                        orientedStop = reverseStop
-                    #if
-
-                    # Turn of translation to protein if we hit splice sites.
-                    # For the current transcript, this is handled with more
-                    # care in variantchecker.py.
-                    if not j.current and \
-                           util.over_splice_site(orientedStart, orientedStop,
-                                                 j.CM.RNA):
-                        j.translate = False
-
-                    # And check whether the variant hits CDS start.
-                    if j.molType == 'c' and forwardStop >= j.CM.x2g(1, 0) \
-                       and forwardStart <= j.CM.x2g(3, 0) :
-                        self.__output.addMessage(__file__, 2, "WSTART",
-                            "Mutation in start codon of gene %s transcript " \
-                            "%s." % (i.name, j.name))
-                        if not j.current:
-                            j.translate = False
-
-                    # FIXME Check whether the variant hits a splice site.
-
-                    if varType != "subst" :
-                        if orientedStart != orientedStop :
-                            if (start_fuzzy or stop_fuzzy) and not j.current:
-                                # Don't generate descriptions on transcripts
-                                # other than the current in the case of fuzzy
-                                # positions.
-                                j.cancelDescription()
-                            else:
-                                j.addToDescription("%s_%s%s%s" % (
-                                    j.CM.g2c(orientedStart, start_fuzzy),
-                                    j.CM.g2c(orientedStop, stop_fuzzy),
-                                    varType, self.__maybeInvert(i, arg1, arg1_reverse)))
-                                self.checkIntron(i, j, orientedStart)
-                                self.checkIntron(i, j, orientedStop)
-                        #if
-                        else :
-                            if start_fuzzy and not j.current:
-                                # Don't generate descriptions on transcripts
-                                # other than the current in the case of fuzzy
-                                # positions.
-                                j.cancelDescription()
-                            else:
-                                j.addToDescription("%s%s%s" % (
-                                    j.CM.g2c(orientedStart, start_fuzzy),
-                                    varType,
-                                    self.__maybeInvert(i, arg1, arg1_reverse)))
-                                self.checkIntron(i, j, orientedStart)
-                        #else
-                    #if
-                    else :
-                        if start_fuzzy and not j.current:
-                            # Don't generate descriptions on transcripts
-                            # other than the current in the case of fuzzy
-                            # positions.
-                            j.cancelDescription()
-                        else:
-                            j.addToDescription("%s%c>%c" % (
-                                j.CM.g2c(orientedStart, start_fuzzy),
-                                self.__maybeInvert(i, arg1, arg1_reverse),
-                                self.__maybeInvert(i, arg2)))
-                            self.checkIntron(i, j, orientedStart)
-                    #else
-                #if
-            #for
-        #for
+        window = (min(forwardStart, reverseStop) - SPLICE_WARN,
+                  max(forwardStop, reverseStart) + SPLICE_WARN)
+
+        # Records created for a selection of genes (see
+        # GBparser.create_record) get the other genes near the variant now.
+        if self.record.geneIndex :
+            loaded = [self.record.findGene(name)
+                      for name in self.record.loadGenesNear(*window)]
+            loaded = [gene for gene in loaded if gene is not None]
+            if loaded :
+                self.checkRecord(loaded)
+
+        # Only transcripts near the variant and the current transcript are
+        # visited. A transcript that is visited for the first time also gets
+        # the variants named before, so all transcripts near any of the
+        # variants are described completely and the others are not
+        # described at all.
+        variant = (forwardStart, forwardStop, reverseStart, reverseStop,
+                   varType, arg1, arg2, arg1_reverse, start_fuzzy,
+                   stop_fuzzy)
+        near = self.record.transcriptsNear(*window)
+        nearby = set(transcript for _, transcript in near)
+
+        others = [(gene, transcript)
+                  for transcript, gene in self.__described.items()
+                  if transcript not in nearby]
+        current = self.record.currentTranscript()
+        if current is not None and current[1].CM and \
+           current[1] not in nearby and current[1] not in self.__described :
+            others.append(current)
+
+        for gene, transcript in others + near :
+            if transcript not in self.__described :
+                for previous in self.__named :
+                    self.__describe(gene, transcript, previous, False)
+                self.__described[transcript] = gene
+            self.__describe(gene, transcript, variant,
+                            transcript in nearby)
+        self.__named.append(variant)
     #name
 
+    def __describe(self, gene, transcript, variant, near) :
+        """
+        Add a variant to the description of a transcript. If the transcript
+        is near the variant, also check whether the variant hits a splice
+        site or the start codon.
+
+        The splice site, start codon, and intron checks can only hit
+        transcripts overlapping the variant, or near it for the intron check
+        (see checkIntron).
+
+        @arg gene: Gene of the transcript
+        @type gene: object
+        @arg transcript: Transcript
+        @type transcript: object
+        @arg variant: Positions and arguments of the variant, as given to
+            and computed by name
+        @type variant: tuple
+        @arg near: Whether the transcript is near the variant
+        @type near: bool
+        """
+        (forwardStart, forwardStop, reverseStart, reverseStop, varType, arg1,
+         arg2, arg1_reverse, start_fuzzy, stop_fuzzy) = variant
+
+        orientedStart = forwardStart
+        orientedStop = forwardStop
+        if gene.orientation == -1 :
+            orientedStart = reverseStart
+            orientedStop = reverseStop
+        #if
+
+        # Turn of translation to protein if we hit splice sites.
+        # For the current transcript, this is handled with more
+        # care in variantchecker.py.
+        if near and not transcript.current and \
+               util.over_splice_site(orientedStart, orientedStop,
+                                     transcript.CM.RNA):
+            transcript.translate = False
+
+        # And check whether the variant hits CDS start.
+        if near and transcript.molType == 'c' and \
+           forwardStop >= transcript.CM.x2g(1, 0) and \
+           forwardStart <= transcript.CM.x2g(3, 0) :
+            self.__output.addMessage(__file__, 2, "WSTART",
+                "Mutation in start codon of gene %s transcript " \
+                "%s." % (gene.name, transcript.name))
+            if not transcript.current:
+                transcript.translate = False
+
+        # FIXME Check whether the variant hits a splice site.
+
+        if varType != "subst" :
+            if orientedStart != orientedStop :
+                if (start_fuzzy or stop_fuzzy) and not transcript.current:
+                    # Don't generate descriptions on transcripts
+                    # other than the current in the case of fuzzy
+                    # positions.
+                    transcript.cancelDescription()
+                else:
+                    transcript.addToDescription("%s_%s%s%s" % (
+                        transcript.CM.g2c(orientedStart, start_fuzzy),
+                        transcript.CM.g2c(orientedStop, stop_fuzzy),
+                        varType, self.__maybeInvert(gene, arg1, arg1_reverse)))
+                    if near :
+                        self.checkIntron(gene, transcript, orientedStart)
+                        self.checkIntron(gene, transcript, orientedStop)
+            #if
+            else :
+                if start_fuzzy and not transcript.current:
+                    # Don't generate descriptions on transcripts
+                    # other than the current in the case of fuzzy
+                    # positions.
+                    transcript.cancelDescription()
+                else:
+                    transcript.addToDescription("%s%s%s" % (
+                        transcript.CM.g2c(orientedStart, start_fuzzy),
+                        varType,
+                        self.__maybeInvert(gene, arg1, arg1_reverse)))
+                    if near :
+                        self.checkIntron(gene, transcript, orientedStart)
+            #else
+        #if
+        else :
+            if start_fuzzy and not transcript.current:
+                # Don't generate descriptions on transcripts
+                # other than the current in the case of fuzzy
+                # positions.
+                transcript.cancelDescription()
+            else:
+                transcript.addToDescription("%s%c>%c" % (
+                    transcript.CM.g2c(orientedStart, start_fuzzy),
+                    self.__maybeInvert(gene, arg1, arg1_reverse),
+                    self.__maybeInvert(gene, arg2)))
+                if near :
+                    self.checkIntron(gene, transcript, orientedStart)
+        #else
+    #__describe
+
     def checkIntron(self, gene, transcript, position):
         """
         Checks if a position is on or near a splice site
@@ -9,21 +9,39 @@ to re-download the file.
 
 from __future__ import unicode_literals
 
-import bz2
 import chardet
+import codecs
+import collections
+import contextlib
+import copy
+import cPickle
+import errno
+import fcntl
 import hashlib
 import io
 import os
+import re
+import tempfile
+import threading
+import time
 import urllib2
+import zlib
 
 from Bio import Entrez
 from Bio import SeqIO
 from Bio.Alphabet import ProteinAlphabet
 from Bio.Seq import UnknownSeq
+from Bio.SeqFeature import FeatureLocation
+from Bio.SeqFeature import SeqFeature
 from httplib import HTTPException
+from lxml import etree
 from sqlalchemy.orm.exc import NoResultFound
-from xml.dom import DOMException
 
+from mutalyzer import cache
+from mutalyzer import compression
+from mutalyzer import entrez
+from mutalyzer import sequence
+from mutalyzer import stats
 from mutalyzer import util
 from mutalyzer.config import settings
 from mutalyzer.db import session
@@ -32,6 +50,51 @@ from mutalyzer.parsers import genbank
 from mutalyzer.parsers import lrg
 
 
+#: Format version of the parsed record cache files. Increase this after any
+#: change to the parsers or to the :mod:`mutalyzer.GenRecord` classes, so
+#: existing parsed record cache files are no longer used.
+PARSED_RECORD_VERSION = 7
+
+#: Sequences of parsed records of at least this length (in bases) are kept in
+#: a raw sequence file and memory-mapped (see :mod:`mutalyzer.sequence`).
+#: Shorter sequences (e.g., of NM records) are kept in memory, since every
+#: memory-mapped sequence holds an open file descriptor.
+MAPPED_SEQUENCE_SIZE = 1048576
+
+#: Reference files are decoded, hashed, compressed, and written in chunks of
+#: this size (in bytes).
+WRITE_CHUNK_SIZE = 1048576
+
+#: The encoding of a reference file is detected on a prefix of this size (in
+#: bytes).
+ENCODING_PREFIX_SIZE = 65536
+
+
+def _detect_encoding(raw_data):
+    """
+    Detect the encoding of raw data.
+
+    Valid UTF-8 (including ASCII) is recognized without further analysis.
+
+    :arg str raw_data: The raw data.
+
+    :returns: Name of the encoding.
+    :rtype: unicode
+    """
+    try:
+        # The data may end with an incomplete multibyte sequence, which the
+        # incremental decoder accepts.
+        codecs.getincrementaldecoder('utf-8')().decode(raw_data)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    result = chardet.detect(raw_data)
+    if result['confidence'] > 0.5:
+        return unicode(result['encoding'])
+    return 'utf-8'
+
+
 class Retriever(object):
     """
     Retrieve a record from either the cache or the NCBI.
@@ -46,26 +109,222 @@ class Retriever(object):
         self._output = output
         if not os.path.isdir(settings.CACHE_DIR):
             os.mkdir(settings.CACHE_DIR)
-        Entrez.email = settings.EMAIL
-        if hasattr(settings, 'ENTREZ_API_KEY'):
-            Entrez.api_key = settings.ENTREZ_API_KEY
         self.file_type = None
 
     def _name_to_file(self, name):
         """
-        Convert an accession number to a filename.
+        Convert an accession number to a filename, compressed with the
+        configured codec (see :mod:`mutalyzer.compression`).
 
         :arg unicode name: The accession number.
 
+        :returns: A filename.
+        :rtype: unicode
+        """
+        return compression.filename(os.path.join(
+            settings.CACHE_DIR, '{}.{}'.format(name, self.file_type)))
+
+    def cache_file(self, name):
+        """
+        Get the cache file for an accession number, if it exists. The file
+        may be compressed with any codec.
+
+        :arg unicode name: The accession number.
+
+        :returns: The full path to the cache file, or `None` if the record is
+          not in the cache.
+        :rtype: unicode
+        """
+        return compression.find(os.path.join(
+            settings.CACHE_DIR, '{}.{}'.format(name, self.file_type)))
+
+    @contextlib.contextmanager
+    def _single_flight(self, key):
+        """
+        Context manager making sure only one thread or process at a time
+        retrieves a record.
+
+        The lock is a file lock in the cache directory. If another retrieval
+        of the same record holds the lock, we wait for it to finish for at
+        most `FETCH_LOCK_TIMEOUT` seconds. After that, we continue without
+        the lock.
+
+        :arg unicode key: Identifies the record to retrieve.
+
+        :returns: `True` if another retrieval of the same record may have
+          finished while we were waiting, `False` otherwise. In the former
+          case, the caller should check the cache again before retrieving.
+        :rtype: bool
+        """
+        lock_dir = os.path.join(settings.CACHE_DIR, 'locks')
+        if not os.path.isdir(lock_dir):
+            try:
+                os.mkdir(lock_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        path = os.path.join(lock_dir,
+                            '{}.{}.lock'.format(key, self.file_type))
+        handle = open(path, 'a')
+        try:
+            waited = False
+            deadline = time.time() + settings.FETCH_LOCK_TIMEOUT
+            while True:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                else:
+                    try:
+                        if (os.fstat(handle.fileno()).st_ino ==
+                                os.stat(path).st_ino):
+                            break
+                    except OSError:
+                        pass
+                    # The lock file was removed (see
+                    # :func:`mutalyzer.cache.evict`), lock a new one.
+                    handle.close()
+                    handle = open(path, 'a')
+                    continue
+                waited = True
+                if time.time() > deadline:
+                    self._output.addMessage(
+                        __file__, -1, 'INFO',
+                        'Timeout waiting for another retrieval of {}.'.format(
+                            key))
+                    break
+                time.sleep(0.1)
+            yield waited
+        finally:
+            # Closing the file releases the lock.
+            handle.close()
+
+    def _parsed_record_file(self, checksum):
+        """
+        Convert a reference checksum to the filename of its parsed record.
+
+        :arg unicode checksum: The md5sum of the reference.
+
         :returns: A filename.
         :rtype: unicode
         """
         return os.path.join(
-            settings.CACHE_DIR, '{}.{}.bz2'.format(name, self.file_type))
+            settings.CACHE_DIR, '{}.{}.record'.format(checksum, self.file_type))
+
+    def _parsed_sequence_file(self, checksum):
+        """
+        Convert a reference checksum to the filename of the raw sequence of
+        its parsed record.
+
+        :arg unicode checksum: The md5sum of the reference.
+
+        :returns: A filename.
+        :rtype: unicode
+        """
+        return os.path.join(
+            settings.CACHE_DIR, '{}.{}.seq'.format(checksum, self.file_type))
+
+    def _load_parsed_record(self, checksum):
+        """
+        Load a parsed record from the parsed record cache.
+
+        The sequence of the record is a
+        :class:`mutalyzer.sequence.MappedSequence` on the raw sequence file if
+        it is at least `MAPPED_SEQUENCE_SIZE` long.
+
+        :arg unicode checksum: The md5sum of the reference.
+
+        :returns: The parsed record or `None` if it is not in the cache (or
+          was written by another version of Mutalyzer).
+        :rtype: object
+        """
+        try:
+            with open(self._parsed_record_file(checksum), 'rb') as handle:
+                version, record = cPickle.loads(
+                    zlib.decompress(handle.read()))
+        except IOError:
+            # This includes a missing raw sequence file.
+            return None
+        except (zlib.error, cPickle.UnpicklingError, EOFError, ValueError,
+                TypeError, AttributeError, ImportError):
+            # Truncated or otherwise unreadable file, we just parse the
+            # reference again and overwrite it.
+            return None
+
+        if version != PARSED_RECORD_VERSION:
+            return None
+        cache.touch(self._parsed_record_file(checksum))
+        cache.touch(self._parsed_sequence_file(checksum))
+        return record
+
+    def _store_parsed_record(self, checksum, record):
+        """
+        Store a parsed record in the parsed record cache.
+
+        Sequences of at least `MAPPED_SEQUENCE_SIZE` are stored in a separate
+        raw sequence file and replaced in the record by a
+        :class:`mutalyzer.sequence.MappedSequence` on that file, so the record
+        does not keep the full sequence in memory.
+
+        The files are written under a temporary name and then renamed, so
+        concurrent readers never see a partially written file.
+
+        :arg unicode checksum: The md5sum of the reference.
+        :arg object record: The parsed record.
+        """
+        record_file = self._parsed_record_file(checksum)
+        sequence_file = self._parsed_sequence_file(checksum)
+
+        if len(record.seq) >= MAPPED_SEQUENCE_SIZE:
+            try:
+                self._write_atomic(
+                    unicode(record.seq).encode('ascii'), sequence_file)
+                mapped = sequence.MappedSequence(sequence_file,
+                                                 record.seq.alphabet)
+            except (IOError, OSError, UnicodeError):
+                # Not being able to cache the parsed record is not fatal.
+                return
+            cache.add(sequence_file)
+            record.seq = mapped
+
+        data = zlib.compress(
+            cPickle.dumps((PARSED_RECORD_VERSION, record),
+                          cPickle.HIGHEST_PROTOCOL), 1)
+        try:
+            self._write_atomic(data, record_file)
+        except (IOError, OSError):
+            return
+        cache.add(record_file)
+
+    def _write_atomic(self, data, filename):
+        """
+        Write data to a file in the cache directory under a temporary name
+        and rename it.
+
+        :arg str data: The data.
+        :arg unicode filename: Full path to the file.
+
+        :raises IOError, OSError: If the file could not be written.
+        """
+        handle, temp_filename = tempfile.mkstemp(dir=settings.CACHE_DIR,
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as out_handle:
+                out_handle.write(data)
+            os.rename(temp_filename, filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.unlink(temp_filename)
 
     def _write(self, raw_data, filename):
         """
-        Write raw data to a compressed file.
+        Write raw data to a compressed file, converting it to UTF-8.
+
+        The encoding is detected on a prefix of the data. If that looks like
+        UTF-8 but the rest of the data is not, we detect the encoding on all
+        of the data and try again.
 
         :arg str raw_data: The raw_data to be compressed and written.
         :arg unicode filename: The intended name of the output filename.
@@ -73,37 +332,79 @@ class Retriever(object):
         :returns: The full path and name of the file written.
         :rtype: unicode
         """
-        result = chardet.detect(raw_data)
-        if result['confidence'] > 0.5:
-            encoding = unicode(result['encoding'])
-        else:
-            encoding = 'utf-8'
+        encoding = _detect_encoding(raw_data[:ENCODING_PREFIX_SIZE])
 
-        if not util.is_utf8_alias(encoding):
-            try:
-                raw_data = raw_data.decode(encoding).encode('utf-8')
-            except UnicodeDecodeError:
-                self._output.addMessage(
-                    __file__, 4, 'ENOPARSE',
-                    'Could not decode file (using {} encoding).'.format(
-                        encoding))
-                return None
+        try:
+            return self._write_chunks(raw_data, filename, encoding)
+        except UnicodeDecodeError:
+            if (len(raw_data) > ENCODING_PREFIX_SIZE and
+                    util.is_utf8_alias(encoding)):
+                encoding = _detect_encoding(raw_data)
+                try:
+                    return self._write_chunks(raw_data, filename, encoding)
+                except UnicodeDecodeError:
+                    pass
+
+        self._output.addMessage(
+            __file__, 4, 'ENOPARSE',
+            'Could not decode file (using {} encoding).'.format(encoding))
+        return None
+
+    def _write_chunks(self, raw_data, filename, encoding):
+        """
+        Write raw data to a compressed file in one pass over the data (see
+        :meth:`_write`).
+
+        The file is written under a temporary name and then renamed, so
+        concurrent readers never see a partially written file.
+
+        :arg str raw_data: The raw_data to be compressed and written.
+        :arg unicode filename: The intended name of the output filename.
+        :arg unicode encoding: Encoding of the raw data.
+
+        :raises UnicodeDecodeError: If the data could not be decoded.
+
+        :returns: The full path and name of the file written.
+        :rtype: unicode
+        """
+        decoder = codecs.getincrementaldecoder(encoding)()
+        convert = not util.is_utf8_alias(encoding)
 
         # Compress the data to save disk space.
-        comp = bz2.BZ2Compressor()
-        data = comp.compress(raw_data)
-        data += comp.flush()
-        out_handle = open(self._name_to_file(filename), 'wb')
-        out_handle.write(data)
-        out_handle.close()
+        comp = compression.get().compressor()
+
+        handle, temp_filename = tempfile.mkstemp(dir=settings.CACHE_DIR,
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as out_handle:
+                for start in range(0, len(raw_data), WRITE_CHUNK_SIZE):
+                    chunk = raw_data[start:start + WRITE_CHUNK_SIZE]
+                    # For UTF-8 data this only validates the chunk.
+                    text = decoder.decode(chunk)
+                    if convert:
+                        chunk = text.encode('utf-8')
+                    out_handle.write(comp.compress(chunk))
+                decoder.decode(b'', True)
+                out_handle.write(comp.flush())
+            os.rename(temp_filename, self._name_to_file(filename))
+        finally:
+            if os.path.exists(temp_filename):
+                os.unlink(temp_filename)
+
+        filename = self._name_to_file(filename)
+        compression.remove_others(filename)
+        cache.add(filename)
 
         # Return the full path to the file.
-        return out_handle.name
+        return filename
 
     def _calculate_hash(self, content):
         """
         Calculate the md5sum of a piece of text.
 
+        Callers calculate the md5sum once and pass it along, the data is not
+        kept (reference files can be hundreds of megabytes).
+
         :arg unicode content: Arbitrary text.
 
         :returns: The md5sum of 'content'.
@@ -111,9 +412,7 @@ class Retriever(object):
         """
         hash_func = hashlib.md5()
         hash_func.update(content)
-        md5sum = hash_func.hexdigest()
-
-        return unicode(md5sum)
+        return unicode(hash_func.hexdigest())
 
     def _new_ud(self):
         """
@@ -125,9 +424,10 @@ class Retriever(object):
         ud = util.generate_id()
         return 'UD_' + unicode(ud)
 
-    def _update_db_md5(self, raw_data, name, source):
+    def _update_db_md5(self, md5sum, name, source):
         """
-        :arg str raw_data:
+        :arg unicode md5sum: The md5sum of the reference (see
+          :meth:`_calculate_hash`).
         :arg unicode name:
         :arg unicode source:
 
@@ -142,7 +442,6 @@ class Retriever(object):
             current_md5sum = None
 
         if current_md5sum:
-            md5sum = self._calculate_hash(raw_data)
             if md5sum != current_md5sum:
                 self._output.addMessage(
                     __file__, -1, 'WHASH',
@@ -152,7 +451,7 @@ class Retriever(object):
                     {'checksum': md5sum})
                 session.commit()
         else:
-            reference = Reference(name, self._calculate_hash(raw_data), source)
+            reference = Reference(name, md5sum, source)
             session.add(reference)
             session.commit()
         return self._name_to_file(name)
@@ -237,6 +536,25 @@ class GenBankRetriever(Retriever):
         return out_filename
 
     def fetch(self, name):
+        """
+        Fetch a GenBank record from the NCBI and store it in the cache.
+
+        Concurrent fetches of the same record are done only once, the other
+        callers wait for the first one to finish.
+
+        :arg unicode name: The accession number.
+
+        :returns: The full path to the file or `None` if the record could not
+          be retrieved.
+        :rtype: unicode
+        """
+        with self._single_flight(name) as waited:
+            if waited and self.cache_file(name):
+                # Somebody else fetched it while we were waiting.
+                return self.cache_file(name)
+            return self._fetch(name)
+
+    def _fetch(self, name):
         """
         Todo: Documentation.
 
@@ -245,7 +563,7 @@ class GenBankRetriever(Retriever):
             use efetch with rettype=gbwithparts to download the GenBank file.
         """
         try:
-            net_handle = Entrez.efetch(
+            net_handle = entrez.efetch(
                 db='nuccore', id=name, rettype='gb', retmode='text')
             raw_data = net_handle.read()
             net_handle.close()
@@ -292,7 +610,7 @@ class GenBankRetriever(Retriever):
                         name, settings.MAX_FILE_SIZE // 1048576))
                 return None
             try:
-                net_handle = Entrez.efetch(
+                net_handle = entrez.efetch(
                     db='nuccore', id=name, rettype='gbwithparts',
                     retmode='text')
                 raw_data = net_handle.read()
@@ -310,7 +628,8 @@ class GenBankRetriever(Retriever):
         name = self.write(raw_data, name, 1)
         if name:
             # Processing went okay.
-            return self._update_db_md5(raw_data, name, 'ncbi')
+            return self._update_db_md5(self._calculate_hash(raw_data), name,
+                                       'ncbi')
         else:
             # Parse error in the GenBank file.
             return None
@@ -328,6 +647,9 @@ class GenBankRetriever(Retriever):
         The content of the slice is placed in the cache with the UD number
         as filename.
 
+        Concurrent retrievals of the same slice are done only once, the other
+        callers wait for the first one to finish.
+
         :arg unicode accno: The accession number of the chromosome.
         :arg int start: Start position of the slice (one-based, inclusive, in
           reference orientation).
@@ -359,32 +681,58 @@ class GenBankRetriever(Retriever):
         source_data = '{}:{}:{}:{}'.format(
             accno, start, stop, ['forward', 'reverse'][orientation - 1])
 
+        with self._single_flight(source_data) as waited:
+            if waited:
+                # Start a new transaction so we see the slice if it was
+                # created while we were waiting.
+                session.commit()
+            return self._retrieveslice(accno, start, stop, orientation,
+                                       source_data)
+
+    def _retrieveslice(self, accno, start, stop, orientation, source_data):
+        """
+        Retrieve a slice of a chromosome (see :meth:`retrieveslice`).
+
+        :arg unicode source_data: Value of the `Reference.source_data` field
+          for this slice.
+
+        :returns: An UD number.
+        :rtype: unicode
+        """
         # Check whether we have seen this slice before.
         reference = Reference.query.filter_by(
             source='ncbi_slice',
             source_data=source_data
         ).first()
-        if reference and os.path.isfile(self._name_to_file(reference.accession)):
+        if reference and self.cache_file(reference.accession):
             # It's still present.
             return reference.accession
 
-        # It's not present, so download it.
-        try:
-            # EFetch `seq_start` and `seq_stop` are one-based, inclusive, and
-            # in reference orientation.
-            handle = Entrez.efetch(
-                db='nuccore', rettype='gbwithparts', retmode='text', id=accno,
-                seq_start=start, seq_stop=stop, strand=orientation)
-            raw_data = handle.read()
-            handle.close()
-        except (IOError, urllib2.HTTPError, HTTPException) as e:
-            self._output.addMessage(
-                __file__, -1, 'INFO',
-                'Error connecting to Entrez nuccore database: {}'.format(
-                    unicode(e)))
-            self._output.addMessage(
-                __file__, 4, 'ERETR', 'Could not retrieve slice.')
-            return None
+        # It's not present, but it may be contained in a larger slice we
+        # have, in which case we crop that one.
+        raw_data = self._crop_slice(accno, start, stop, orientation)
+        if raw_data is not None:
+            stats.increment_counter('slice-cache/hit')
+        else:
+            # Nothing to crop, so download it.
+            try:
+                # EFetch `seq_start` and `seq_stop` are one-based, inclusive,
+                # and in reference orientation.
+                handle = entrez.efetch(
+                    db='nuccore', rettype='gbwithparts', retmode='text',
+                    id=accno, seq_start=start, seq_stop=stop,
+                    strand=orientation)
+                raw_data = handle.read()
+                handle.close()
+            except (IOError, urllib2.HTTPError, HTTPException) as e:
+                self._output.addMessage(
+                    __file__, -1, 'INFO',
+                    'Error connecting to Entrez nuccore database: {}'.format(
+                        unicode(e)))
+                self._output.addMessage(
+                    __file__, 4, 'ERETR', 'Could not retrieve slice.')
+                return None
+            stats.increment_counter('slice-cache/miss')
 
         # Calculate the hash of the downloaded file.
         md5sum = self._calculate_hash(raw_data)
@@ -412,6 +760,136 @@ class GenBankRetriever(Retriever):
         if self.write(raw_data, reference.accession, 0):
             return reference.accession
 
+    def _containing_slice(self, accno, start, stop):
+        """
+        Find the smallest slice we have in the cache that contains a region
+        of a chromosome.
+
+        Slices are looked up by their `Reference.source_data` field, which
+        starts with the accession number of the chromosome, using the
+        `reference_source_data` index.
+
+        :arg unicode accno: The accession number of the chromosome.
+        :arg int start: Start position of the region (one-based, inclusive,
+          in reference orientation).
+        :arg int stop: End position of the region (one-based, inclusive, in
+          reference orientation).
+
+        :returns: Full path to the file, start and end position, and
+          orientation (1 or 2) of the slice, or `None` if there is no such
+          slice.
+        :rtype: tuple(unicode, int, int, int)
+        """
+        candidates = []
+
+        references = Reference.query.filter(
+            Reference.source == 'ncbi_slice',
+            Reference.source_data.like(accno.replace('%', '\\%')
+                                       .replace('_', '\\_') + ':%',
+                                       escape='\\'))
+        for reference in references:
+            try:
+                _, slice_start, slice_stop, slice_orientation = \
+                    reference.source_data.rsplit(':', 3)
+                slice_start, slice_stop = int(slice_start), int(slice_stop)
+                slice_orientation = ['forward', 'reverse'].index(
+                    slice_orientation) + 1
+            except ValueError:
+                continue
+            if slice_start <= start and stop <= slice_stop:
+                candidates.append((slice_stop - slice_start, reference,
+                                   slice_start, slice_stop, slice_orientation))
+
+        for _, reference, slice_start, slice_stop, slice_orientation in \
+                sorted(candidates, key=lambda candidate: candidate[0]):
+            filename = self.cache_file(reference.accession)
+            if filename:
+                return filename, slice_start, slice_stop, slice_orientation
+
+        return None
+
+    def _crop_slice(self, accno, start, stop, orientation):
+        """
+        Create a slice of a chromosome by cropping a larger slice we have in
+        the cache (see :meth:`_containing_slice`).
+
+        We only do this if no feature (other than the source feature) is
+        partially contained in the slice. Otherwise, the result would differ
+        from what the NCBI gives us, since they truncate such features
+        differently (and adjust their qualifiers).
+
+        :arg unicode accno: The accession number of the chromosome.
+        :arg int start: Start position of the slice (one-based, inclusive, in
+          reference orientation).
+        :arg int stop: End position of the slice (one-based, inclusive, in
+          reference orientation).
+        :arg int orientation: Orientation of the slice (1 or 2).
+
+        :returns: The GenBank record for the slice, or `None` if there is no
+          containing slice or it cannot be cropped.
+        :rtype: str
+        """
+        container = self._containing_slice(accno, start, stop)
+        if container is None:
+            return None
+        filename, slice_start, slice_stop, slice_orientation = container
+
+        handle = compression.open(filename)
+        try:
+            record = SeqIO.read(codecs.getreader('utf-8')(handle), 'genbank')
+        except (ValueError, AttributeError):
+            return None
+        finally:
+            handle.close()
+
+        # Zero-based, half-open, in the orientation of the containing slice.
+        if slice_orientation == 1:
+            crop_start, crop_stop = start - slice_start, stop - slice_start + 1
+        else:
+            crop_start, crop_stop = slice_stop - stop, slice_stop - start + 1
+
+        source = None
+        for feature in record.features:
+            if feature.type == 'source':
+                source = source or feature
+                continue
+            feature_start = int(feature.location.start)
+            feature_stop = int(feature.location.end)
+            if (feature_start < crop_start < feature_stop or
+                    feature_start < crop_stop < feature_stop):
+                return None
+
+        cropped = record[crop_start:crop_stop]
+        if orientation != slice_orientation:
+            cropped = cropped.reverse_complement(
+                id=True, name=True, description=True, features=True,
+                annotations=True, letter_annotations=True, dbxrefs=True)
+
+        # Slicing drops the annotations and the source feature.
+        cropped.annotations = copy.deepcopy(record.annotations)
+        if source is not None:
+            cropped.features.insert(0, SeqFeature(
+                FeatureLocation(0, len(cropped), strand=1), type='source',
+                qualifiers=copy.deepcopy(source.qualifiers)))
+
+        fake_handle = io.BytesIO()
+        SeqIO.write(cropped, codecs.getwriter('utf-8')(fake_handle),
+                    'genbank')
+        raw_data = fake_handle.getvalue()
+
+        # BioPython only writes the accession number on the ACCESSION line,
+        # but the region is how the parser knows the position of the slice on
+        # the chromosome.
+        region = '{}..{}'.format(start, stop)
+        if orientation == 2:
+            region = 'complement({})'.format(region)
+        accession = ' '.join([record.annotations['accessions'][0], 'REGION:',
+                              region] +
+                             record.annotations['accessions'][3:])
+        return re.sub(br'(?m)^ACCESSION   .*$',
+                      b'ACCESSION   ' + accession.encode('ascii'), raw_data,
+                      count=1)
+
     def retrievegene(self, gene, organism, upstream=0, downstream=0):
         """
         Query the NCBI for the chromosomal location of a gene and make a
@@ -428,7 +906,7 @@ class GenBankRetriever(Retriever):
         # Search the NCBI for a specific gene in an organism.
         query = '{}[Gene] AND {}[Orgn]'.format(gene, organism)
         try:
-            handle = Entrez.esearch(db='gene', term=query)
+            handle = entrez.esearch(db='gene', term=query)
             try:
                 search_result = Entrez.read(handle)
             except Entrez.Parser.ValidationError:
@@ -456,7 +934,7 @@ class GenBankRetriever(Retriever):
         for i in search_result['IdList']:
             # Inspect all results.
             try:
-                handle = Entrez.esummary(db='gene', id=i)
+                handle = entrez.esummary(db='gene', id=i)
                 try:
                     summary = Entrez.read(handle)
                 except Entrez.Parser.ValidationError:
@@ -582,7 +1060,7 @@ class GenBankRetriever(Retriever):
                         checksum=md5sum).one()
                 except NoResultFound:
                     ud = self._new_ud()
-                    if not os.path.isfile(self._name_to_file(ud)):
+                    if not self.cache_file(ud):
                         ud = self.write(raw_data, ud, 0) and ud
                     if ud:
                         # Parsing went OK, add to DB.
@@ -591,7 +1069,7 @@ class GenBankRetriever(Retriever):
                         session.add(reference)
                         session.commit()
                 else:
-                    if (os.path.isfile(self._name_to_file(reference.accession)) or
+                    if (self.cache_file(reference.accession) or
                             self.write(raw_data, reference.accession, 0)):
                         ud = reference.accession
 
@@ -630,13 +1108,13 @@ class GenBankRetriever(Retriever):
                 session.commit()
                 return ud
         else:
-            if os.path.isfile(self._name_to_file(reference.accession)):
+            if self.cache_file(reference.accession):
                 return reference.accession
             else:
                 return (self.write(raw_data, reference.accession, 0) and
                         reference.accession)
 
-    def loadrecord(self, accession):
+    def loadrecord(self, accession, genes=None, region=None):
         """
         Load a RefSeq record and return it.
 
@@ -648,7 +1126,20 @@ class GenBankRetriever(Retriever):
            database.
         3. Fetched from the NCBI.
 
+        If only some genes are needed, these can be selected with `genes` and
+        `region`. Only the selected genes are parsed completely, the others
+        are loaded on demand (see
+        :meth:`mutalyzer.parsers.genbank.GBparser.create_record`). Records
+        parsed this way are only kept in memory, by selection. If the fully
+        parsed record is cached, the same selection is made on it (see
+        :meth:`mutalyzer.GenRecord.Record.selectGenes`).
+
         :arg unicode accession: A RefSeq accession number.
+        :arg genes: Select genes by name or by accession number (with version)
+          of one of their transcripts or proteins.
+        :type genes: iterable(unicode)
+        :arg tuple(int) region: Select genes overlapping this region, given as
+          start and stop position (one-based, inclusive).
 
         :returns: A parsed RefSeq record or `None` if no record could be found
           for the given accession.
@@ -656,17 +1147,22 @@ class GenBankRetriever(Retriever):
         """
         reference = Reference.query.filter_by(accession=accession).first()
 
+        if reference is not None and self.cache_file(reference.accession):
+            stats.increment_counter('cache/hit')
+        else:
+            stats.increment_counter('cache/miss')
+
         if reference is None:
             # We don't know it, fetch it from NCBI.
             filename = self.fetch(accession)
 
         else:
             # We have seen it before.
-            filename = self._name_to_file(reference.accession)
+            filename = self.cache_file(reference.accession)
 
-            if os.path.isfile(filename):
+            if filename is not None:
                 # It is still in the cache, so filename is valid.
-                pass
+                cache.touch(filename)
 
             elif reference.source == 'ncbi_slice':
                 # It was previously created by slicing.
@@ -679,14 +1175,14 @@ class GenBankRetriever(Retriever):
                 slice_start = int(slice_start)
                 slice_stop = int(slice_stop)
                 slice_orientation = cast_orientation[slice_orientation]
-                if not self.retrieveslice(slice_accession, slice_start,
-                                          slice_stop, slice_orientation):
-                    filename = None
+                if self.retrieveslice(slice_accession, slice_start,
+                                      slice_stop, slice_orientation):
+                    filename = self.cache_file(reference.accession)
 
             elif reference.source == 'url':
                 # It was previously created by URL.
-                if not self.downloadrecord(reference.source_data):
-                    filename = None
+                if self.downloadrecord(reference.source_data):
+                    filename = self.cache_file(reference.accession)
 
             elif reference.source == 'ncbi':
                 # It was previously fetched from NCBI.
@@ -704,9 +1200,52 @@ class GenBankRetriever(Retriever):
             self._output.addOutput('BatchFlags', ('S1', accession))
             return None
 
-        # Now we have the file, so we can parse it.
-        genbank_parser = genbank.GBparser()
-        record = genbank_parser.create_record(filename)
+        if reference is not None:
+            checksum = reference.checksum
+        else:
+            # The record was fetched and stored under its accession (with
+            # version), which may differ from the one we asked for.
+            fetched = Reference.query.filter_by(
+                accession=compression.split(os.path.basename(filename))[0]
+                [:-len('.gb')]).first()
+            checksum = fetched and fetched.checksum
+
+        # Now we have the file, so we can parse it, unless we already have
+        # the parsed record for the same file contents.
+        record = None
+        if checksum:
+            record = shared_records.get((self.file_type, checksum))
+            if record is None:
+                record = self._load_parsed_record(checksum)
+                if record is not None:
+                    shared_records.add((self.file_type, checksum), record)
+                    record = copy_record(record)
+
+        if record is not None and (genes is not None or region is not None):
+            # Results should not depend on what we have cached, so the
+            # complete record gets the same selection.
+            record.selectGenes(genes, region=region)
+
+        elif record is None and (genes is not None or region is not None):
+            key = (self.file_type, checksum,
+                   tuple(sorted(genes or [])), region)
+            if checksum:
+                record = shared_records.get(key)
+            if record is None:
+                genbank_parser = genbank.GBparser()
+                record = genbank_parser.create_record(filename, genes=genes,
+                                                      region=region)
+                if checksum:
+                    shared_records.add(key, record)
+                    record = copy_record(record)
+
+        elif record is None:
+            genbank_parser = genbank.GBparser()
+            record = genbank_parser.create_record(filename)
+            if checksum:
+                self._store_parsed_record(checksum, record)
+                shared_records.add((self.file_type, checksum), record)
+                record = copy_record(record)
 
         if reference:
             record.id = reference.accession
@@ -740,16 +1279,23 @@ class LRGRetriever(Retriever):
         """
         Load and parse a LRG file based on the identifier.
 
+        Like GenBank records, parsed LRG records are kept in the parsed
+        record cache by checksum of the LRG file, so parsing the XML is only
+        needed the first time.
+
         :arg unicode identifier: The name of the LRG file to read.
 
         :returns: GenRecord.Record of LRG file or None in case of failure.
         :rtype: object
         """
-        # Make a filename based upon the identifier.
-        filename = self._name_to_file(identifier)
+        filename = self.cache_file(identifier)
 
-        if not os.path.isfile(filename):
+        if filename is not None:
+            stats.increment_counter('cache/hit')
+            cache.touch(filename)
+        else:
             # We can't find the file.
+            stats.increment_counter('cache/miss')
             filename = self.fetch(identifier)
 
         if filename is None:
@@ -758,12 +1304,31 @@ class LRGRetriever(Retriever):
             # return None in case of error.
             return None
 
-        # Now we have the file, so we can parse it.
-        file_handle = bz2.BZ2File(filename, 'r')
+        reference = Reference.query.filter_by(accession=identifier).first()
+        checksum = reference and reference.checksum
+        key = self.file_type, checksum or identifier
 
-        # Create GenRecord.Record from LRG file.
-        record = lrg.create_record(file_handle.read())
-        file_handle.close()
+        record = shared_records.get(key)
+        if record is None and checksum:
+            record = self._load_parsed_record(checksum)
+            if record is not None:
+                shared_records.add(key, record)
+                record = copy_record(record)
+
+        if record is None:
+            # Now we have the file, so we can parse it.
+            file_handle = compression.open(filename)
+
+            # Create GenRecord.Record from LRG file.
+            try:
+                record = lrg.create_record(file_handle)
+            finally:
+                file_handle.close()
+
+            if checksum:
+                self._store_parsed_record(checksum, record)
+            shared_records.add(key, record)
+            record = copy_record(record)
 
         # We don't create LRGs from other sources, so id is always the same
         # as source_id.
@@ -776,11 +1341,25 @@ class LRGRetriever(Retriever):
         """
         Fetch the LRG file and store in the cache directory.
 
+        Concurrent fetches of the same LRG file are done only once, the other
+        callers wait for the first one to finish.
+
         :arg unicode name: The name of the LRG file to fetch.
 
         :returns: the full path to the file; None in case of an error.
         :rtype: unicode
         """
+        with self._single_flight(name) as waited:
+            if waited and self.cache_file(name):
+                # Somebody else fetched it while we were waiting.
+                return self.cache_file(name)
+            return self._fetch(name)
+
+    def _fetch(self, name):
+        """
+        Fetch the LRG file and store in the cache directory (see
+        :meth:`fetch`).
+        """
         url = '{}/{}.xml'.format(settings.LRG_PREFIX_URL, name)
         filename = None
 
@@ -804,8 +1383,6 @@ class LRGRetriever(Retriever):
         lrg_id = name or os.path.splitext(os.path.split(url)[1])[0]
         # if not lrg_id.startswith('LRG'):
         #     return None
-        filename = self._name_to_file(lrg_id)
-
         # TODO: Properly read the file contents to a unicode string and write
         # it utf-8 encoded.
         handle = urllib2.urlopen(url)
@@ -849,7 +1426,8 @@ class LRGRetriever(Retriever):
                     # Hash the same as in db.
                     pass
 
-                if not os.path.isfile(filename):
+                filename = self.cache_file(lrg_id)
+                if filename is None:
                     return self.write(raw_data, lrg_id)
                 else:
                     # This can only occur if synchronus calls to mutalyzer are
@@ -881,7 +1459,7 @@ class LRGRetriever(Retriever):
         # Parse the file to see if it's a real LRG file.
         try:
             lrg.create_record(raw_data)
-        except DOMException:
+        except etree.XMLSyntaxError:
             self._output.addMessage(
                 __file__, 4, 'ERECPARSE', 'Could not parse file.')
             # Explicit return on Error.
@@ -889,3 +1467,228 @@ class LRGRetriever(Retriever):
 
         # Returns full path.
         return self._write(raw_data, filename)
+
+
+def copy_record(record):
+    """
+    Copy a parsed record.
+
+    The copy can be modified independently from the original, except for the
+    sequence. Sequences (:class:`Bio.Seq.Seq` objects) are immutable, so the
+    original and the copy share the same sequence instead of copying what can
+    be many megabases.
+
+    :arg object record: A parsed record.
+
+    :returns: A copy of the parsed record.
+    :rtype: object
+    """
+    return copy.deepcopy(record, {id(record.seq): record.seq})
+
+
+def _record_size(record):
+    """
+    Estimate the memory used by a parsed record (in bytes).
+
+    This is dominated by the sequence, we count a fixed amount of memory for
+    the annotation of each transcript. Memory-mapped sequences (see
+    :mod:`mutalyzer.sequence`) are not counted, they are paged in and out by
+    the operating system and shared with other processes.
+    """
+    transcripts = sum(len(gene.transcriptList) for gene in record.geneList)
+    size = 1024 * (transcripts + 1)
+    if not isinstance(record.seq, sequence.LazySequence):
+        size += len(record.seq)
+    return size
+
+
+def _is_mapped(record):
+    """
+    Whether the sequence of a parsed record is memory-mapped (and holds an
+    open file descriptor).
+    """
+    return isinstance(record.seq, sequence.MappedSequence)
+
+
+class SharedRecordCache(object):
+    """
+    Keep parsed records in memory for the lifetime of the process, so
+    records used by many requests are parsed only once.
+
+    The cache is bounded by the estimated memory use of the records (see the
+    `SHARED_RECORD_CACHE_SIZE` setting) and by the number of records with a
+    memory-mapped sequence, each holding an open file descriptor (see the
+    `SHARED_RECORD_CACHE_MAPPED` setting). It discards the least recently
+    used records first. It is cleared when the `CACHE_DIR` setting changes.
+
+    Records are modified while checking a variant description, so cached
+    records are never handed out directly. Callers get a copy made by
+    :func:`copy_record`, sharing only the immutable sequence.
+
+    Cache hits, misses, and evictions are counted in the `record-cache/hit`,
+    `record-cache/miss`, and `record-cache/eviction` counters in
+    :mod:`mutalyzer.stats`.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = collections.OrderedDict()
+        self._size = 0
+        self._mapped = 0
+
+    def get(self, key):
+        """
+        Get a copy of a cached record.
+
+        :arg tuple key: The cache key.
+
+        :returns: A copy of the cached record, or `None` if it is not cached.
+        :rtype: object
+        """
+        with self._lock:
+            try:
+                record, size = self._records.pop(key)
+            except KeyError:
+                record = None
+            else:
+                self._records[key] = record, size
+
+        if record is None:
+            stats.increment_counter('record-cache/miss')
+            return None
+
+        stats.increment_counter('record-cache/hit')
+        return copy_record(record)
+
+    def add(self, key, record):
+        """
+        Add a record to the cache. The caller should not modify the record
+        afterwards.
+
+        :arg tuple key: The cache key.
+        :arg object record: The parsed record.
+        """
+        size = _record_size(record)
+        if size > settings.SHARED_RECORD_CACHE_SIZE:
+            return
+        if _is_mapped(record) and not settings.SHARED_RECORD_CACHE_MAPPED:
+            return
+
+        evicted = 0
+        with self._lock:
+            if key in self._records:
+                self._remove(key)
+            self._records[key] = record, size
+            self._size += size
+            self._mapped += _is_mapped(record)
+            while self._size > settings.SHARED_RECORD_CACHE_SIZE:
+                self._remove(next(iter(self._records)))
+                evicted += 1
+            if self._mapped > settings.SHARED_RECORD_CACHE_MAPPED:
+                mapped = [cached_key
+                          for cached_key, (cached, _) in self._records.items()
+                          if _is_mapped(cached)]
+                excess = self._mapped - settings.SHARED_RECORD_CACHE_MAPPED
+                for cached_key in mapped[:excess]:
+                    self._remove(cached_key)
+                    evicted += 1
+
+        for _ in range(evicted):
+            stats.increment_counter('record-cache/eviction')
+
+    def _remove(self, key):
+        """
+        Remove a record from the cache. The caller should hold the lock.
+        """
+        record, size = self._records.pop(key)
+        self._size -= size
+        self._mapped -= _is_mapped(record)
+
+    def clear(self):
+        """
+        Remove all records from the cache.
+        """
+        with self._lock:
+            self._records.clear()
+            self._size = 0
+            self._mapped = 0
+
+
+def _clear_shared_records(cache_dir):
+    """
+    Clear the shared record cache if the cache directory is updated.
+    """
+    shared_records.clear()
+
+
+#: Global :class:`SharedRecordCache` instance, used by the retrievers.
+shared_records = SharedRecordCache()
+
+# Cached records reflect the contents of the cache directory.
+settings.on_update(_clear_shared_records, 'CACHE_DIR')
+
+
+class RecordCache(object):
+    """
+    Keep a limited number of parsed records in memory, so records used by
+    many variant descriptions (e.g., in a batch job) are parsed only once.
+
+    Records are modified while checking a variant description, so we hand
+    out copies of the cached records.
+    """
+    def __init__(self, size):
+        """
+        :arg int size: Maximum number of records to keep. Least recently used
+          records are discarded first.
+        """
+        self._size = size
+        self._records = collections.OrderedDict()
+
+    def loadrecord(self, retriever, identifier, genes=None):
+        """
+        Load a record with the given retriever, using the cached record if
+        we have it.
+
+        Only records loaded by their exact identifier are cached. This way,
+        the retriever still notifies about implicit version numbers (and
+        corrects the batch job entries).
+
+        Records loaded for a selection of genes are cached by selection. If
+        we have the complete record, the same selection is made on a copy of
+        it instead.
+
+        :arg Retriever retriever: The retriever to use if the record is not
+          cached.
+        :arg unicode identifier: The record identifier.
+        :arg genes: Select genes by name or by accession number (with version)
+          of one of their transcripts or proteins (see
+          :meth:`GenBankRetriever.loadrecord`).
+        :type genes: iterable(unicode)
+
+        :returns: A parsed record or `None` if no record could be found for
+          the given identifier.
+        :rtype: object
+        """
+        key = retriever.file_type, identifier, None
+        select = genes is not None and key in self._records
+        if genes is not None and not select:
+            key = retriever.file_type, identifier, tuple(sorted(genes))
+
+        try:
+            record = self._records.pop(key)
+        except KeyError:
+            if genes is None:
+                record = retriever.loadrecord(identifier)
+            else:
+                record = retriever.loadrecord(identifier, genes=genes)
+            if record is None or record.id != identifier or self._size < 1:
+                return record
+            self._records[key] = record
+            while len(self._records) > self._size:
+                self._records.popitem(last=False)
+        else:
+            self._records[key] = record
+
+        record = copy_record(record)
+        if select:
+            record.selectGenes(genes)
+        return record
@@ -17,28 +17,536 @@ Module used to add and manage the Batch Jobs.
 
 from __future__ import unicode_literals
 
+import collections
+import datetime
+import gzip
 import io
-import os                               # os.path.exists
+import itertools
+import math
+import os
+import Queue
+import re
 import smtplib                          # smtplib.STMP
+import socket
+import threading
+import time
 from email.mime.text import MIMEText    # MIMEText
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from sqlalchemy.orm.exc import NoResultFound
 
 from mutalyzer.config import settings
 from mutalyzer.db import queries, session
 from mutalyzer.db.models import Assembly, BatchJob, BatchQueueItem
 from mutalyzer import ncbi
+from mutalyzer import Retriever
 from mutalyzer import stats
 from mutalyzer import variantchecker
 from mutalyzer.grammar import Grammar
 from mutalyzer.output import Output
-from mutalyzer.mapping import Converter
+from mutalyzer.mapping import Converter, ConverterCache
 from mutalyzer import website
 
 
 __all__ = ["Scheduler"]
 
 
+# Header of the job result file for each job type.
+RESULT_HEADERS = {
+    'name-checker': ['Input',
+                     'Errors and warnings',
+                     'AccNo',
+                     'Genesymbol',
+                     'Variant',
+                     'Reference Sequence Start Descr.',
+                     'Coding DNA Descr.',
+                     'Protein Descr.',
+                     'GeneSymbol Coding DNA Descr.',
+                     'GeneSymbol Protein Descr.',
+                     'Genomic Reference',
+                     'Coding Reference',
+                     'Protein Reference',
+                     'Affected Transcripts',
+                     'Affected Proteins',
+                     'Restriction Sites Created',
+                     'Restriction Sites Deleted'],
+    'syntax-checker': ['Input', 'Status'],
+    'position-converter': ['Input Variant',
+                           'Errors',
+                           'Chromosomal Variant',
+                           'Coding Variant(s)'],
+    'snp-converter': ['Input Variant',
+                      'HGVS description(s)',
+                      'Errors and warnings']
+}
+
+
+class ResultWriter(object):
+    """
+    Writes results to the result file of a batch job.
+
+    The file is kept open while the job is processed and the header is
+    written only if the file is empty. Optionally (see the BATCH_RESULT_GZIP
+    setting), a gzip-compressed copy of the result file is written as well.
+
+    Results can be written by concurrent schedulers, so the caller must make
+    sure only one writer is used for a job at any time.
+    """
+    def __init__(self, batch_job):
+        """
+        @arg batch_job: The batch job
+        @type batch_job: BatchJob
+        """
+        self.filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR,
+                                                 batch_job.result_id)
+        self._header = "%s\n" % "\t".join(RESULT_HEADERS[batch_job.job_type])
+        self._handles = None
+    #__init__
+
+    def write(self, results):
+        """
+        Write results to the result file(s) and flush them.
+
+        @arg results: Result lines (including separators)
+        @type results: list(unicode)
+        """
+        if self._handles is None:
+            filenames = [self.filename]
+            if settings.BATCH_RESULT_GZIP:
+                filenames.append(self.filename + '.gz')
+            self._handles = [io.open(filename, mode='ab')
+                             for filename in filenames]
+
+        data = ''.join(results).encode('utf-8')
+
+        for handle in self._handles:
+            if os.fstat(handle.fileno()).st_size:
+                chunk = data
+            else:
+                chunk = self._header.encode('utf-8') + data
+            if handle.name.endswith('.gz'):
+                # We write a complete gzip member for each chunk, which
+                # together form a valid gzip file.
+                member = io.BytesIO()
+                compressed = gzip.GzipFile(fileobj=member, mode='wb')
+                compressed.write(chunk)
+                compressed.close()
+                chunk = member.getvalue()
+            handle.write(chunk)
+            handle.flush()
+    #write
+
+    def close(self):
+        """
+        Close the result file(s).
+        """
+        for handle in self._handles or []:
+            handle.close()
+        self._handles = None
+    #close
+#ResultWriter
+
+
+# Estimated processing time (in seconds) of an entry for each job type, not
+# including the retrieval and parsing of reference sequences.
+ITEM_COSTS = {
+    'name-checker': 0.2,
+    'syntax-checker': 0.002,
+    'position-converter': 0.05,
+    'snp-converter': 1.0
+}
+
+# Estimated time (in seconds) to retrieve a reference sequence that is not in
+# the cache, and to parse a cached reference sequence per megabyte of cache
+# file.
+REFERENCE_FETCH_COST = 5.0
+REFERENCE_PARSE_COST = 2.0
+
+# Maximum number of distinct references to look at when estimating the cost
+# of a name checker job.
+REFERENCE_ESTIMATE_LIMIT = 1000
+
+# Maximum number of results kept for identical entries in later jobs (see the
+# BATCH_DEDUPLICATE_WINDOW setting).
+RECENT_RESULTS_SIZE = 10000
+
+# Error codes for failures that might not happen again if the entry is
+# retried: retrieval and dbSNP communication errors, and unexpected errors.
+# Results with these errors are not reused for identical entries.
+TRANSIENT_ERRORS = ('ERETR', 'EENTREZ', 'EBATCHU')
+
+# Interval (in seconds) at which the job table of a scheduler is rebuilt from
+# the database.
+JOB_TABLE_REFRESH_INTERVAL = 60
+
+
+#: Batch job as kept in the job table of a scheduler. Unlike the database
+#: model instances, these stay usable across sessions.
+JobInfo = collections.namedtuple(
+    'JobInfo', ['id', 'email', 'job_type', 'argument', 'result_id',
+                'item_cost'])
+
+
+def _reference(item):
+    """
+    Reference of a batch entry (the part before the colon, without any
+    selector).
+
+    @arg item: Batch entry
+    @type item: unicode
+
+    @return: Reference
+    @rtype: unicode
+    """
+    return item.split(':', 1)[0].split('(', 1)[0].strip()
+#_reference
+
+
+def _item_cost(batch_job):
+    """
+    Estimated processing time (in seconds) of an entry of a batch job.
+
+    @arg batch_job: The batch job
+    @type batch_job: BatchJob or JobInfo
+
+    @return: Estimated processing time of an entry
+    @rtype: float
+    """
+    return batch_job.item_cost or ITEM_COSTS.get(batch_job.job_type, 1.0)
+#_item_cost
+
+
+def estimate_job(batch_job):
+    """
+    Estimate the time left until a job is finished.
+
+    The scheduling policy divides processing time equally over email
+    addresses, and the jobs of an email address are processed in order
+    of submission. So the job is finished after the remaining work of
+    the jobs before it from the same email address and of itself (its
+    own work), plus for every other email address the smallest of its
+    remaining work and our own work.
+
+    This assumes no new jobs are submitted and all processing is done by
+    one scheduler. It only reads the database, so it can be used without a
+    scheduler (e.g., by the webservices).
+
+    @arg batch_job: The batch job
+    @type batch_job: BatchJob
+
+    @return: Estimated time left (in seconds)
+    @rtype: float
+    """
+    left = dict(session.query(BatchQueueItem.batch_job_id,
+                              func.count(BatchQueueItem.id))
+                .filter(BatchQueueItem.result == None)
+                .group_by(BatchQueueItem.batch_job_id))
+
+    own = 0
+    work = collections.defaultdict(float)
+    for job in BatchJob.query.filter(BatchJob.id.in_(left)):
+        count = left[job.id]
+        if job.email == batch_job.email:
+            if job.id <= batch_job.id:
+                own += count * _item_cost(job)
+        else:
+            work[job.email] += count * _item_cost(job)
+
+    return own + sum(min(other, own) for other in work.values())
+#estimate_job
+
+
+class RoundRobinPolicy(object):
+    """
+    Scheduling policy that processes a block of entries (see the
+    BATCH_BLOCK_SIZES setting) from the oldest job of each email address in
+    turn.
+    """
+    def schedule(self, jobs):
+        """
+        Schedule the next round of processing.
+
+        @arg jobs: Unfinished jobs in order of submission
+        @type jobs: list(JobInfo)
+
+        @return: Jobs to process in this round, each with the maximum number
+            of entries to process
+        @rtype: list(tuple(JobInfo, int))
+        """
+        return [(job, settings.BATCH_BLOCK_SIZES.get(job.job_type, 1))
+                for job in self._oldest(jobs).values()]
+    #schedule
+
+    def processed(self, job, count):
+        """
+        Notify the policy that entries of a job were processed.
+
+        @arg job: The batch job
+        @type job: JobInfo
+        @arg count: Number of processed entries
+        @type count: int
+        """
+        pass
+    #processed
+
+    @staticmethod
+    def _oldest(jobs):
+        """
+        The oldest job for each email address.
+
+        @arg jobs: Jobs in order of submission
+        @type jobs: list(JobInfo)
+
+        @return: Oldest job by email address, in order of submission
+        @rtype: collections.OrderedDict
+        """
+        oldest = collections.OrderedDict()
+        for job in jobs:
+            oldest.setdefault(job.email, job)
+        return oldest
+    #_oldest
+#RoundRobinPolicy
+
+
+class DeficitRoundRobinPolicy(RoundRobinPolicy):
+    """
+    Scheduling policy that divides processing time equally over email
+    addresses using deficit round robin, where the cost of an entry is the
+    estimated processing time of an entry of its job.
+
+    Every round, each email address is credited a quantum of processing time
+    (see the BATCH_SCHEDULING_QUANTUM setting) and its oldest job may process
+    as many entries as its credit covers (but no more than a block, see the
+    BATCH_BLOCK_SIZES setting). This way, jobs with cheap entries (e.g.,
+    syntax checker jobs) are not held up by jobs with expensive entries.
+    """
+    def __init__(self):
+        self._deficits = {}
+    #__init__
+
+    def schedule(self, jobs):
+        """
+        Schedule the next round of processing.
+
+        @arg jobs: Unfinished jobs in order of submission
+        @type jobs: list(JobInfo)
+
+        @return: Jobs to process in this round, each with the maximum number
+            of entries to process
+        @rtype: list(tuple(JobInfo, int))
+        """
+        quantum = float(settings.BATCH_SCHEDULING_QUANTUM)
+        oldest = self._oldest(jobs)
+
+        # Email addresses without jobs lose their credit.
+        for email in list(self._deficits):
+            if email not in oldest:
+                del self._deficits[email]
+
+        for email in oldest:
+            self._deficits[email] = self._deficits.get(email, 0) + quantum
+
+        # Make sure at least one job can process an entry in this round by
+        # skipping rounds in which no job would be scheduled.
+        if oldest:
+            rounds = min(
+                max(0, math.ceil((_item_cost(job) - self._deficits[email]) /
+                                 quantum))
+                for email, job in oldest.items())
+            for email in oldest:
+                self._deficits[email] += rounds * quantum
+
+        schedule = []
+        for email, job in oldest.items():
+            count = min(int(self._deficits[email] / _item_cost(job)),
+                        settings.BATCH_BLOCK_SIZES.get(job.job_type, 1))
+            if count:
+                schedule.append((job, count))
+        return schedule
+    #schedule
+
+    def processed(self, job, count):
+        """
+        Notify the policy that entries of a job were processed.
+
+        @arg job: The batch job
+        @type job: JobInfo
+        @arg count: Number of processed entries
+        @type count: int
+        """
+        if job.email not in self._deficits:
+            return
+        # Credit that is not used in a round is only partly kept, so email
+        # addresses cannot save up credit while they have no entries to
+        # process (e.g., when they are leased by other schedulers).
+        deficit = self._deficits[job.email] - count * _item_cost(job)
+        self._deficits[job.email] = min(deficit,
+                                        settings.BATCH_SCHEDULING_QUANTUM)
+    #processed
+#DeficitRoundRobinPolicy
+
+
+#: Scheduling policies by name (see the BATCH_SCHEDULING_POLICY setting).
+SCHEDULING_POLICIES = {
+    'round-robin': RoundRobinPolicy,
+    'deficit-round-robin': DeficitRoundRobinPolicy
+}
+
+
+# References that are prefetched: LRG identifiers and GenBank accession
+# numbers with version. Entries without version are altered after their first
+# retrieval, chromosomal references are not retrieved from the NCBI by the
+# name checker, and UD references are slices made by us that cannot be
+# retrieved from the NCBI.
+PREFETCH_REFERENCE = re.compile(
+    r'^(LRG_\d+|(?!NC_|UD_)[A-Z]{1,2}_?\d+\.\d+)$')
+
+
+def _prefetch_reference(reference):
+    """
+    Make sure a reference is in the cache, retrieving it if needed.
+
+    @arg reference: LRG identifier or GenBank accession number with version
+    @type reference: unicode
+
+    @return: False if the reference could not be retrieved, True otherwise
+    @rtype: bool
+    """
+    O = Output(__file__)
+    if reference.startswith('LRG_'):
+        retriever = Retriever.LRGRetriever(O)
+    else:
+        retriever = Retriever.GenBankRetriever(O)
+
+    if retriever.cache_file(reference):
+        return True
+    return retriever.fetch(reference) is not None
+#_prefetch_reference
+
+
+class Prefetcher(object):
+    """
+    Retrieve references of batch job entries in a pool of background
+    threads, so they are in the cache when the entries are processed.
+
+    Failed retrievals are reported back and can be collected with the
+    {failed} method.
+    """
+    def __init__(self, size):
+        """
+        @arg size: Number of threads
+        @type size: int
+        """
+        self._size = size
+        self._tasks = Queue.Queue()
+        self._failed = Queue.Queue()
+        self._threads = []
+    #__init__
+
+    def add(self, job_id, references):
+        """
+        Queue references for retrieval.
+
+        @arg job_id: The ID of the batch job
+        @type job_id: int
+        @arg references: Pairs of reference and the ID of the first entry
+            using it
+        @type references: list(tuple(unicode, int))
+        """
+        for reference, item_id in references:
+            self._tasks.put((job_id, reference, item_id))
+
+        while len(self._threads) < self._size:
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+    #add
+
+    def failed(self):
+        """
+        Collect the references that could not be retrieved since the last
+        call.
+
+        @return: Job ID, reference, and ID of the first entry using it, for
+            each failed retrieval
+        @rtype: list(tuple(int, unicode, int))
+        """
+        failed = []
+        while True:
+            try:
+                failed.append(self._failed.get_nowait())
+            except Queue.Empty:
+                return failed
+    #failed
+
+    def discard(self, job_ids):
+        """
+        Discard the queued references of some jobs (e.g., finished jobs).
+
+        @arg job_ids: The IDs of the batch jobs
+        @type job_ids: set(int)
+        """
+        for task in self._drain():
+            if task[0] not in job_ids:
+                self._tasks.put(task)
+    #discard
+
+    def stop(self):
+        """
+        Discard the queued references and wait for the threads to finish
+        their current retrieval.
+
+        @return: The IDs of the jobs of which references were discarded
+        @rtype: set(int)
+        """
+        job_ids = set(task[0] for task in self._drain())
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return job_ids
+    #stop
+
+    def _drain(self):
+        """
+        Remove all queued tasks.
+
+        @return: The removed tasks
+        @rtype: list(tuple(int, unicode, int))
+        """
+        tasks = []
+        while True:
+            try:
+                tasks.append(self._tasks.get_nowait())
+            except Queue.Empty:
+                return tasks
+    #_drain
+
+    def _work(self):
+        """
+        Retrieve queued references until we get None.
+        """
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            job_id, reference, item_id = task
+            try:
+                retrieved = _prefetch_reference(reference)
+            except Exception:
+                # Not prefetched, the entries retrieve the reference as usual
+                # and report whatever went wrong.
+                retrieved = None
+            finally:
+                # Every thread has its own database session.
+                session.remove()
+            if retrieved is False:
+                self._failed.put(task)
+    #_work
+#Prefetcher
+
+
 class Scheduler() :
     """
     Special methods:
@@ -55,14 +563,31 @@ class Scheduler() :
         - Batch Position Converter
     """
 
-    def __init__(self) :
-        #TODO: documentation
+    def __init__(self, worker=None) :
         """
         Initialize the Scheduler, which requires a database connection.
 
-        @todo: documentation
+        @kwarg worker: Identifier for this scheduler, used to lease batch
+            queue items. Concurrent schedulers must use different identifiers.
+            Defaults to the hostname and process id.
+        @type worker: unicode
         """
         self.__run = True
+        self.__entriesUpdated = False
+        self.__transientError = False
+        self.__records = {}
+        self.__converters = {}
+        self.__writers = {}
+        self.__pending = {}
+        self.__jobs = collections.OrderedDict()
+        self.__recent = collections.OrderedDict()
+        self.__jobsRefreshed = None
+        self.__prefetcher = Prefetcher(settings.BATCH_PREFETCH_THREADS)
+        self.__prefetched = set()
+        self.__policy = SCHEDULING_POLICIES[
+            settings.BATCH_SCHEDULING_POLICY]()
+        self.__worker = worker or '%s:%d' % (socket.gethostname(),
+                                             os.getpid())
     #__init__
 
     def stop(self):
@@ -274,6 +799,7 @@ Mutalyzer batch scheduler""" % download_url)
                        % (type(ex).__name__, ex.args, old, new, flag, nselector))
             O.addMessage(__file__, 4, "ABATCHE", message)
         session.commit()
+        self.__entriesUpdated = True
     #__alterBatchEntries
 
     def __skipBatchEntries(self, jobID, flag, selector) :
@@ -300,6 +826,7 @@ Mutalyzer batch scheduler""" % download_url)
             .update({'flags': BatchQueueItem.flags + flag},
                     synchronize_session=False)
         session.commit()
+        self.__entriesUpdated = True
     #__skipBatchEntries
 
     def _updateDbFlags(self, O, jobID) :
@@ -359,26 +886,40 @@ Mutalyzer batch scheduler""" % download_url)
     def process(self):
         """
         Start the mutalyzer Batch Processing. This method retrieves all jobs
-        jobs from the database and processes them in a roundrobin fashion.
+        jobs from the database and processes them in rounds, scheduled by the
+        configured scheduling policy (see the BATCH_SCHEDULING_POLICY
+        setting).
         After each round, the process checks if new jobs are added during the
         last processing round and repeats. This continue until no jobs are
-        left to process.
+        left to process, or until all remaining items are being processed by
+        other schedulers.
 
         If during this process the {stop} method is called, the current
         job item is completed and we return.
 
         This method uses two database tables, BatchJob and BatchQueue.
 
-        The jobList is an array of tuples with three elements
-            - jobID       ;   The ID of the job
-            - jobType     ;   The type of the job
-            - argument1   ;   Currently only used for the ConversionChecker
+        Unfinished jobs are kept in a job table, which is updated with newly
+        submitted jobs before each round (and rebuilt from the database every
+        once in a while). A job is removed from the table once it is
+        finished. For each job in the table we keep:
+            - id          ;   The ID of the job
+            - email       ;   E-mail address of the submitter
+            - job_type    ;   The type of the job
+            - argument    ;   Currently only used for the ConversionChecker
                             to send the build version.
-
-        If the jobList is not empty, the method will iterate once over the
-        list and fetch the first entry of a job from the database table
-        BatchQueue. This request returns both the input for the batch and
-        the flags for the job.
+            - result_id   ;   Identifier for the job result
+            - item_cost   ;   Estimated processing time of an entry
+
+        In each round, the method will iterate once over the scheduled jobs
+        and lease a block of the first available entries of a job from
+        the database table BatchQueue. This request returns both the input
+        for the batch and the flags for the job. All entries in the block are
+        processed before continuing with the next job. Leased entries are not
+        handed out to other schedulers, so any number of schedulers can
+        process the same jobs concurrently. The result of an entry is stored
+        with the entry and results are written to the job result file in
+        input order.
 
         #Flags
         A job can be flagged in three ways:
@@ -401,53 +942,431 @@ Mutalyzer batch scheduler""" % download_url)
         refers to the reason of alteration / skip.
         """
         while not self.stopped():
-            # Group batch jobs by email address and retrieve the oldest for
-            # each address. This improves fairness when certain users have
-            # many jobs.
-            batch_jobs = BatchJob.query.filter(BatchJob.id.in_(
-                session.query(func.min(BatchJob.id)).group_by(BatchJob.email))
-            ).all()
-
-            if len(batch_jobs) == 0:
+            self.__refreshJobs()
+
+            if not self.__jobs:
                 break
 
-            for batch_job in batch_jobs:
+            # Forget parsed records, converter caches, and result writers of
+            # jobs that are finished.
+            for job_id in list(self.__records):
+                if job_id not in self.__jobs:
+                    del self.__records[job_id]
+            for job_id in list(self.__converters):
+                if job_id not in self.__jobs:
+                    del self.__converters[job_id]
+            for job_id in list(self.__writers):
+                if job_id not in self.__jobs:
+                    self.__writers.pop(job_id).close()
+            finished = self.__prefetched - set(self.__jobs)
+            if finished:
+                self.__prefetcher.discard(finished)
+                self.__prefetched -= finished
+
+            # Start retrieving the references of new jobs.
+            for batch_job in self.__jobs.values():
+                if batch_job.id not in self.__prefetched:
+                    self.__prefetched.add(batch_job.id)
+                    self.__startPrefetch(batch_job)
+
+            # If all remaining items are leased by other schedulers, there is
+            # nothing for us to do in this round.
+            busy = False
+
+            for batch_job, count in self.__policy.schedule(
+                    list(self.__jobs.values())):
                 if self.stopped():
                     break
 
-                batch_queue_item = queries.pop_batch_queue_item(batch_job)
-
-                if batch_queue_item is not None:
-                    item, flags = batch_queue_item
+                self.__skipPrefetchFailures()
+                count, processed = self.__processBlock(batch_job, count)
+                self.__policy.processed(batch_job, count)
+                if count:
+                    busy = True
+
+                # Results are kept in the database until we have enough of
+                # them or until we are out of entries to process for this
+                # job (it may be finished).
+                size, since = self.__pending.get(batch_job.id,
+                                                 (0, time.time()))
+                size += processed
+                if (not count or
+                        size >= settings.BATCH_RESULT_FLUSH_SIZE or
+                        time.time() - since >=
+                        settings.BATCH_RESULT_FLUSH_INTERVAL):
+                    self.__pending.pop(batch_job.id, None)
+                    if self.__flushResults(batch_job):
+                        busy = True
+                else:
+                    self.__pending[batch_job.id] = size, since
 
-                    if batch_job.job_type == 'name-checker':
-                        self._processNameBatch(batch_job, item, flags)
-                    elif batch_job.job_type == 'syntax-checker':
-                        self._processSyntaxCheck(batch_job, item, flags)
-                    elif batch_job.job_type == 'position-converter':
-                        self._processConversion(batch_job, item, flags)
-                    elif batch_job.job_type == 'snp-converter':
-                        self._processSNP(batch_job, item, flags)
-                    else:
-                        # Unknown job type, should never happen.
-                        # Todo: Log some screaming message.
-                        pass
+            if not busy:
+                break
 
-                else:
-                    print ('Job %s finished, email %s file %s' %
-                           (batch_job.id, batch_job.email, batch_job.result_id))
-                    self.__sendMail(batch_job.email, batch_job.result_id)
-                    session.delete(batch_job)
-                    session.commit()
+        # References of open jobs are still retrieved in the background
+        # until the next call, unless we are stopped. References that were
+        # not retrieved are queued again in the next call.
+        if self.stopped() or not self.__jobs:
+            self.__prefetched -= self.__prefetcher.stop()
     #process
 
-    def _processNameBatch(self, batch_job, cmd, flags):
+    def __startPrefetch(self, batch_job):
+        """
+        Queue the distinct references used by the entries of a name checker
+        job for retrieval in the background (see the BATCH_PREFETCH_THREADS
+        setting).
+
+        @arg batch_job: The batch job
+        @type batch_job: JobInfo
+        """
+        if (batch_job.job_type != 'name-checker' or
+                not settings.BATCH_PREFETCH_THREADS):
+            return
+
+        references = collections.OrderedDict()
+        items = session.query(BatchQueueItem.id, BatchQueueItem.item) \
+            .filter_by(batch_job_id=batch_job.id) \
+            .order_by(BatchQueueItem.id) \
+            .yield_per(settings.BATCH_INSERT_CHUNK_SIZE)
+        for item_id, item in items:
+            reference = _reference(item)
+            if (reference not in references and
+                    PREFETCH_REFERENCE.match(reference)):
+                references[reference] = item_id
+
+        self.__prefetcher.add(batch_job.id, references.items())
+    #__startPrefetch
+
+    def __skipPrefetchFailures(self):
+        """
+        Flag the entries using references that could not be retrieved by the
+        prefetcher to be skipped.
+
+        The first entry using the reference is not flagged. It will try to
+        retrieve the reference again and report the error, after which any
+        remaining entries are skipped as usual.
+        """
+        failed = self.__prefetcher.failed()
+
+        for job_id, reference, item_id in failed:
+            BatchQueueItem.query \
+                .filter_by(batch_job_id=job_id) \
+                .filter(or_(BatchQueueItem.item.startswith(reference + ':'),
+                            BatchQueueItem.item.startswith(reference + '(')),
+                        BatchQueueItem.id != item_id,
+                        ~BatchQueueItem.flags.contains('S')) \
+                .update({'flags': BatchQueueItem.flags + 'S1'},
+                        synchronize_session=False)
+
+        if failed:
+            session.commit()
+            self.__entriesUpdated = True
+    #__skipPrefetchFailures
+
+    def __refreshJobs(self):
+        """
+        Add jobs that were submitted since the last refresh to the job table.
+
+        Jobs can become visible out of order (their transactions are not
+        necessarily committed in order of their ids), so every once in a
+        while the job table is rebuilt from the database. This also removes
+        jobs that were finished by other schedulers.
+        """
+        batch_jobs = BatchJob.query.order_by(BatchJob.id)
+
+        if (self.__jobsRefreshed is None or
+                time.time() - self.__jobsRefreshed >=
+                JOB_TABLE_REFRESH_INTERVAL):
+            self.__removeAbandonedJobs()
+            self.__jobs.clear()
+            self.__jobsRefreshed = time.time()
+        elif self.__jobs:
+            batch_jobs = batch_jobs.filter(
+                BatchJob.id > next(reversed(self.__jobs)))
+
+        for batch_job in batch_jobs:
+            self.__jobs[batch_job.id] = JobInfo(
+                batch_job.id, batch_job.email, batch_job.job_type,
+                batch_job.argument, batch_job.result_id, batch_job.item_cost)
+    #__refreshJobs
+
+    def __removeAbandonedJobs(self):
+        """
+        Remove jobs of which the entries were still being added when the
+        submitting process died, including any results written so far.
+        """
+        for result_id in queries.remove_abandoned_batch_jobs():
+            for extension in ('', '.gz'):
+                try:
+                    os.unlink(os.path.join(
+                        settings.CACHE_DIR,
+                        'batch-job-%s.txt%s' % (result_id, extension)))
+                except OSError:
+                    pass
+    #__removeAbandonedJobs
+
+    def __processBlock(self, batch_job, count):
+        """
+        Lease a block of entries from a job and process them.
+
+        If the {stop} method is called, the current entry is completed and
+        the remaining entries in the block are released.
+
+        The leases on the block are renewed between entries once half of the
+        lease duration (see the BATCH_LEASE_DURATION setting) has passed, so
+        they don't expire while we are still working on the block.
+
+        @arg batch_job: The batch job
+        @type batch_job: JobInfo
+        @arg count: Maximum number of entries to process
+        @type count: int
+
+        @return: Number of processed entries and the total length of their
+            results.
+        @rtype: tuple(int, int)
+        """
+        buffer = collections.deque(queries.lease_batch_queue_items(
+            batch_job, self.__worker, count))
+
+        if not buffer:
+            return 0, 0
+
+        item_ids = [item_id for item_id, _, _ in buffer]
+        renew_interval = settings.BATCH_LEASE_DURATION / 2.0
+        renew_at = time.time() + renew_interval
+
+        if batch_job.job_type == 'name-checker':
+            buffer = self.__groupEntries(buffer)
+        elif batch_job.job_type == 'snp-converter':
+            # Retrieve the dbSNP records for the entire block in a few
+            # requests instead of one request per entry.
+            ncbi.prefetch_rsid_descriptions(
+                [item for _, item, flags in buffer
+                 if not (flags and 'S' in flags)])
+
+        results = []
+
+        # Results (without separator) by input and flags (without
+        # continuation flags), so identical entries are processed only once.
+        computed = collections.OrderedDict()
+
+        while buffer and not self.stopped():
+            if time.time() >= renew_at:
+                queries.renew_batch_queue_items(self.__worker, item_ids)
+                renew_at = time.time() + renew_interval
+
+            if self.__entriesUpdated:
+                # Entries in our buffer may have been altered or flagged to
+                # be skipped by the previous entry.
+                buffer = collections.deque(queries.get_batch_queue_items(
+                    [item_id for item_id, _, _ in buffer]))
+                if batch_job.job_type == 'name-checker':
+                    buffer = self.__groupEntries(buffer)
+                self.__entriesUpdated = False
+
+            item_id, item, flags = buffer.popleft()
+
+            key = item, (flags or '').replace('C0', '')
+            if flags and 'C' in flags:
+                separator = '\t'
+            else:
+                separator = '\n'
+
+            if key not in computed:
+                recent = self.__recentResult(batch_job, key)
+                if recent is not None:
+                    computed[key] = recent
+
+            if key in computed:
+                results.append((item_id, computed[key] + separator))
+                continue
+
+            self.__transientError = False
+            if batch_job.job_type == 'name-checker':
+                result = self._processNameBatch(batch_job, item, flags)
+            elif batch_job.job_type == 'syntax-checker':
+                result = self._processSyntaxCheck(batch_job, item, flags)
+            elif batch_job.job_type == 'position-converter':
+                result = self._processConversion(batch_job, item, flags)
+            elif batch_job.job_type == 'snp-converter':
+                result = self._processSNP(batch_job, item, flags)
+            else:
+                # Unknown job type, should never happen.
+                # Todo: Log some screaming message.
+                result = ''
+
+            # Results of failures that might not happen on a retry are not
+            # reused for identical entries.
+            if result.endswith(separator) and not self.__transientError:
+                computed[key] = result[:-len(separator)]
+                self.__storeRecentResult(batch_job, key, computed[key])
+
+            results.append((item_id, result))
+
+        queries.complete_batch_queue_items(self.__worker, results)
+
+        # Identical entries elsewhere in the job get the same result.
+        queries.fan_out_batch_results(
+            batch_job, self.__worker,
+            [(item, flags, result)
+             for (item, flags), result in computed.items()])
+        queries.release_batch_queue_items(
+            self.__worker, [item_id for item_id, _, _ in buffer])
+
+        return len(results), sum(len(result) for _, result in results)
+    #__processBlock
+
+    def __recentResult(self, batch_job, key):
+        """
+        Get the result of an identical entry in a recent job (see the
+        BATCH_DEDUPLICATE_WINDOW setting).
+
+        @arg batch_job: The batch job
+        @type batch_job: JobInfo
+        @arg key: Input and flags (without continuation flags) of the entry
+        @type key: tuple(unicode, unicode)
+
+        @return: Result (without separator), or None if there is no recent
+            identical entry.
+        @rtype: unicode
+        """
+        if not settings.BATCH_DEDUPLICATE_WINDOW:
+            return None
+
+        # Forget results that are too old.
+        expired = time.time() - settings.BATCH_DEDUPLICATE_WINDOW
+        while self.__recent:
+            oldest = next(iter(self.__recent))
+            if self.__recent[oldest][0] >= expired:
+                break
+            del self.__recent[oldest]
+
+        recent = self.__recent.get(
+            (batch_job.job_type, batch_job.argument) + key)
+        if recent is None:
+            return None
+        return recent[1]
+    #__recentResult
+
+    def __storeRecentResult(self, batch_job, key, result):
+        """
+        Store the result of an entry for identical entries in later jobs (see
+        the BATCH_DEDUPLICATE_WINDOW setting).
+
+        @arg batch_job: The batch job
+        @type batch_job: JobInfo
+        @arg key: Input and flags (without continuation flags) of the entry
+        @type key: tuple(unicode, unicode)
+        @arg result: Result (without separator)
+        @type result: unicode
+        """
+        if not settings.BATCH_DEDUPLICATE_WINDOW:
+            return
+
+        key = (batch_job.job_type, batch_job.argument) + key
+        self.__recent.pop(key, None)
+        self.__recent[key] = time.time(), result
+        while len(self.__recent) > RECENT_RESULTS_SIZE:
+            self.__recent.popitem(last=False)
+    #__storeRecentResult
+
+    def __checkTransientErrors(self, O):
         """
-        Process an entry from the Name Batch, write the results
-        to the job-file. If an Exception is raised, catch and continue.
+        Note if the processing of the current entry failed with an error that
+        might not happen again if the entry is retried (see
+        TRANSIENT_ERRORS), so its result is not reused for identical entries.
+
+        @arg O: Output object of the entry
+        @type O: Output
+        """
+        for code in TRANSIENT_ERRORS:
+            if any(message.level >= 3
+                   for message in O.getMessagesWithErrorCode(code)):
+                self.__transientError = True
+    #__checkTransientErrors
+
+    @staticmethod
+    def __groupEntries(entries):
+        """
+        Group entries by their reference (the part before the colon, without
+        any selector), so consecutive entries can use the same parsed record.
+        Groups are ordered by their first entry and the order within a group
+        is preserved.
+
+        Since entries are only ever altered or skipped based on their
+        reference, this does not change the outcome of processing them. The
+        results are still written in input order.
+
+        @arg entries: Entries as tuples (id, item, flags)
+        @type entries: iterable
+
+        @return: Grouped entries
+        @rtype: collections.deque
+        """
+        groups = collections.OrderedDict()
+        for entry in entries:
+            groups.setdefault(_reference(entry[1]), []).append(entry)
+        return collections.deque(entry for group in groups.values()
+                                 for entry in group)
+    #__groupEntries
+
+    def __flushResults(self, batch_job):
+        """
+        Write the results of the completed entries at the start of a job to
+        the job result file and finish the job if no entries are left. The
+        job result file is kept open until the job is finished.
+
+        Entries can be completed out of order by concurrent schedulers, so
+        results are only written up to the first entry that is not yet
+        completed.
 
         Side-effect:
             - Output written to outputfile.
+            - Finished jobs are removed from the database and the job table.
+
+        @arg batch_job: The batch job
+        @type batch_job: JobInfo
+
+        @return: True if the job was finished, False otherwise.
+        @rtype: bool
+        """
+        popped = queries.pop_batch_results(batch_job)
+
+        if popped is None:
+            # The job was finished by another scheduler.
+            session.commit()
+            self.__jobs.pop(batch_job.id, None)
+            return False
+
+        results, finished = popped
+
+        if results:
+            if batch_job.id not in self.__writers:
+                self.__writers[batch_job.id] = ResultWriter(batch_job)
+            self.__writers[batch_job.id].write(results)
+
+        if finished:
+            if batch_job.id in self.__writers:
+                self.__writers.pop(batch_job.id).close()
+            print ('Job %s finished, email %s file %s' %
+                   (batch_job.id, batch_job.email, batch_job.result_id))
+            BatchJob.query.filter_by(id=batch_job.id).delete()
+            self.__jobs.pop(batch_job.id, None)
+
+        # Only commit after the results are written, so they are not lost if
+        # we crash in between.
+        session.commit()
+
+        if finished:
+            self.__sendMail(batch_job.email, batch_job.result_id)
+
+        return finished
+    #__flushResults
+
+    def _processNameBatch(self, batch_job, cmd, flags):
+        """
+        Process an entry from the Name Batch and return the result line
+        for the job-file. If an Exception is raised, catch and continue.
 
         @arg cmd: The NameChecker input
         @type cmd:
@@ -455,6 +1374,9 @@ Mutalyzer batch scheduler""" % download_url)
         @type i:
         @arg flags: Flags of the current entry
         @type flags:
+
+        @return: Result line (including separator)
+        @rtype: unicode
         """
         O = Output(__file__)
         O.addMessage(__file__, -1, "INFO",
@@ -466,9 +1388,15 @@ Mutalyzer batch scheduler""" % download_url)
         skip = self.__processFlags(O, flags)
 
         if not skip :
+            # Parsed records are kept for the duration of the job.
+            if batch_job.id not in self.__records:
+                self.__records[batch_job.id] = Retriever.RecordCache(
+                    settings.BATCH_RECORD_CACHE_SIZE)
+
             #Run mutalyzer and get values from Output Object 'O'
             try :
-                variantchecker.check_variant(cmd, O)
+                variantchecker.check_variant(
+                    cmd, O, records=self.__records[batch_job.id])
             except Exception:
                 #Catch all exceptions related to the processing of cmd
                 O.addMessage(__file__, 4, "EBATCHU",
@@ -490,6 +1418,7 @@ Mutalyzer batch scheduler""" % download_url)
                 self._updateDbFlags(O, batch_job.id)
         #if
 
+        self.__checkTransientErrors(O)
         batchOutput = O.getOutput("batchDone")
 
         outputline =  "%s\t" % cmd
@@ -498,53 +1427,20 @@ Mutalyzer batch scheduler""" % download_url)
         if batchOutput :
             outputline += batchOutput[0]
 
-        #Output
-        filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR, batch_job.result_id)
-        if not os.path.exists(filename) :
-            # If the file does not yet exist, create it with the correct
-            # header above it. The header is read from the config file as
-            # a list. We need a tab delimited string.
-            header = ['Input',
-                      'Errors and warnings',
-                      'AccNo',
-                      'Genesymbol',
-                      'Variant',
-                      'Reference Sequence Start Descr.',
-                      'Coding DNA Descr.',
-                      'Protein Descr.',
-                      'GeneSymbol Coding DNA Descr.',
-                      'GeneSymbol Protein Descr.',
-                      'Genomic Reference',
-                      'Coding Reference',
-                      'Protein Reference',
-                      'Affected Transcripts',
-                      'Affected Proteins',
-                      'Restriction Sites Created',
-                      'Restriction Sites Deleted']
-            handle = io.open(filename, mode='a', encoding='utf-8')
-            handle.write("%s\n" % "\t".join(header))
-        #if
-        else :
-            handle = io.open(filename, mode='a', encoding='utf-8')
-
         if flags and 'C' in flags:
             separator = '\t'
         else:
             separator = '\n'
 
-        handle.write("%s%s" % (outputline, separator))
-        handle.close()
         O.addMessage(__file__, -1, "INFO",
             "Finished NameChecker batchvariant " + cmd)
+        return "%s%s" % (outputline, separator)
     #_processNameBatch
 
     def _processSyntaxCheck(self, batch_job, cmd, flags):
         """
-        Process an entry from the Syntax Check, write the results
-        to the job-file.
-
-        Side-effect:
-            - Output written to outputfile
+        Process an entry from the Syntax Check and return the result line
+        for the job-file.
 
         @arg cmd:   The Syntax Checker input
         @type cmd:
@@ -552,6 +1448,9 @@ Mutalyzer batch scheduler""" % download_url)
         @type i:
         @arg flags: Flags of the current entry
         @type flags:
+
+        @return: Result line (including separator)
+        @rtype: unicode
         """
         output = Output(__file__)
         grammar = Grammar(output)
@@ -573,39 +1472,22 @@ Mutalyzer batch scheduler""" % download_url)
         else :
             result = "|".join(output.getBatchMessages(2))
 
-        #Output
-        filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR, batch_job.result_id)
-        if not os.path.exists(filename) :
-            # If the file does not yet exist, create it with the correct
-            # header above it. The header is read from the config file as
-            # a list. We need a tab delimited string.
-            header = ['Input', 'Status']
-            handle = io.open(filename, mode='a', encoding='utf-8')
-            handle.write("%s\n" % "\t".join(header))
-        #if
-        else :
-            handle = io.open(filename, mode='a', encoding='utf-8')
-
         if flags and 'C' in flags:
             separator = '\t'
         else:
             separator = '\n'
 
-        handle.write("%s\t%s%s" % (cmd, result, separator))
-        handle.close()
         output.addMessage(__file__, -1, "INFO",
                           "Finished SyntaxChecker batchvariant " + cmd)
+        return "%s\t%s%s" % (cmd, result, separator)
     #_processSyntaxCheck
 
     def _processConversion(self, batch_job, cmd, flags):
         """
-        Process an entry from the Position Converter, write the results
-        to the job-file. The Position Converter is wrapped in a try except
-        block which ensures that he Batch Process keeps running. Errors
-        are caught and the user will be notified.
-
-        Side-effect:
-            - Output written to outputfile.
+        Process an entry from the Position Converter and return the result
+        line for the job-file. The Position Converter is wrapped in a try
+        except block which ensures that he Batch Process keeps running.
+        Errors are caught and the user will be notified.
 
         @arg cmd: The Syntax Checker input
         @type cmd: unicode
@@ -615,6 +1497,9 @@ Mutalyzer batch scheduler""" % download_url)
         @type build: unicode
         @arg flags: Flags of the current entry
         @type flags:
+
+        @return: Result line (including separator)
+        @rtype: unicode
         """
         O = Output(__file__)
         variant = cmd
@@ -631,14 +1516,26 @@ Mutalyzer batch scheduler""" % download_url)
         if not skip :
             try :
                 #process
-                try:
-                    assembly = Assembly.by_name_or_alias(batch_job.argument)
-                except NoResultFound:
+                # The assembly, its chromosomes, and transcript mappings are
+                # looked up once for the duration of the job.
+                if batch_job.id not in self.__converters:
+                    try:
+                        assembly = Assembly.by_name_or_alias(
+                            batch_job.argument)
+                    except NoResultFound:
+                        cache = None
+                    else:
+                        cache = ConverterCache(
+                            assembly, settings.BATCH_CONVERTER_CACHE_SIZE)
+                    self.__converters[batch_job.id] = cache
+
+                cache = self.__converters[batch_job.id]
+                if cache is None:
                     O.addMessage(__file__, 3, 'ENOASSEMBLY',
                                  'Not a valid assembly: ' + batch_job.argument)
-                    raise
+                    raise NoResultFound()
 
-                converter = Converter(assembly, O)
+                converter = Converter(cache.assembly, O, cache=cache)
 
                 #Also accept chr accNo
                 variant = converter.correctChrVariant(variant)
@@ -680,43 +1577,25 @@ Mutalyzer batch scheduler""" % download_url)
             #except
         #if
 
+        self.__checkTransientErrors(O)
         error = "%s" % "|".join(O.getBatchMessages(2))
 
-        #Output
-        filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR, batch_job.result_id)
-        if not os.path.exists(filename) :
-            # If the file does not yet exist, create it with the correct
-            # header above it. The header is read from the config file as
-            # a list. We need a tab delimited string.
-            header = ['Input Variant',
-                      'Errors',
-                      'Chromosomal Variant',
-                      'Coding Variant(s)']
-            handle = io.open(filename, mode='a', encoding='utf-8')
-            handle.write("%s\n" % "\t".join(header))
-        #if
-        else :
-            handle = io.open(filename, mode='a', encoding='utf-8')
-
         if flags and 'C' in flags:
             separator = '\t'
         else:
             separator = '\n'
 
-        handle.write("%s\t%s\t%s\t%s%s" % (cmd, error, gName, "\t".join(cNames), separator))
-        handle.close()
         O.addMessage(__file__, -1, "INFO",
             "Finisehd PositionConverter batchvariant " + cmd)
+        return "%s\t%s\t%s\t%s%s" % (cmd, error, gName, "\t".join(cNames),
+                                    separator)
     #_processConversion
 
 
     def _processSNP(self, batch_job, cmd, flags):
         """
-        Process an entry from the SNP converter Batch, write the results
-        to the job-file. If an Exception is raised, catch and continue.
-
-        Side-effect:
-            - Output written to outputfile.
+        Process an entry from the SNP converter Batch and return the result
+        line for the job-file. If an Exception is raised, catch and continue.
 
         @arg cmd: The SNP converter input
         @type cmd:
@@ -724,6 +1603,9 @@ Mutalyzer batch scheduler""" % download_url)
         @type i:
         @arg flags: Flags of the current entry
         @type flags:
+
+        @return: Result line (including separator)
+        @rtype: unicode
         """
         O = Output(__file__)
         O.addMessage(__file__, -1, "INFO",
@@ -738,36 +1620,21 @@ Mutalyzer batch scheduler""" % download_url)
         descriptions = []
         if not skip:
             descriptions = ncbi.rsid_to_descriptions(cmd, O)
+            self.__checkTransientErrors(O)
 
         # Todo: Is output ok?
         outputline =  "%s\t" % cmd
         outputline += "%s\t" % "|".join(descriptions)
         outputline += "%s\t" % "|".join(O.getBatchMessages(2))
 
-        #Output
-        filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR, batch_job.result_id)
-        if not os.path.exists(filename) :
-            # If the file does not yet exist, create it with the correct
-            # header above it. The header is read from the config file as
-            # a list. We need a tab delimited string.
-            header = ['Input Variant',
-                      'HGVS description(s)',
-                      'Errors and warnings']
-            handle = io.open(filename, mode='a', encoding='utf-8')
-            handle.write("%s\n" % "\t".join(header))
-        #if
-        else :
-            handle = io.open(filename, mode='a', encoding='utf-8')
-
         if flags and 'C' in flags:
             separator = '\t'
         else:
             separator = '\n'
 
-        handle.write("%s%s" % (outputline, separator))
-        handle.close()
         O.addMessage(__file__, -1, "INFO",
                      "Finished SNP converter batch rs%s" % cmd)
+        return "%s%s" % (outputline, separator)
     #_processSNP
 
     def addJob(self, email, queue, columns, job_type, argument=None):
@@ -776,8 +1643,8 @@ Mutalyzer batch scheduler""" % download_url)
 
         @arg email:         e-mail address of batch supplier
         @type email:        unicode
-        @arg queue:         A list of jobs
-        @type queue:        list
+        @arg queue:         Entries of the job
+        @type queue:        iterable
         @arg columns:       The number of columns.
         @type columns:      int
         @arg job_type:       The type of Batch Job that should be run
@@ -788,10 +1655,65 @@ Mutalyzer batch scheduler""" % download_url)
         @return: result_id
         @rtype:
         """
-        # Add jobs to the database
-        batch_job = BatchJob(job_type, email=email, argument=argument)
+        # The job is committed together with the first chunk of entries, so
+        # it can be processed while the remaining entries are added. Until
+        # all entries are added, the job is marked as loading so it will not
+        # be finished prematurely. The loading deadline is renewed with every
+        # chunk, if we are killed the job is removed after the deadline (see
+        # __refreshJobs).
+        rows = self.__queueRows(queue, columns)
+        chunk = list(itertools.islice(rows, settings.BATCH_INSERT_CHUNK_SIZE))
+
+        batch_job = BatchJob(job_type, email=email, argument=argument,
+                             item_cost=self.__estimateItemCost(job_type,
+                                                               chunk))
+        batch_job.loading = True
         session.add(batch_job)
+        session.flush()
+        job_id, result_id = batch_job.id, batch_job.result_id
+
+        try:
+            while chunk:
+                for row in chunk:
+                    row['batch_job_id'] = job_id
+                if not BatchJob.query.filter_by(id=job_id).update(
+                        {'loading_expires': datetime.datetime.now() +
+                         datetime.timedelta(
+                             seconds=settings.BATCH_LOADING_TIMEOUT)}):
+                    raise Exception('Batch job %d was removed while its '
+                                    'entries were added' % job_id)
+                session.execute(BatchQueueItem.__table__.insert(), chunk)
+                session.commit()
+                chunk = list(itertools.islice(
+                    rows, settings.BATCH_INSERT_CHUNK_SIZE))
+        except Exception:
+            # Don't leave a partial job behind.
+            session.rollback()
+            BatchQueueItem.query.filter_by(batch_job_id=job_id).delete()
+            BatchJob.query.filter_by(id=job_id).delete()
+            session.commit()
+            raise
+
+        BatchJob.query.filter_by(id=job_id).update({'loading': False,
+                                                    'loading_expires': None})
+        session.commit()
+        return result_id
+    #addJob
+
+    @staticmethod
+    def __queueRows(queue, columns):
+        """
+        Sanitise and flag the entries of a new job.
+
+        @arg queue: Entries of the job
+        @type queue: iterable
+        @arg columns: The number of columns.
+        @type columns: int
 
+        @return: Batch queue item rows (without job id) as dictionaries with
+            keys 'item' and 'flags'
+        @rtype: generator(dict)
+        """
         for i, inputl in enumerate(queue):
             # NOTE:
             # This is a very dirty way to skip entries before they are fed
@@ -815,10 +1737,60 @@ Mutalyzer batch scheduler""" % download_url)
                 # Add flag for continuing the current row
                 flag = '%s%s' % (flag if flag else '', 'C0')
 
-            item = BatchQueueItem(batch_job, inputl, flags=flag)
-            session.add(item)
+            yield {'item': inputl, 'flags': flag or ''}
+    #__queueRows
 
-        session.commit()
-        return batch_job.result_id
-    #addJob
+    def __estimateItemCost(self, job_type, rows):
+        """
+        Estimate the processing time of an entry of a new job. This is used
+        by the scheduling policy and to estimate when a job is finished.
+
+        For name checker jobs, the cost of retrieving and parsing the
+        references is included. This is based on the distinct references in
+        the given (first) entries of the job and the size of their cache
+        files.
+
+        @arg job_type: The type of the job
+        @type job_type: unicode
+        @arg rows: Batch queue item rows (see {__queueRows})
+        @type rows: list(dict)
+
+        @return: Estimated processing time (in seconds) of an entry
+        @rtype: float
+        """
+        cost = ITEM_COSTS.get(job_type, 1.0)
+
+        if job_type != 'name-checker' or not rows:
+            return cost
+
+        O = Output(__file__)
+        retrievers = {'genbank': Retriever.GenBankRetriever(O),
+                      'lrg': Retriever.LRGRetriever(O)}
+
+        references = set()
+        reference_cost = 0
+        for row in rows:
+            if 'S' in row['flags']:
+                continue
+            reference = _reference(row['item'])
+            if reference in references:
+                continue
+            references.add(reference)
+            if len(references) > REFERENCE_ESTIMATE_LIMIT:
+                break
+            if reference.startswith('LRG_'):
+                retriever = retrievers['lrg']
+            else:
+                retriever = retrievers['genbank']
+            filename = retriever.cache_file(reference)
+            if filename is None:
+                reference_cost += REFERENCE_FETCH_COST
+            else:
+                reference_cost += (REFERENCE_PARSE_COST *
+                                   os.path.getsize(filename) / 1024.0 ** 2)
+
+        # The entries after the last reference we looked at are assumed to
+        # use the references we have seen.
+        return cost + reference_cost / len(rows)
+    #__estimateItemCost
 #Scheduler
@@ -0,0 +1,355 @@
+"""
+Management of the cache directory.
+
+The cache directory (`CACHE_DIR` setting) contains reference files, parsed
+records and batch job results. If the reference files and parsed records
+together with everything else exceed `CACHE_SIZE` bytes, the least recently
+used of them are removed until we are back at `EVICTION_TARGET` of that size.
+
+Removed reference files are retrieved again when needed, using the
+information on their source in the database (see
+:meth:`mutalyzer.Retriever.GenBankRetriever.loadrecord`). We therefore only
+remove reference files we have a database entry for, and never those that
+were uploaded (they cannot be retrieved again). Parsed records can always be
+removed, the reference file is just parsed again.
+
+The modification time of a file is used as its last access time, since most
+filesystems are mounted without (strict) access time updates. Accessing a
+cached file should therefore be reported with :func:`touch`, and writing a
+new file with :func:`add`.
+
+If the files that cannot be removed already exceed `CACHE_SIZE`, a warning
+is logged and we evict again only after `SCAN_INTERVAL` or after another
+`1 - EVICTION_TARGET` of `CACHE_SIZE` was written, instead of on every
+write.
+
+Lock files in the `locks` subdirectory of the cache directory (see
+:meth:`mutalyzer.Retriever.Retriever._single_flight`) that are not in use are
+removed on every eviction.
+
+Reference files found in the cache (hits) and reference files that had to
+be retrieved (misses) are counted by :mod:`mutalyzer.Retriever` in
+:mod:`mutalyzer.stats` as `cache/hit` and `cache/miss`. Evictions are counted
+here as `cache/eviction` (and `cache/eviction-bytes` for the number of
+bytes).
+"""
+
+
+from __future__ import unicode_literals
+
+import collections
+import errno
+import fcntl
+import os
+import re
+import threading
+import time
+
+from mutalyzer import compression
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer.db.models import Reference
+from mutalyzer.output import Output
+from mutalyzer import stats
+
+
+#: Fraction of `CACHE_SIZE` we evict down to, so we don't have to evict
+#: again on every write after the cache is full.
+EVICTION_TARGET = 0.9
+
+#: Scan the cache directory at least this often (in seconds) when files are
+#: added, to account for files added by other processes.
+SCAN_INTERVAL = 10 * 60
+
+#: Number of accession numbers to look up in one database query.
+SCAN_QUERY_SIZE = 500
+
+# Reference files are named `<accession>.<type><extension>` (see
+# :mod:`mutalyzer.compression`), parsed records `<checksum>.<type>.record`
+# with their raw sequence `<checksum>.<type>.seq`, and batch job results
+# `batch-job-<id>.txt` (optionally gzipped).
+REFERENCE_FILE = re.compile(
+    r'^(?P<accession>[^/]+)\.(gb|xml)(%s)$'
+    % '|'.join(re.escape(codec.extension)
+               for codec in compression.CODECS.values()))
+PARSED_RECORD_FILE = re.compile(r'^[0-9a-f]{32}\.(gb|xml)\.(record|seq)$')
+BATCH_RESULT_FILE = re.compile(r'^batch-job-[^/]+\.txt(\.gz)?$')
+
+
+#: Cache file entry.
+CacheFile = collections.namedtuple(
+    'CacheFile', ['name', 'path', 'size', 'accessed', 'category'])
+
+
+class _Accounting(object):
+    """
+    Bytes written to the cache directory by this process since the last
+    scan.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.size = None
+        self.scanned = 0
+        # Size at which we evict, higher than `CACHE_SIZE` if the last
+        # eviction could not get below it.
+        self.limit = None
+
+
+_accounting = _Accounting()
+
+
+def _reset_accounting(cache_dir):
+    """
+    Forget about the cache directory after it changed.
+    """
+    with _accounting.lock:
+        _accounting.size = None
+        _accounting.scanned = 0
+        _accounting.limit = None
+
+
+settings.on_update(_reset_accounting, 'CACHE_DIR')
+settings.on_update(_reset_accounting, 'CACHE_SIZE')
+
+
+def touch(filename):
+    """
+    Mark a file in the cache as used.
+
+    :arg unicode filename: Full path to the file.
+    """
+    try:
+        os.utime(filename, None)
+    except OSError:
+        # The file was just removed, it will be retrieved again next time.
+        pass
+
+
+def add(filename):
+    """
+    Account for a new file in the cache. This may remove other files from
+    the cache (see :func:`evict`).
+
+    :arg unicode filename: Full path to the file.
+    """
+    if settings.CACHE_SIZE is None:
+        return
+
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        return
+
+    with _accounting.lock:
+        if _accounting.size is not None:
+            _accounting.size += size
+        full = (_accounting.size is None or
+                _accounting.size > (_accounting.limit or
+                                    settings.CACHE_SIZE) or
+                time.time() - _accounting.scanned > SCAN_INTERVAL)
+
+    if full:
+        evict()
+
+
+def scan():
+    """
+    List the files in the cache directory.
+
+    Reference files are categorized by the source of the reference (see
+    :attr:`mutalyzer.db.models.Reference.source`), or `unknown` if it has no
+    database entry. Other categories are `parsed`, `batch-result`, and
+    `other`.
+
+    :returns: The files in the cache directory.
+    :rtype: list(CacheFile)
+    """
+    try:
+        names = os.listdir(settings.CACHE_DIR)
+    except OSError:
+        return []
+
+    files = []
+    accessions = {}
+    for name in names:
+        path = os.path.join(settings.CACHE_DIR, name)
+        try:
+            info = os.stat(path)
+        except OSError:
+            continue
+        if not os.path.isfile(path):
+            continue
+
+        match = REFERENCE_FILE.match(name)
+        if match:
+            accessions[name] = match.group('accession')
+            category = None
+        elif PARSED_RECORD_FILE.match(name):
+            category = 'parsed'
+        elif BATCH_RESULT_FILE.match(name):
+            category = 'batch-result'
+        else:
+            category = 'other'
+
+        files.append(CacheFile(name, path, info.st_size, info.st_mtime,
+                               category))
+
+    sources = {}
+    unique = sorted(set(accessions.values()))
+    for i in range(0, len(unique), SCAN_QUERY_SIZE):
+        sources.update(session.query(Reference.accession, Reference.source)
+                       .filter(Reference.accession.in_(
+                           unique[i:i + SCAN_QUERY_SIZE])))
+
+    return [f._replace(category=sources.get(accessions[f.name], 'unknown'))
+            if f.category is None else f
+            for f in files]
+
+
+def _evictable(cache_file):
+    """
+    Whether a file can be removed from the cache.
+    """
+    return cache_file.category not in ('upload', 'unknown', 'batch-result',
+                                       'other')
+
+
+def evict():
+    """
+    Remove the least recently used reference files and parsed records from
+    the cache if its total size exceeds `CACHE_SIZE`.
+
+    Only one process at a time evicts, if another process is already doing
+    this we return immediately.
+
+    :returns: Number of files removed.
+    :rtype: int
+    """
+    if settings.CACHE_SIZE is None:
+        return 0
+
+    lock_dir = os.path.join(settings.CACHE_DIR, 'locks')
+    if not os.path.isdir(lock_dir):
+        try:
+            os.mkdir(lock_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    with open(os.path.join(lock_dir, 'evict.lock'), 'a') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return 0
+
+        _remove_locks(lock_dir)
+
+        files = scan()
+        size = sum(f.size for f in files)
+        evicted = 0
+
+        if size > settings.CACHE_SIZE:
+            target = settings.CACHE_SIZE * EVICTION_TARGET
+            for cache_file in sorted(filter(_evictable, files),
+                                     key=lambda f: f.accessed):
+                if size <= target:
+                    break
+                try:
+                    os.unlink(cache_file.path)
+                except OSError:
+                    continue
+                size -= cache_file.size
+                evicted += 1
+                stats.increment_counter('cache/eviction')
+                stats.increment_counter('cache/eviction-bytes',
+                                        amount=cache_file.size)
+
+        if size > settings.CACHE_SIZE:
+            # Only files that cannot be removed are left. We allow for the
+            # same amount of writes as after a successful eviction before
+            # scanning again.
+            limit = size + settings.CACHE_SIZE * (1 - EVICTION_TARGET)
+            Output(__file__).addMessage(
+                __file__, -1, 'WCACHESIZE',
+                'Cache size of %d bytes exceeds CACHE_SIZE with files that '
+                'cannot be removed.' % size)
+        else:
+            limit = settings.CACHE_SIZE
+
+        with _accounting.lock:
+            _accounting.size = size
+            _accounting.scanned = time.time()
+            _accounting.limit = limit
+
+    return evicted
+
+
+def _remove_locks(lock_dir):
+    """
+    Remove lock files that are not in use from the lock directory.
+
+    Lock files for retrievals are created per record and never removed
+    after use. A process that opened a lock file we remove notices this
+    after locking it and opens a new one.
+    """
+    for name in os.listdir(lock_dir):
+        if not name.endswith('.lock') or name == 'evict.lock':
+            continue
+        path = os.path.join(lock_dir, name)
+        try:
+            with open(path, 'a') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.unlink(path)
+        except (IOError, OSError):
+            # In use, or already removed.
+            continue
+
+
+def report():
+    """
+    Report on the contents and use of the cache.
+
+    :returns: A tuple of the number of files and bytes per category (see
+      :func:`scan`) and the totals of the `cache/*` counters (only those
+      that have been incremented at least once).
+    :rtype: tuple(dict(unicode, tuple(int, int)), dict(unicode, int))
+    """
+    sizes = {}
+    for cache_file in scan():
+        count, size = sizes.get(cache_file.category, (0, 0))
+        sizes[cache_file.category] = count + 1, size + cache_file.size
+
+    counters = {counter.split('/', 1)[1]: value
+                for counter, value in stats.get_totals().items()
+                if counter.startswith('cache/')}
+
+    return sizes, counters
+
+
+def migrate():
+    """
+    Recompress the reference files in the cache with the configured codec
+    (`CACHE_CODEC` setting).
+
+    :returns: Number of files recompressed.
+    :rtype: int
+    """
+    codec = compression.get()
+    migrated = 0
+
+    for name in os.listdir(settings.CACHE_DIR):
+        if not REFERENCE_FILE.match(name):
+            continue
+        path = os.path.join(settings.CACHE_DIR, name)
+        if compression.split(path)[1] is codec:
+            continue
+        try:
+            compression.recompress(path, codec)
+        except (IOError, OSError, EOFError):
+            # Removed by another process, or an unreadable file.
+            continue
+        migrated += 1
+
+    return migrated
@@ -0,0 +1,252 @@
+"""
+Compression of reference files in the cache directory.
+
+Reference files are stored as `<accession>.<type><extension>`, where the
+extension depends on the codec used to compress them. New files are written
+with the codec configured by the `CACHE_CODEC` setting, existing files are
+read with the codec matching their extension. This means changing the codec
+does not invalidate the cache, but existing files can be converted to the
+configured codec with :func:`mutalyzer.cache.migrate`.
+
+Available codecs:
+
+- `none`: no compression (no extension).
+- `bz2`: bzip2 compression (`.bz2` extension).
+- `gzip`: gzip compression at level 1 (`.gz` extension).
+- `lz4`: LZ4 frame compression (`.lz4` extension), only if the `lz4`
+  package is installed.
+- `zstd`: Zstandard compression (`.zst` extension), only if the
+  `zstandard` package is installed.
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import collections
+import gzip
+import io
+import os
+import tempfile
+import zlib
+
+from mutalyzer.config import settings
+
+
+#: Codec definition. The `open` function opens a file for reading, the
+#: `compressor` function returns an object with `compress` and `flush`
+#: methods like :class:`bz2.BZ2Compressor`.
+Codec = collections.namedtuple('Codec', ['name', 'extension', 'open',
+                                         'compressor'])
+
+
+#: Available codecs by name.
+CODECS = collections.OrderedDict()
+
+#: Files are recompressed in chunks of this size (in bytes).
+CHUNK_SIZE = 1048576
+
+
+def _register(name, extension, open_function, compressor):
+    CODECS[name] = Codec(name, extension, open_function, compressor)
+
+
+class _NoCompressor(object):
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def _gzip_compressor():
+    # Window size 16 + 15 gives a gzip container.
+    return zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+_register('bz2', '.bz2', lambda path: bz2.BZ2File(path, 'r'),
+          bz2.BZ2Compressor)
+_register('gzip', '.gz', lambda path: gzip.open(path, 'rb'),
+          _gzip_compressor)
+_register('none', '', lambda path: io.open(path, 'rb'),
+          _NoCompressor)
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+    class _LZ4Compressor(object):
+        def __init__(self):
+            self._compressor = lz4.frame.LZ4FrameCompressor()
+            self._started = False
+
+        def compress(self, data):
+            header = b''
+            if not self._started:
+                header = self._compressor.begin()
+                self._started = True
+            return header + self._compressor.compress(data)
+
+        def flush(self):
+            if not self._started:
+                return self._compressor.begin() + self._compressor.flush()
+            return self._compressor.flush()
+
+    _register('lz4', '.lz4', lambda path: lz4.frame.open(path, 'rb'),
+              _LZ4Compressor)
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    def _zstd_open(filename):
+        return zstandard.ZstdDecompressor().stream_reader(
+            io.open(filename, 'rb'), closefd=True)
+
+    _register('zstd', '.zst', _zstd_open,
+              lambda: zstandard.ZstdCompressor().compressobj())
+
+
+def get(name=None):
+    """
+    Get a codec by name.
+
+    :arg unicode name: Name of the codec (default: the configured codec).
+
+    :raises ValueError: If the codec is not available.
+
+    :returns: The codec.
+    :rtype: Codec
+    """
+    name = name or settings.CACHE_CODEC
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError('Codec not available: %s' % name)
+
+
+def _codecs():
+    """
+    All available codecs, starting with the configured one.
+    """
+    configured = get()
+    return [configured] + [codec for codec in CODECS.values()
+                           if codec is not configured]
+
+
+def filename(base, codec=None):
+    """
+    Filename for a compressed file.
+
+    :arg unicode base: Full path without compression extension (e.g.,
+      `/tmp/NM_003002.2.gb`).
+    :arg Codec codec: The codec (default: the configured codec).
+
+    :returns: Full path with compression extension.
+    :rtype: unicode
+    """
+    return base + (codec or get()).extension
+
+
+def find(base):
+    """
+    Find a compressed file, written with any codec.
+
+    :arg unicode base: Full path without compression extension.
+
+    :returns: Full path with compression extension, or `None` if the file
+      does not exist. If there are several, we prefer the configured codec.
+    :rtype: unicode
+    """
+    for codec in _codecs():
+        path = filename(base, codec)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def split(path):
+    """
+    Split the compression extension from a filename.
+
+    :arg unicode path: Filename with compression extension.
+
+    :returns: Filename without compression extension and the codec.
+    :rtype: tuple(unicode, Codec)
+    """
+    # Longest extensions first, the empty extension matches anything.
+    for codec in sorted(CODECS.values(), key=lambda c: -len(c.extension)):
+        if path.endswith(codec.extension):
+            return path[:len(path) - len(codec.extension)], codec
+
+
+def open(path):
+    """
+    Open a compressed file for reading, using the codec matching its
+    extension.
+
+    :arg unicode path: Filename with compression extension.
+
+    :returns: File handle yielding the uncompressed data.
+    :rtype: file
+    """
+    return split(path)[1].open(path)
+
+
+def recompress(path, codec=None):
+    """
+    Compress a file with another codec. The file with the new codec is
+    written under a temporary name and renamed, and gets the same
+    modification time as the original file, which is then removed.
+
+    :arg unicode path: Filename with compression extension.
+    :arg Codec codec: The codec (default: the configured codec).
+
+    :returns: Filename with the new compression extension.
+    :rtype: unicode
+    """
+    codec = codec or get()
+    base, current = split(path)
+    if current is codec:
+        return path
+
+    new_path = filename(base, codec)
+    info = os.stat(path)
+    compressor = codec.compressor()
+
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                         suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as out_handle:
+            in_handle = current.open(path)
+            try:
+                for chunk in iter(lambda: in_handle.read(CHUNK_SIZE), b''):
+                    out_handle.write(compressor.compress(chunk))
+            finally:
+                in_handle.close()
+            out_handle.write(compressor.flush())
+        os.utime(temp_path, (info.st_atime, info.st_mtime))
+        os.rename(temp_path, new_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    os.unlink(path)
+    return new_path
+
+
+def remove_others(path):
+    """
+    Remove the files with the same base filename written with other codecs.
+
+    :arg unicode path: Filename with compression extension.
+    """
+    base, codec = split(path)
+    for other in CODECS.values():
+        if other is not codec:
+            try:
+                os.unlink(filename(base, other))
+            except OSError:
+                pass
@@ -17,6 +17,23 @@ TESTING = False
 # with NCBI Entrez calls.
 EMAIL = 'mutalyzer@humgen.nl'
 
+# NCBI API key sent with NCBI Entrez calls (optional). With an API key, more
+# requests per second are allowed.
+ENTREZ_API_KEY = None
+
+# Maximum number of NCBI Entrez requests per second. This is a budget for all
+# processes using the same cache directory together (batch processor workers,
+# the website, the SOAP service, etc.). If `None`, the NCBI limit is used (3,
+# or 10 with an API key).
+ENTREZ_REQUESTS_PER_SECOND = None
+
+# Maximum number of attempts for NCBI Entrez requests failing with network or
+# server errors (at least one attempt is made).
+ENTREZ_MAX_TRIES = 3
+
+# Base URL for NCBI Entrez calls. If `None`, the default NCBI URL is used.
+ENTREZ_URL = None
+
 # This email address is used as sender in batch job notifications. If `None`,
 # the value of `EMAIL` will be used.
 BATCH_NOTIFICATION_EMAIL = None
@@ -25,9 +42,33 @@ BATCH_NOTIFICATION_EMAIL = None
 # reference files from NCBI or user) and batch job results.
 CACHE_DIR = '/tmp'
 
+# Maximum size of the cache directory (in bytes). If it is exceeded, the least
+# recently used reference files and parsed records are removed. Uploaded
+# reference files are never removed. Use `None` for no maximum (and no
+# removal of files), e.g., `50 * 1073741824` for 50 GB.
+CACHE_SIZE = None
+
+# Codec used to compress new reference files in the cache directory, one of
+# `bz2`, `gzip`, `none`, and (if the Python package is installed) `lz4` or
+# `zstd`.
+CACHE_CODEC = 'bz2'
+
 # Maximum size for uploaded and downloaded files (in bytes).
 MAX_FILE_SIZE = 10 * 1048576 # 10 MB
 
+# Maximum estimated memory use of parsed reference records each process keeps
+# in memory, shared between requests (in bytes).
+SHARED_RECORD_CACHE_SIZE = 100 * 1048576 # 100 MB
+
+# Maximum number of parsed reference records with a memory-mapped sequence
+# each process keeps in memory, shared between requests. Each of them holds an
+# open file descriptor.
+SHARED_RECORD_CACHE_MAPPED = 100
+
+# Maximum time to wait for another thread or process retrieving the same
+# reference (in seconds).
+FETCH_LOCK_TIMEOUT = 120
+
 # Maximum sequence length for description extractor (in bases).
 EXTRACTOR_MAX_INPUT_LENGTH = 50 * 1000 # 50 Kbp
 
@@ -70,10 +111,82 @@ LRG_PREFIX_URL = 'ftp://ftp.ebi.ac.uk/pub/databases/lrgex/'
 # Allow for this fraction of errors in batch jobs.
 BATCH_JOBS_ERROR_THRESHOLD = 0.05
 
+# Batch queue items are leased by a batch processor worker for this number of
+# seconds. The worker renews its leases while it is still processing the
+# items. Items with an expired lease (e.g., because the worker was killed) are
+# picked up by another worker.
+BATCH_LEASE_DURATION = 60 * 10
+
+# Number of batch queue items that are inserted and committed at once when a
+# batch job is submitted. The job can be processed as soon as the first items
+# are committed.
+BATCH_INSERT_CHUNK_SIZE = 5000
+
+# Maximum time (in seconds) between adding two chunks of items of a batch job.
+# Jobs that are still loading after this time (e.g., because the submitting
+# process was killed) are removed by the batch processor.
+BATCH_LOADING_TIMEOUT = 60 * 10
+
+# Number of batch queue items a batch processor worker leases and processes at
+# once for a job, per job type. This is the maximum number of items processed
+# for a job in one scheduling round.
+BATCH_BLOCK_SIZES = {
+    'name-checker': 10,
+    'syntax-checker': 500,
+    'position-converter': 50,
+    'snp-converter': 50
+}
+
+# Maximum number of parsed reference records a batch processor worker keeps
+# in memory per name checker batch job.
+BATCH_RECORD_CACHE_SIZE = 10
+
+# Maximum number of transcript accession numbers (and crossmappers) for which
+# a batch processor worker keeps the transcript mappings in memory per
+# position converter batch job.
+BATCH_CONVERTER_CACHE_SIZE = 1000
+
+# Number of threads a batch processor worker uses to retrieve the references
+# of name checker batch jobs in the background. Use 0 to disable.
+BATCH_PREFETCH_THREADS = 4
+
+# Results of processed batch queue items are written to the batch job result
+# file when they amount to this number of characters, when this number of
+# seconds has passed, or when the job is finished.
+BATCH_RESULT_FLUSH_SIZE = 64 * 1024
+BATCH_RESULT_FLUSH_INTERVAL = 10
+
+# Also write a gzip-compressed copy of batch job result files, which can be
+# downloaded instead of the uncompressed file.
+BATCH_RESULT_GZIP = False
+
+# Identical entries within a batch job are processed only once. If this is
+# set, results are also reused for identical entries in jobs processed within
+# this number of seconds by the same batch processor worker (0 to disable).
+# Results of entries that failed because of retrieval or communication errors
+# are never reused.
+BATCH_DEDUPLICATE_WINDOW = 0
+
+# Scheduling policy for batch jobs, either 'round-robin' (a block of entries
+# from the oldest job of each email address in turn) or 'deficit-round-robin'
+# (processing time is divided equally over email addresses, based on the
+# estimated processing time of entries).
+BATCH_SCHEDULING_POLICY = 'deficit-round-robin'
+
+# Processing time (in seconds) credited to each email address per round by
+# the deficit round robin scheduling policy.
+BATCH_SCHEDULING_QUANTUM = 5
+
 # Cache expiration time for negative transcript<->protein links from the NCBI
 # (in seconds).
 NEGATIVE_LINK_CACHE_EXPIRATION = 60 * 60 * 24 * 30
 
+# Cache expiration time for HGVS descriptions of dbSNP records (in seconds).
+DBSNP_CACHE_EXPIRATION = 60 * 60 * 24 * 7
+
+# Maximum number of dbSNP records to retrieve in one Entrez request.
+DBSNP_FETCH_CHUNK_SIZE = 200
+
 # URL to the website root (without trailing slash). Used for generating
 # download links in the batch scheduler.
 WEBSITE_ROOT_URL = None
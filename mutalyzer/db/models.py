@@ -11,8 +11,8 @@ import uuid
 
 import binning
 from sqlalchemy import event, or_
-from sqlalchemy import (Boolean, Column, DateTime, Enum, ForeignKey, Index,
-                        Integer, String, Text, TypeDecorator)
+from sqlalchemy import (Boolean, Column, DateTime, Enum, Float, ForeignKey,
+                        Index, Integer, String, Text, TypeDecorator)
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import backref, relationship
 
@@ -88,13 +88,26 @@ class BatchJob(db.Base):
     #: since it can be guessed by any user.
     result_id = Column(String(50), nullable=False, index=True, unique=True)
 
+    #: Estimated processing time per item (in seconds), used for scheduling
+    #: and for estimating the time of completion.
+    item_cost = Column(Float)
+
+    #: Set while the items of the job are still being added. The job is not
+    #: finished before all its items are added.
+    loading = Column(Boolean, nullable=False, default=False)
+
+    #: Date and time after which a job that is still loading is considered
+    #: abandoned, renewed with every chunk of items added.
+    loading_expires = Column(DateTime)
+
     #: Date and time of creation.
     added = Column(DateTime)
 
-    def __init__(self, job_type, email=None, argument=None):
+    def __init__(self, job_type, email=None, argument=None, item_cost=None):
         self.job_type = job_type
         self.email = email
         self.argument = argument
+        self.item_cost = item_cost
         self.result_id = unicode(uuid.uuid4())
         self.added = datetime.now()
 
@@ -123,6 +136,20 @@ class BatchQueueItem(db.Base):
     #: alteration/skip. We simply store the concatenation of these flags.
     flags = Column(String(20), nullable=False)
 
+    #: Identifier of the batch processor worker currently processing this
+    #: item, or `None` if the item is not leased.
+    lease_owner = Column(String(100))
+
+    #: Date and time the lease on this item expires. After this time, the
+    #: item can be leased by another worker.
+    lease_expires = Column(DateTime)
+
+    #: Result for this item (including the separator), or `None` if the item
+    #: was not yet processed. Results are written to the job result file in
+    #: input order, so completed items wait here until all preceding items in
+    #: the job are completed.
+    result = Column(Text)
+
     #: The :class:`BatchJob` for this item.
     batch_job = relationship(
         BatchJob,
@@ -141,6 +168,8 @@ class BatchQueueItem(db.Base):
 
 Index('batch_queue_item_with_batch_job',
       BatchQueueItem.batch_job_id, BatchQueueItem.id)
+Index('batch_queue_item_with_item',
+      BatchQueueItem.batch_job_id, BatchQueueItem.item)
 
 
 class Reference(db.Base):
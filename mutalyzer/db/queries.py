@@ -9,42 +9,252 @@ Queries on database models.
 
 from __future__ import unicode_literals
 
+from datetime import datetime, timedelta
+from itertools import takewhile
+
+from sqlalchemy import and_, bindparam, case, func, or_
+
+from mutalyzer.config import settings
 from mutalyzer.db import session
-from mutalyzer.db.models import BatchQueueItem
+from mutalyzer.db.models import BatchJob, BatchQueueItem
 
 
-def pop_batch_queue_item(batch_job):
+def lease_batch_queue_items(batch_job, owner, limit):
     """
-    Get the next batch queue item for the given batch job. Return its fields
-    as a tuple `item`, `flags` and remove it from the database.
+    Lease a block of at most `limit` available batch queue items of the given
+    batch job for `owner`. Return their fields as a list of tuples `id`,
+    `item`, `flags`, in input order.
+
+    An item is available if it has no result yet and is not leased, or if
+    its lease has expired (for example, because the worker holding it was
+    killed). The block is leased by one conditional update and one commit,
+    so concurrent workers can never lease the same item.
+
+    If no batch queue items could be leased for this batch job, return an
+    empty list.
+    """
+    while True:
+        now = datetime.now()
+        available = or_(BatchQueueItem.lease_expires == None,
+                        BatchQueueItem.lease_expires < now)
+
+        candidates = [item.id for item in session.query(BatchQueueItem.id)
+                      .filter(BatchQueueItem.batch_job_id == batch_job.id,
+                              BatchQueueItem.result == None,
+                              available)
+                      .order_by(BatchQueueItem.id.asc())
+                      .limit(limit)]
+        if not candidates:
+            session.commit()
+            return []
+
+        BatchQueueItem.query \
+            .filter(BatchQueueItem.id.in_(candidates),
+                    BatchQueueItem.result == None,
+                    available) \
+            .update({'lease_owner': owner,
+                     'lease_expires': now + timedelta(
+                         seconds=settings.BATCH_LEASE_DURATION)},
+                    synchronize_session=False)
 
-    If no batch queue item could be found for this batch job, return `None`.
+        leased = session.query(BatchQueueItem.id, BatchQueueItem.item,
+                               BatchQueueItem.flags) \
+            .filter(BatchQueueItem.id.in_(candidates),
+                    BatchQueueItem.lease_owner == owner,
+                    BatchQueueItem.result == None) \
+            .order_by(BatchQueueItem.id.asc()) \
+            .all()
+        session.commit()
 
-    .. note:: Originally, finding the next batch queue item was done using a
-        more complicated query::
+        if leased:
+            return [tuple(item) for item in leased]
+
+        # Another worker leased these items just before us, try the next
+        # ones.
+
+
+def renew_batch_queue_items(owner, item_ids):
+    """
+    Extend the leases of `owner` on the given batch queue items to
+    `BATCH_LEASE_DURATION` seconds from now, in one commit. Items whose
+    lease was lost in the meantime are left alone.
+    """
+    if not item_ids:
+        return
+    BatchQueueItem.query \
+        .filter(BatchQueueItem.id.in_(item_ids),
+                BatchQueueItem.lease_owner == owner,
+                BatchQueueItem.result == None) \
+        .update({'lease_expires': datetime.now() + timedelta(
+                    seconds=settings.BATCH_LEASE_DURATION)},
+                synchronize_session=False)
+    session.commit()
 
-            SELECT QueueID, Input, Flags
-            FROM BatchQueue
-            WHERE QueueID = (
-                SELECT MIN(QueueID)
-                FROM BatchQueue
-                GROUP BY JobID
-                HAVING JobID = {batch_job.id}
-            );
 
-        However, I couldn't see any significant performance difference in my
-        latest benchmarks, so we stick with the more obvious query for now.
+def get_batch_queue_items(item_ids):
     """
-    batch_queue_item = BatchQueueItem.query \
-        .filter_by(batch_job=batch_job) \
+    Get the current fields of the given batch queue items as a list of
+    tuples `id`, `item`, `flags`, in input order.
+
+    This can be used to refresh leased items after their item or flags have
+    been updated.
+    """
+    if not item_ids:
+        return []
+    items = session.query(BatchQueueItem.id, BatchQueueItem.item,
+                          BatchQueueItem.flags) \
+        .filter(BatchQueueItem.id.in_(item_ids)) \
         .order_by(BatchQueueItem.id.asc()) \
+        .all()
+    return [tuple(item) for item in items]
+
+
+def complete_batch_queue_items(owner, results):
+    """
+    Store the results for batch queue items leased by `owner` and release
+    their leases, in one commit.
+
+    Results for items whose lease was lost in the meantime are discarded.
+
+    :arg unicode owner: Owner of the leases.
+    :arg list results: List of tuples `id`, `result`.
+    """
+    if not results:
+        return
+    table = BatchQueueItem.__table__
+    session.execute(
+        table.update()
+        .where(and_(table.c.id == bindparam('item_id'),
+                    table.c.lease_owner == owner,
+                    table.c.result == None))
+        .values(result=bindparam('item_result'),
+                lease_owner=None,
+                lease_expires=None),
+        [{'item_id': item_id, 'item_result': result}
+         for item_id, result in results])
+    session.commit()
+
+
+def fan_out_batch_results(batch_job, owner, results):
+    """
+    Store results for all other unprocessed batch queue items in a batch job
+    that have the same input and flags (ignoring continuation flags) as
+    processed items, in one commit. Items leased by other workers are left
+    alone.
+
+    The separator of each result depends on the continuation flag of the
+    item it is stored for. Only results that do not depend on transient
+    failures (e.g., network errors) should be fanned out.
+
+    :arg batch_job: Batch job.
+    :arg unicode owner: Owner of the leases.
+    :arg list results: List of tuples `item`, `flags`, `result`, where
+      `result` is without separator.
+    """
+    if not results:
+        return
+    table = BatchQueueItem.__table__
+    session.execute(
+        table.update()
+        .where(and_(table.c.batch_job_id == batch_job.id,
+                    table.c.item == bindparam('item_item'),
+                    func.replace(table.c.flags, 'C0', '') ==
+                    bindparam('item_flags'),
+                    table.c.result == None,
+                    or_(table.c.lease_owner == None,
+                        table.c.lease_owner == owner,
+                        table.c.lease_expires < datetime.now())))
+        .values(result=case([(table.c.flags.contains('C'),
+                              bindparam('item_result_continue'))],
+                            else_=bindparam('item_result')),
+                lease_owner=None,
+                lease_expires=None),
+        [{'item_item': item,
+          'item_flags': (flags or '').replace('C0', ''),
+          'item_result_continue': result + '\t',
+          'item_result': result + '\n'}
+         for item, flags, result in results])
+    session.commit()
+
+
+def release_batch_queue_items(owner, item_ids):
+    """
+    Release the leases of `owner` on the given batch queue items without
+    storing a result, so they can be leased by other workers.
+    """
+    if not item_ids:
+        return
+    BatchQueueItem.query \
+        .filter(BatchQueueItem.id.in_(item_ids),
+                BatchQueueItem.lease_owner == owner) \
+        .update({'lease_owner': None, 'lease_expires': None},
+                synchronize_session=False)
+    session.commit()
+
+
+def remove_abandoned_batch_jobs():
+    """
+    Remove batch jobs that are still loading after their loading deadline,
+    together with their batch queue items. The process adding their items
+    is gone (e.g., it was killed), so they would never be finished.
+
+    Return the result ids of the removed batch jobs.
+    """
+    abandoned = session.query(BatchJob.id, BatchJob.result_id) \
+        .filter(BatchJob.loading == True,
+                BatchJob.loading_expires < datetime.now()) \
+        .all()
+    if not abandoned:
+        session.commit()
+        return []
+
+    job_ids = [job.id for job in abandoned]
+    BatchQueueItem.query \
+        .filter(BatchQueueItem.batch_job_id.in_(job_ids)) \
+        .delete(synchronize_session=False)
+    BatchJob.query \
+        .filter(BatchJob.id.in_(job_ids),
+                BatchJob.loading == True) \
+        .delete(synchronize_session=False)
+    session.commit()
+    return [job.result_id for job in abandoned]
+
+
+def pop_batch_results(batch_job, limit=1000):
+    """
+    Get the results of the completed batch queue items at the start of the
+    given batch job, in input order, and remove these items from the
+    database.
+
+    Items are completed by concurrent workers in arbitrary order, so this
+    stops at the first item without a result. The batch job row is locked
+    for the duration of the transaction, which must be committed by the
+    caller (after writing the results).
+
+    Return a tuple `results`, `finished`, where `finished` is `True` if no
+    batch queue items remain for this batch job and all its items were
+    added. If the batch job no longer exists (another worker finished it),
+    return `None`.
+    """
+    job = session.query(BatchJob.loading) \
+        .filter_by(id=batch_job.id) \
+        .with_for_update() \
         .first()
-    if batch_queue_item is None:
+    if job is None:
         return None
 
-    item, flags = batch_queue_item.item, batch_queue_item.flags
+    items = session.query(BatchQueueItem.id, BatchQueueItem.result) \
+        .filter_by(batch_job_id=batch_job.id) \
+        .order_by(BatchQueueItem.id.asc()) \
+        .limit(limit) \
+        .all()
 
-    session.delete(batch_queue_item)
-    session.commit()
+    completed = list(takewhile(lambda item: item.result is not None, items))
+    if completed:
+        BatchQueueItem.query \
+            .filter(BatchQueueItem.batch_job_id == batch_job.id,
+                    BatchQueueItem.id <= completed[-1].id) \
+            .delete(synchronize_session=False)
 
-    return item, flags
+    finished = not job.loading and len(completed) == len(items) < limit
+    return [item.result for item in completed], finished
@@ -0,0 +1,316 @@
+"""
+Gateway to the NCBI Entrez API.
+
+All communication with Entrez goes through this module. It is a thin layer
+over :mod:`Bio.Entrez`, adding:
+
+- Keep-alive HTTP connections from a connection pool shared by all threads in
+  the process. These replace the private :func:`Bio.Entrez._open`, which
+  also removes its fixed delay between requests.
+- Rate limiting with a token bucket, at `ENTREZ_REQUESTS_PER_SECOND`
+  requests per second (by default the NCBI limit of 3, or 10 with an API
+  key). The bucket is kept in a file in the cache directory, so the limit
+  holds for all processes using the same cache directory together (e.g.,
+  batch processor workers, the website and the SOAP service).
+- Retries with exponential backoff on network and server errors, at most
+  `ENTREZ_MAX_TRIES` attempts (at least one).
+- Request, error and latency (in milliseconds) counters per endpoint in
+  :mod:`mutalyzer.stats` (e.g., `entrez-efetch/requests`).
+
+Use the functions in this module instead of their :mod:`Bio.Entrez`
+counterparts. Results can be parsed with :func:`Bio.Entrez.read` as usual.
+
+The Entrez base URL can be changed with the `ENTREZ_URL` setting, for
+example to use a local stub server.
+"""
+
+
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+import httplib
+import io
+import os
+import threading
+import time
+import urllib
+import urllib2
+
+from Bio import Entrez
+import requests
+
+from mutalyzer.config import settings
+from mutalyzer import stats
+
+
+#: Base URL used by :mod:`Bio.Entrez`.
+DEFAULT_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+
+#: Timeout for connecting to Entrez and for reading a response (in seconds).
+TIMEOUT = 120
+
+#: Delay before the first retry of a failed request (in seconds), it is
+#: doubled for every subsequent retry.
+RETRY_DELAY = 1
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, shared by all threads in the process.
+
+    Tokens are added at a constant rate up to a maximum of one second worth
+    of tokens, which is also what we start with. Every request takes a
+    token, waiting for one if none is available.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._updated = time.time()
+
+    def acquire(self, rate):
+        """
+        Take a token, waiting for it if needed.
+
+        :arg float rate: Number of tokens added per second.
+        """
+        with self._lock:
+            wait = self._take(rate)
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def _take(self, rate):
+        """
+        Take a token from the bucket in this process.
+
+        :returns: Number of seconds to wait for the token.
+        :rtype: float
+        """
+        self._tokens, self._updated, wait = _take(
+            self._tokens, self._updated, rate)
+        return wait
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket rate limiter, shared by all processes using the same state
+    file.
+
+    The state file is `locks/<name>.bucket` in the cache directory. It is
+    locked while we take a token, not while we wait for it. If the file
+    cannot be used, we fall back to a bucket for this process only.
+    """
+    def __init__(self, name, directory=None):
+        """
+        :arg unicode name: Name of the bucket.
+        :arg unicode directory: Directory for the state file. Defaults to the
+          `CACHE_DIR` setting (looked up on every request).
+        """
+        super(SharedTokenBucket, self).__init__()
+        self._name = name
+        self._directory = directory
+
+    def _take(self, rate):
+        lock_dir = os.path.join(self._directory or settings.CACHE_DIR,
+                                'locks')
+        try:
+            if not os.path.isdir(lock_dir):
+                try:
+                    os.mkdir(lock_dir)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            fd = os.open(os.path.join(lock_dir, '%s.bucket' % self._name),
+                         os.O_RDWR | os.O_CREAT, 0o644)
+        except (IOError, OSError):
+            return super(SharedTokenBucket, self)._take(rate)
+
+        # Closing the file releases the lock.
+        with os.fdopen(fd, 'r+b') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                tokens, updated = map(float, handle.read().split())
+            except ValueError:
+                # New (or corrupt) state file.
+                tokens, updated = None, time.time()
+            tokens, updated, wait = _take(tokens, updated, rate)
+            handle.seek(0)
+            handle.truncate()
+            handle.write(b'%r %r' % (tokens, updated))
+        return wait
+
+
+def _take(tokens, updated, rate):
+    """
+    Take a token from a bucket.
+
+    :arg float tokens: Number of tokens in the bucket (negative if callers
+      are waiting for tokens), or `None` for a new bucket.
+    :arg float updated: Time the number of tokens was last updated.
+    :arg float rate: Number of tokens added per second.
+
+    :returns: The new number of tokens, the time of the update, and the
+      number of seconds to wait for the token.
+    :rtype: tuple(float, float, float)
+    """
+    now = time.time()
+    if tokens is None:
+        tokens = rate
+    tokens = min(rate, tokens + (now - updated) * rate)
+
+    # We take the token even if it is not there yet, so concurrent callers
+    # wait for subsequent tokens.
+    tokens -= 1
+    return tokens, now, -tokens / rate
+
+
+_bucket = SharedTokenBucket('entrez')
+_session = requests.Session()
+_session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=20))
+_session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=20))
+
+
+def _open(cgi, params=None, post=None, ecitmatch=False):
+    """
+    Open an Entrez URL on a pooled keep-alive connection.
+
+    This replaces the private :func:`Bio.Entrez._open`, which is called by
+    the :mod:`Bio.Entrez` query functions with the endpoint URL and query
+    parameters, and raises the same exceptions. We replace it instead of
+    :func:`Bio.Entrez._urlopen`, because it also sleeps between requests to
+    enforce the NCBI rate limit (which our token bucket already does) and
+    retries failed requests (which :func:`_request` already does).
+
+    The response is read completely, so the connection can be reused for
+    the next request.
+
+    :arg str cgi: Endpoint URL.
+    :arg dict params: Query parameters.
+    :arg bool post: Use a POST request. By default, POST is used if the
+      encoded query parameters are longer than 1000 characters.
+    :arg bool ecitmatch: Don't encode pipes in the query parameters, as
+      expected by the ECitMatch endpoint.
+    """
+    params = dict((key, value) for key, value in (params or {}).items()
+                  if value is not None)
+    params.setdefault('tool', Entrez.tool)
+    params.setdefault('email', settings.EMAIL)
+    if settings.ENTREZ_API_KEY:
+        params.setdefault('api_key', settings.ENTREZ_API_KEY)
+
+    if settings.ENTREZ_URL and cgi.startswith(DEFAULT_URL):
+        cgi = settings.ENTREZ_URL + cgi[len(DEFAULT_URL):]
+
+    options = urllib.urlencode(params, doseq=True)
+    if ecitmatch:
+        options = options.replace('%7C', '|')
+    if post is None:
+        post = len(options) > 1000
+
+    try:
+        if post:
+            response = _session.post(
+                cgi, data=options, timeout=TIMEOUT,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        else:
+            response = _session.get(cgi + '?' + options, timeout=TIMEOUT)
+        content = response.content
+    except requests.RequestException as e:
+        raise urllib2.URLError(e)
+
+    if response.status_code >= 400:
+        raise urllib2.HTTPError(cgi, response.status_code, response.reason,
+                                response.headers, io.BytesIO(content))
+
+    return io.BytesIO(content)
+
+
+def _configure():
+    """
+    Configure :mod:`Bio.Entrez` to use our connection pool.
+    """
+    Entrez._open = _open
+
+
+def _rate():
+    """
+    Maximum number of requests per second.
+    """
+    if settings.ENTREZ_REQUESTS_PER_SECOND:
+        return float(settings.ENTREZ_REQUESTS_PER_SECOND)
+    if settings.ENTREZ_API_KEY:
+        return 10.0
+    return 3.0
+
+
+def _request(endpoint, **kwargs):
+    """
+    Do an Entrez request with rate limiting and retries.
+
+    :arg str endpoint: Name of the Entrez function in :mod:`Bio.Entrez`
+      (e.g., `efetch`).
+
+    :raises IOError: On network errors or error responses, after all
+      retries failed. Client errors (4xx responses) are not retried.
+    :raises httplib.HTTPException: On network errors, after all retries
+      failed.
+
+    :returns: A handle to the response.
+    """
+    if Entrez._open is not _open:
+        _configure()
+
+    counter = 'entrez-%s' % endpoint
+    max_tries = max(1, settings.ENTREZ_MAX_TRIES)
+
+    for attempt in range(max_tries):
+        _bucket.acquire(_rate())
+
+        start = time.time()
+        try:
+            # The function is looked up on every call, so it can be patched.
+            handle = getattr(Entrez, endpoint)(**kwargs)
+        except (IOError, httplib.HTTPException) as e:
+            stats.increment_counter('%s/errors' % counter)
+            if (isinstance(e, urllib2.HTTPError) and 400 <= e.code < 500 and
+                    e.code != 429):
+                raise
+            if attempt >= max_tries - 1:
+                raise
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+        else:
+            stats.increment_counter('%s/requests' % counter)
+            stats.increment_counter(
+                '%s/milliseconds' % counter,
+                amount=int((time.time() - start) * 1000))
+            return handle
+
+
+def efetch(**kwargs):
+    """
+    Retrieve records from Entrez, see :func:`Bio.Entrez.efetch`.
+    """
+    return _request('efetch', **kwargs)
+
+
+def esearch(**kwargs):
+    """
+    Search an Entrez database, see :func:`Bio.Entrez.esearch`.
+    """
+    return _request('esearch', **kwargs)
+
+
+def esummary(**kwargs):
+    """
+    Retrieve document summaries from Entrez, see
+    :func:`Bio.Entrez.esummary`.
+    """
+    return _request('esummary', **kwargs)
+
+
+def elink(**kwargs):
+    """
+    Find links between Entrez records, see :func:`Bio.Entrez.elink`.
+    """
+    return _request('elink', **kwargs)
@@ -7,6 +7,7 @@ from __future__ import unicode_literals
 
 import argparse
 import codecs
+import collections
 import json
 import locale
 import os
@@ -19,11 +20,13 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from . import _cli_string
 from .. import announce
+from .. import cache
 from .. import db
 from ..db import session
 from ..db.models import Assembly, BatchJob, BatchQueueItem, Chromosome
 from .. import mapping
 from .. import output
+from .. import reference_import
 from .. import sync
 from .. import util
 
@@ -152,6 +155,55 @@ def import_reference(assembly_name_or_alias, reference):
     mapping.import_from_reference(assembly, reference)
 
 
+def _import_references(results, manifest_file=None):
+    """
+    Report on imported references.
+    """
+    counts = collections.Counter()
+
+    for result in results:
+        counts[result.status] += 1
+        if manifest_file is not None and result.accession is not None:
+            manifest_file.write('%s\t%s\t%s\n' % result)
+
+    print ', '.join('%s: %d' % (status, counts[status]) for status in
+                    ('added', 'updated', 'restored', 'unchanged',
+                     'duplicate', 'invalid'))
+
+
+def import_genbank(genbank_files, processes=None, manifest_file=None):
+    """
+    Import references from GenBank flat files (e.g., a RefSeq release).
+    """
+    # For long-running processes it can be convenient to have a short and
+    # human-readable process name.
+    util.set_process_name('mutalyzer: genbank-import')
+
+    for filename in genbank_files:
+        if not os.path.isfile(filename):
+            raise UserError('Not a file: %s' % filename)
+
+    _import_references(
+        reference_import.import_genbank(genbank_files, processes=processes),
+        manifest_file=manifest_file)
+
+
+def import_lrg(lrg_directory, processes=None, manifest_file=None):
+    """
+    Import references from a directory with LRG files.
+    """
+    # For long-running processes it can be convenient to have a short and
+    # human-readable process name.
+    util.set_process_name('mutalyzer: lrg-import')
+
+    if not os.path.isdir(lrg_directory):
+        raise UserError('Not a directory: %s' % lrg_directory)
+
+    _import_references(
+        reference_import.import_lrg(lrg_directory, processes=processes),
+        manifest_file=manifest_file)
+
+
 def sync_cache(wsdl_url, url_template, history=7):
     """
     Synchronize the database cache with another Mutalyzer instance.
@@ -222,6 +274,50 @@ def list_batch_jobs():
             **lengths)
 
 
+def cache_report():
+    """
+    Report on the size and use of the cache.
+    """
+    sizes, counters = cache.report()
+
+    print 'Size by source:'
+    for category, (count, size) in sorted(sizes.items()):
+        print '  %-14s %8d files  %10.1f MB' % (category, count,
+                                                size / 1048576.0)
+    print '  %-14s %8d files  %10.1f MB' % (
+        'total', sum(count for count, _ in sizes.values()),
+        sum(size for _, size in sizes.values()) / 1048576.0)
+
+    hits = counters.get('hit', 0)
+    misses = counters.get('miss', 0)
+    print
+    print 'Hits:       %d' % hits
+    print 'Misses:     %d' % misses
+    if hits + misses:
+        print 'Hit rate:   %.1f%%' % (100.0 * hits / (hits + misses))
+    print 'Evictions:  %d (%.1f MB)' % (
+        counters.get('eviction', 0),
+        counters.get('eviction-bytes', 0) / 1048576.0)
+
+
+def cache_evict():
+    """
+    Remove least recently used files from the cache if it is too large.
+    """
+    print 'Removed %d files from the cache.' % cache.evict()
+
+
+def cache_migrate():
+    """
+    Recompress reference files in the cache with the configured codec.
+    """
+    # For long-running processes it can be convenient to have a short and
+    # human-readable process name.
+    util.set_process_name('mutalyzer: cache-migrate')
+
+    print 'Recompressed %d files in the cache.' % cache.migrate()
+
+
 def set_announcement(body, url=None):
     """
     Set announcement to show to the user.
@@ -371,6 +467,47 @@ def main():
         help='genomic reference to import all genes from (example: '
         'NC_012920.1)')
 
+    # Subparsers for 'references'.
+    s = subparsers.add_parser(
+        'references', help='manage reference files',
+        description='Manage reference files.'
+        ).add_subparsers()
+
+    import_parser = argparse.ArgumentParser(add_help=False)
+    import_parser.add_argument(
+        '-p', '--processes', metavar='NUMBER', dest='processes', type=int,
+        help='number of worker processes (default: number of CPUs)')
+    import_parser.add_argument(
+        '-m', '--manifest', metavar='MANIFEST', dest='manifest_file',
+        type=argparse.FileType('w'),
+        help='write accession number, checksum, and outcome of every '
+        'imported record to this file')
+
+    # Subparser 'references import-genbank'.
+    p = s.add_parser(
+        'import-genbank', help='import references from GenBank flat files',
+        parents=[import_parser],
+        description=import_genbank.__doc__.split('\n\n')[0],
+        epilog='References that were imported before are only updated if '
+        'their checksum changed.')
+    p.set_defaults(func=import_genbank)
+    p.add_argument(
+        'genbank_files', metavar='FILE', type=_cli_string, nargs='+',
+        help='multi-record GenBank flat file, optionally gzipped (example: '
+        'human.1.rna.gbff.gz)')
+
+    # Subparser 'references import-lrg'.
+    p = s.add_parser(
+        'import-lrg', help='import references from LRG files',
+        parents=[import_parser],
+        description=import_lrg.__doc__.split('\n\n')[0],
+        epilog='References that were imported before are only updated if '
+        'their checksum changed.')
+    p.set_defaults(func=import_lrg)
+    p.add_argument(
+        'lrg_directory', metavar='DIRECTORY', type=_cli_string,
+        help='directory with LRG_<number>.xml files')
+
     # Subparsers for 'announcement'.
     s = subparsers.add_parser(
         'announcement', help='manage user announcement',
@@ -396,6 +533,33 @@ def main():
         description=unset_announcement.__doc__.split('\n\n')[0])
     p.set_defaults(func=unset_announcement)
 
+    # Subparsers for 'cache'.
+    s = subparsers.add_parser(
+        'cache', help='manage cache directory',
+        description='Manage the cache directory.'
+        ).add_subparsers()
+
+    # Subparser 'cache report'.
+    p = s.add_parser(
+        'report', help='report on cache size and use',
+        description=cache_report.__doc__.split('\n\n')[0])
+    p.set_defaults(func=cache_report)
+
+    # Subparser 'cache evict'.
+    p = s.add_parser(
+        'evict', help='remove least recently used files',
+        description=cache_evict.__doc__.split('\n\n')[0],
+        epilog='This is also done automatically when files are added to the '
+        'cache.')
+    p.set_defaults(func=cache_evict)
+
+    # Subparser 'cache migrate'.
+    p = s.add_parser(
+        'migrate', help='recompress reference files',
+        description=cache_migrate.__doc__.split('\n\n')[0],
+        epilog='Use this after changing the CACHE_CODEC setting.')
+    p.set_defaults(func=cache_migrate)
+
     # Subparser 'batch-jobs'.
     p = subparsers.add_parser(
         'batch-jobs', help='list batch jobs',
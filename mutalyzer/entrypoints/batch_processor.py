@@ -9,6 +9,7 @@ Mutalyzer batch processor.
 from __future__ import unicode_literals
 
 import argparse
+import multiprocessing
 import signal
 import sys
 import time
@@ -19,13 +20,19 @@ from .. import Scheduler
 from .. import util
 
 
-def process():
+def process(worker=None):
     """
     Run forever in a loop processing scheduled batch jobs.
+
+    :arg int worker: Number of this worker if running as one of several
+      concurrent workers (see :func:`process_concurrently`).
     """
     # For long-running processes it can be convenient to have a short and
     # human-readable process name.
-    util.set_process_name('mutalyzer: batch-processor')
+    if worker is None:
+        util.set_process_name('mutalyzer: batch-processor')
+    else:
+        util.set_process_name('mutalyzer: batch-processor worker %d' % worker)
 
     scheduler = Scheduler.Scheduler()
 
@@ -39,7 +46,12 @@ def process():
         scheduler.stop()
 
     signal.signal(signal.SIGTERM, handle_exit)
-    signal.signal(signal.SIGINT, handle_exit)
+    if worker is None:
+        signal.signal(signal.SIGINT, handle_exit)
+    else:
+        # Ctrl+C is handled by the parent process, which forwards it to the
+        # workers as SIGTERM.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
 
     while True:
 
@@ -52,6 +64,53 @@ def process():
         # Wait a bit and process any possible new jobs.
         time.sleep(1)
 
+    if worker is None:
+        sys.stderr.write('mutalyzer-batch-processor: Graceful shutdown\n')
+    sys.exit(0)
+
+
+def process_concurrently(workers):
+    """
+    Run forever processing scheduled batch jobs with a number of concurrent
+    worker processes.
+
+    Batch queue items are leased by the worker processing them, so the
+    workers never process the same item and results are still written in
+    input order.
+
+    :arg int workers: Number of worker processes.
+    """
+    util.set_process_name('mutalyzer: batch-processor')
+
+    # Note that we don't touch the database in this process, so the workers
+    # don't share any connections.
+    children = [multiprocessing.Process(target=process, args=(i + 1,))
+                for i in range(workers)]
+    for child in children:
+        child.start()
+
+    state = {'stopping': False}
+
+    def handle_exit(signum, stack_frame):
+        if state['stopping']:
+            sys.stderr.write('mutalyzer-batch-processor: Terminated\n')
+        elif signum == signal.SIGINT:
+            sys.stderr.write('mutalyzer-batch-processor: Hitting Ctrl+C '
+                             'again will terminate any running job!\n')
+        state['stopping'] = True
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, handle_exit)
+    signal.signal(signal.SIGINT, handle_exit)
+
+    for child in children:
+        child.join()
+
+    if any(child.exitcode for child in children):
+        sys.exit(1)
+
     sys.stderr.write('mutalyzer-batch-processor: Graceful shutdown\n')
     sys.exit(0)
 
@@ -66,8 +125,19 @@ def main():
         epilog='The process can be shutdown gracefully by sending a SIGINT '
         '(Ctrl+C) or SIGTERM signal.')
 
-    parser.parse_args()
-    process()
+    parser.add_argument(
+        '-w', '--workers', metavar='N', type=int, default=1,
+        help='number of concurrent worker processes (default: 1)')
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('number of workers must be at least 1')
+
+    if args.workers == 1:
+        process()
+    else:
+        process_concurrently(args.workers)
 
 
 if __name__ == '__main__':
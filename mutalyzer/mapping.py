@@ -12,12 +12,13 @@ update the database with this information.
 
 from __future__ import unicode_literals
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from itertools import groupby
 from operator import attrgetter, itemgetter
 
 import binning
 import MySQLdb
+from sqlalchemy.orm import joinedload
 
 from mutalyzer.db import session
 from mutalyzer.db.models import Chromosome, TranscriptMapping
@@ -88,6 +89,140 @@ def _construct_change(var, reverse=False):
 #_construct_change
 
 
+def _make_crossmap(mapping):
+    """
+    Build a crossmapper for a transcript mapping.
+
+    @arg mapping: Transcript mapping
+    @type mapping: TranscriptMapping
+
+    @return: Cross ; A Crossmap object
+    @rtype: object
+    """
+    # Create Mutalyzer compatible exon list.
+    mrna = []
+    for exon in zip(mapping.exon_starts, mapping.exon_stops):
+        mrna.extend(exon)
+
+    cds = mapping.cds or []
+    orientation = 1 if mapping.orientation == 'forward' else -1
+
+    return Crossmap.Crossmap(mrna, cds, orientation)
+#_make_crossmap
+
+
+def _detach(instances):
+    """
+    Remove database model instances from the session, so they keep their
+    loaded attributes when the session is committed.
+    """
+    for instance in instances:
+        if instance in session:
+            session.expunge(instance)
+#_detach
+
+
+class ConverterCache(object):
+    """
+    Cache of database lookups and crossmappers that can be shared by
+    converters on the same assembly (e.g., for all entries of a position
+    converter batch job).
+
+    The chromosomes of the assembly are loaded once. Transcript mappings (by
+    accession number) and crossmappers (by transcript mapping) are kept in
+    least recently used caches.
+
+    Cached chromosomes and transcript mappings are removed from the session,
+    so they stay usable after commits but must not be modified.
+    """
+    def __init__(self, assembly, size=1000):
+        """
+        @arg assembly: The assembly
+        @type assembly: Assembly
+        @kwarg size: Maximum number of accession numbers and crossmappers to
+            keep.
+        @type size: int
+        """
+        chromosomes = assembly.chromosomes.all()
+        _detach(chromosomes)
+
+        self.assembly = assembly
+        self.size = size
+        self._chromosomes_by_name = {c.name: c for c in chromosomes}
+        self._chromosomes_by_accession = {c.accession: c for c in chromosomes}
+        self._mappings = OrderedDict()
+        self._crossmaps = OrderedDict()
+    #__init__
+
+    def chromosome_by_name(self, name):
+        """
+        Get a chromosome of the assembly by name.
+
+        @return: The chromosome, or None if it does not exist.
+        @rtype: Chromosome
+        """
+        return self._chromosomes_by_name.get(name)
+    #chromosome_by_name
+
+    def chromosome_by_accession(self, accession):
+        """
+        Get a chromosome of the assembly by accession number (including
+        version).
+
+        @return: The chromosome, or None if it does not exist.
+        @rtype: Chromosome
+        """
+        return self._chromosomes_by_accession.get(accession)
+    #chromosome_by_accession
+
+    def transcript_mappings(self, accession):
+        """
+        Get all transcript mappings on the assembly for an accession number
+        (without version), ordered by chromosome name.
+
+        @return: The transcript mappings (with their chromosomes loaded).
+        @rtype: list(TranscriptMapping)
+        """
+        try:
+            mappings = self._mappings.pop(accession)
+        except KeyError:
+            mappings = TranscriptMapping.query \
+                .join(Chromosome) \
+                .options(joinedload(TranscriptMapping.chromosome)) \
+                .filter(TranscriptMapping.accession == accession,
+                        Chromosome.assembly == self.assembly) \
+                .order_by(Chromosome.name.asc()) \
+                .all()
+            _detach(mappings)
+            _detach(set(m.chromosome for m in mappings))
+            if len(self._mappings) >= self.size:
+                self._mappings.popitem(last=False)
+        self._mappings[accession] = mappings
+        return mappings
+    #transcript_mappings
+
+    def crossmap(self, mapping):
+        """
+        Get the crossmapper for a transcript mapping.
+
+        @arg mapping: Transcript mapping
+        @type mapping: TranscriptMapping
+
+        @return: Cross ; A Crossmap object
+        @rtype: object
+        """
+        try:
+            crossmap = self._crossmaps.pop(mapping.id)
+        except KeyError:
+            crossmap = _make_crossmap(mapping)
+            if len(self._crossmaps) >= self.size:
+                self._crossmaps.popitem(last=False)
+        self._crossmaps[mapping.id] = crossmap
+        return crossmap
+    #crossmap
+#ConverterCache
+
+
 class Converter(object) :
     """
     Convert between transcript and chromosomal locations.
@@ -110,7 +245,7 @@ class Converter(object) :
     @todo: Refactor anything using {mutalyzer.models} into the {webservice}
     module.
     """
-    def __init__(self, assembly, O) :
+    def __init__(self, assembly, O, cache=None) :
         """
         Initialise the class.
 
@@ -119,9 +254,13 @@ class Converter(object) :
         @type assembly: string
         @arg O: output object
         @type O: object
+        @kwarg cache: Optional cache of database lookups and crossmappers for
+            this assembly, shared by several converters.
+        @type cache: ConverterCache
         """
         self.assembly = assembly
         self.__output = O
+        self.cache = cache
 
         # Populated arguments
         self.parseTree = None
@@ -173,9 +312,13 @@ class Converter(object) :
         @kwarg selector_version: Optional transcript version selector.
         @type selector_version: int
         """
-        versions = [m.version for m in TranscriptMapping.query.filter(
-                      TranscriptMapping.accession == acc,
-                      TranscriptMapping.chromosome.has(assembly=self.assembly))]
+        if self.cache:
+            cached = self.cache.transcript_mappings(acc)
+            versions = [m.version for m in cached]
+        else:
+            versions = [m.version for m in TranscriptMapping.query.filter(
+                          TranscriptMapping.accession == acc,
+                          TranscriptMapping.chromosome.has(assembly=self.assembly))]
 
         if not versions:
             self.__output.addMessage(__file__, 4, "EACCNOTINDB",
@@ -186,23 +329,34 @@ class Converter(object) :
             return
 
         if version in versions:
-            mappings = TranscriptMapping.query.join(Chromosome).filter(
-                TranscriptMapping.accession == acc,
-                TranscriptMapping.version == version,
-                Chromosome.assembly == self.assembly)
-            if selector:
-                mappings = mappings.filter(TranscriptMapping.gene == selector)
-            if selector_version:
-                mappings = mappings.filter(TranscriptMapping.transcript == selector_version)
-
-            # Todo: The 'order by chrom asc' is a quick hack to make sure we
-            #   first get a primary assembly mapping instead of some haplotype
-            #   mapping for genes in the HLA cluster.
-            #   A better fix is to return the entire list of mappings, and/or
-            #   remove all secondary mappings for the HLA cluster.
-            #   See also test_converter.test_hla_cluster and bug #58.
-            mapping = mappings.order_by(TranscriptMapping.version.desc(),
-                                             Chromosome.name.asc()).first()
+            if self.cache:
+                # Cached mappings are ordered by chromosome name, see the
+                # note on the query below.
+                mapping = next(
+                    (m for m in cached
+                     if m.version == version and
+                     (not selector or m.gene == selector) and
+                     (not selector_version or
+                      m.transcript == selector_version)),
+                    None)
+            else:
+                mappings = TranscriptMapping.query.join(Chromosome).filter(
+                    TranscriptMapping.accession == acc,
+                    TranscriptMapping.version == version,
+                    Chromosome.assembly == self.assembly)
+                if selector:
+                    mappings = mappings.filter(TranscriptMapping.gene == selector)
+                if selector_version:
+                    mappings = mappings.filter(TranscriptMapping.transcript == selector_version)
+
+                # Todo: The 'order by chrom asc' is a quick hack to make sure
+                #   we first get a primary assembly mapping instead of some
+                #   haplotype mapping for genes in the HLA cluster.
+                #   A better fix is to return the entire list of mappings,
+                #   and/or remove all secondary mappings for the HLA cluster.
+                #   See also test_converter.test_hla_cluster and bug #58.
+                mapping = mappings.order_by(TranscriptMapping.version.desc(),
+                                            Chromosome.name.asc()).first()
 
             if not mapping:
                 self.__output.addMessage(
@@ -264,15 +418,10 @@ class Converter(object) :
         if not self.mapping:
             return None
 
-        # Create Mutalyzer compatible exon list.
-        mrna = []
-        for exon in zip(self.mapping.exon_starts, self.mapping.exon_stops):
-            mrna.extend(exon)
-
-        cds = self.mapping.cds or []
-        orientation = 1 if self.mapping.orientation == 'forward' else -1
-
-        self.crossmap = Crossmap.Crossmap(mrna, cds, orientation)
+        if self.cache:
+            self.crossmap = self.cache.crossmap(self.mapping)
+        else:
+            self.crossmap = _make_crossmap(self.mapping)
         return self.crossmap
     #makeCrossmap
 
@@ -606,21 +755,29 @@ class Converter(object) :
 
         This only works for positions on transcript references in c. notation.
         """
-        versions = [m.version for m in TranscriptMapping.query.filter(
-                      TranscriptMapping.accession == reference,
-                      TranscriptMapping.version != None,
-                      TranscriptMapping.chromosome.has(assembly=self.assembly))]
+        if self.cache:
+            # Cached mappings are ordered by chromosome name.
+            self.mapping = next(
+                (m for m in self.cache.transcript_mappings(reference)
+                 if m.version is not None and m.version == version), None)
+            if not self.mapping:
+                return None
+        else:
+            versions = [m.version for m in TranscriptMapping.query.filter(
+                          TranscriptMapping.accession == reference,
+                          TranscriptMapping.version != None,
+                          TranscriptMapping.chromosome.has(assembly=self.assembly))]
 
-        if version not in versions:
-            return None
+            if version not in versions:
+                return None
 
-        self.mapping = TranscriptMapping.query \
-            .join(Chromosome) \
-            .filter(TranscriptMapping.accession == reference,
-                    TranscriptMapping.version == version,
-                    Chromosome.assembly == self.assembly) \
-            .order_by(TranscriptMapping.version.desc(),
-                      Chromosome.name.asc()).first()
+            self.mapping = TranscriptMapping.query \
+                .join(Chromosome) \
+                .filter(TranscriptMapping.accession == reference,
+                        TranscriptMapping.version == version,
+                        Chromosome.assembly == self.assembly) \
+                .order_by(TranscriptMapping.version.desc(),
+                          Chromosome.name.asc()).first()
 
         if not self.mapping:
             return
@@ -662,8 +819,11 @@ class Converter(object) :
         if variant.startswith('chr') and ':' in variant:
             preco, postco = variant.split(':', 1)
 
-            chromosome = Chromosome.query.filter_by(assembly=self.assembly,
-                                                    name=preco).first()
+            if self.cache:
+                chromosome = self.cache.chromosome_by_name(preco)
+            else:
+                chromosome = Chromosome.query.filter_by(assembly=self.assembly,
+                                                        name=preco).first()
             if not chromosome:
                 self.__output.addMessage(__file__, 4, "ENOTINDB",
                     "Accession number %s could not be found in our database "
@@ -696,9 +856,13 @@ class Converter(object) :
         acc = self.parseTree.LrgAcc or self.parseTree.RefSeqAcc
         version = self.parseTree.Version
 
-        chromosome = Chromosome.query \
-            .filter_by(assembly=self.assembly,
-                       accession='%s.%s' % (acc, version)).first()
+        if self.cache:
+            chromosome = self.cache.chromosome_by_accession(
+                '%s.%s' % (acc, version))
+        else:
+            chromosome = Chromosome.query \
+                .filter_by(assembly=self.assembly,
+                           accession='%s.%s' % (acc, version)).first()
         if not chromosome :
             self.__output.addMessage(__file__, 4, "ENOTINDB",
                 "Accession number %s could not be found in our database or is "
@@ -731,13 +895,16 @@ class Converter(object) :
             min_loc = min(min_loc, loc)
             max_loc = max(max_loc, loc2)
 
+        # Note: We don't use `chromosome.transcript_mappings` here, since a
+        # cached chromosome is not in the session.
+        mappings = TranscriptMapping.query.filter_by(chromosome_id=chromosome.id)
         if gene:
-            mappings = chromosome.transcript_mappings.filter_by(gene=gene)
+            mappings = mappings.filter_by(gene=gene)
         else:
             start = max(min_loc - 5000, 1)
             stop = min(max_loc + 5000, binning.MAX_POSITION + 1)
             bins = binning.overlapping_bins(start - 1, stop)
-            mappings = chromosome.transcript_mappings.filter(
+            mappings = mappings.filter(
                 TranscriptMapping.bin.in_(bins),
                 TranscriptMapping.start <= stop,
                 TranscriptMapping.stop >= start
@@ -18,6 +18,7 @@ from collections import defaultdict
 
 from Bio import Restriction
 
+from mutalyzer import sequence
 from mutalyzer import util
 
 
@@ -45,7 +46,7 @@ class Mutator():
         Initialise the instance with the original sequence.
 
         @arg orig: The original sequence before mutation.
-        @type orig: Bio.Seq.Seq
+        @type orig: Bio.Seq.Seq or mutalyzer.sequence.LazySequence
         @arg output: The output object.
         @type output: mutalyzer.Output.Output
         """
@@ -57,7 +58,8 @@ class Mutator():
         self.orig = orig
 
         # Note that we don't need to create a copy here, since mutation
-        # operations are not in place (`self._mutate`).
+        # operations are not in place (`self._mutate`). If the sequence is
+        # lazy (see `mutalyzer.sequence`), so is the mutated sequence.
         self.mutated = orig
     #__init__
 
@@ -342,9 +344,10 @@ class Mutator():
         @type ins: unicode
         """
         correct = 1 if pos1 == pos2 else 0
-        self.mutated = (self.mutated[:self.shift(pos1 + 1) - 1] +
-                        ins +
-                        self.mutated[self.shift(pos2 + correct) - correct:])
+        self.mutated = sequence.replace(self.mutated,
+                                        self.shift(pos1 + 1) - 1,
+                                        self.shift(pos2 + correct) - correct,
+                                        ins)
 
         self._add_shift(pos2 + 1, pos1 - pos2 + len(ins))
     #_mutate
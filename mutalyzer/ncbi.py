@@ -9,6 +9,7 @@ from xml.parsers import expat
 
 from Bio import Entrez
 
+from . import entrez
 from .config import settings
 from .redisclient import client as redis
 
@@ -76,10 +77,6 @@ def _get_link_from_ncbi(source_db, target_db, match_link_name,
     # At the moment (2016-06-01) only GIs are returned by the calls we use
     # below, so we cannot move to `accession.version` here. This is fine for
     # now, but should be reconsidered at some point.
-    Entrez.email = settings.EMAIL
-    if hasattr(settings, 'ENTREZ_API_KEY'):
-        Entrez.api_key = settings.ENTREZ_API_KEY
-
     # If we are currently strictly matching on version, we can try again if
     # no result is found. Otherwise, we just report failure.
     def fail_or_retry():
@@ -96,7 +93,7 @@ def _get_link_from_ncbi(source_db, target_db, match_link_name,
 
     # Find source record.
     try:
-        handle = Entrez.esearch(db=source_db, term=source)
+        handle = entrez.esearch(db=source_db, term=source)
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
         return fail_or_retry()
@@ -116,7 +113,7 @@ def _get_link_from_ncbi(source_db, target_db, match_link_name,
 
     # Find link from source record to target record.
     try:
-        handle = Entrez.elink(dbfrom=source_db, db=target_db, id=source_gi)
+        handle = entrez.elink(dbfrom=source_db, db=target_db, id=source_gi)
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
         return fail_or_retry()
@@ -141,7 +138,7 @@ def _get_link_from_ncbi(source_db, target_db, match_link_name,
 
     # Get target record.
     try:
-        handle = Entrez.efetch(
+        handle = entrez.efetch(
             db=target_db, id=target_gi, rettype='acc', retmode='text')
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
@@ -344,12 +341,22 @@ def _get_snp_from_ncbi(rsid):
     :param rsid: The rs# of the dbSNP record (e.g., `rs9919552`).
     :return: response_text(str)
     """
-    Entrez.email = settings.EMAIL
-    if hasattr(settings, 'ENTREZ_API_KEY'):
-        Entrez.api_key = settings.ENTREZ_API_KEY
+    return _get_snps_from_ncbi([rsid])
+
 
+def _get_snps_from_ncbi(rsids):
+    """
+    Connects to the Entrez DB to fetch the annotated SNP records for several
+    rs#'s in one request.
+
+    :param rsids: The rs#'s of the dbSNP records (e.g.,
+      `['rs9919552', 'rs1']`).
+    :return: response_text(str)
+    """
     try:
-        response = Entrez.efetch(db='snp', id=rsid[2:], retmode='xml')
+        response = entrez.efetch(db='snp',
+                                 id=','.join(rsid[2:] for rsid in rsids),
+                                 retmode='xml')
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
         raise ServiceError()
@@ -363,10 +370,91 @@ def _get_snp_from_ncbi(rsid):
     return response_text
 
 
+def _descriptions_from_docsum(docsum):
+    """
+    Extract the HGVS descriptions from the DOCSUM field of a dbSNP record.
+    """
+    for part in docsum.split('|'):
+        if part.startswith('HGVS='):
+            return part.split('=')[1].split(',')
+    return []
+
+
+def _get_descriptions_from_cache(rsid):
+    """
+    Retrieve the HGVS descriptions for a dbSNP rs# from the cache.
+
+    :returns: List of HGVS descriptions, or `None` if they are not in the
+      cache.
+    :rtype: list(str)
+    """
+    descriptions = redis.get('ncbi:rsid-to-descriptions:%s' % rsid)
+    if descriptions is None:
+        return None
+    return descriptions.split('|') if descriptions else []
+
+
+def _cache_descriptions(rsid, descriptions):
+    """
+    Store the HGVS descriptions for a dbSNP rs# in the cache.
+
+    The cache value expires in `DBSNP_CACHE_EXPIRATION` seconds.
+    """
+    redis.setex('ncbi:rsid-to-descriptions:%s' % rsid,
+                settings.DBSNP_CACHE_EXPIRATION, '|'.join(descriptions))
+
+
+def prefetch_rsid_descriptions(rsids):
+    """
+    Fetch and cache the annotated HGVS descriptions for a number of dbSNP
+    rs#'s, so subsequent calls to :func:`rsid_to_descriptions` for them do
+    not have to communicate with dbSNP.
+
+    Records are requested in chunks of `DBSNP_FETCH_CHUNK_SIZE` rs#'s per
+    Entrez request. Invalid and already cached rs#'s are ignored, as are
+    communication errors and rs#'s that are not found. For those,
+    :func:`rsid_to_descriptions` will fall back to a separate request and
+    report any errors.
+
+    :arg rsids: The rs#'s of the dbSNP records (e.g., `rs9919552`).
+    :type rsids: iterable(str)
+    """
+    todo = []
+    for rsid in rsids:
+        if (rsid.startswith('rs') and rsid[2:].isdigit() and
+                rsid not in todo and
+                _get_descriptions_from_cache(rsid) is None):
+            todo.append(rsid)
+
+    for start in range(0, len(todo), settings.DBSNP_FETCH_CHUNK_SIZE):
+        chunk = todo[start:start + settings.DBSNP_FETCH_CHUNK_SIZE]
+
+        try:
+            response_text = _get_snps_from_ncbi(chunk)
+            doc = minidom.parseString(response_text)
+        except (ServiceError, expat.ExpatError):
+            # TODO: Log error.
+            continue
+
+        for record in doc.getElementsByTagName('DocumentSummary'):
+            rsid = 'rs' + record.getAttribute('uid')
+            if rsid not in chunk:
+                continue
+            try:
+                docsum = record.getElementsByTagName('DOCSUM')[0] \
+                    .childNodes[0].data
+            except IndexError:
+                continue
+            _cache_descriptions(rsid, _descriptions_from_docsum(docsum))
+
+
 def rsid_to_descriptions(rsid, output):
     """
     Return all annotated HGVS descriptions for a given dbSNP rs#.
 
+    Descriptions are retrieved from dbSNP using the Entrez API and cached in
+    Redis for `DBSNP_CACHE_EXPIRATION` seconds.
+
     :arg str rsid: The rs# of the dbSNP record (e.g., `rs9919552`).
 
     :raises ServiceError: On error in Entrez communication.
@@ -381,6 +469,10 @@ def rsid_to_descriptions(rsid, output):
                           'Incorrect RSID input format.')
         return []
 
+    descriptions = _get_descriptions_from_cache(rsid)
+    if descriptions is not None:
+        return descriptions
+
     # Get the NCBI Entrez DB response.
     try:
         response_text = _get_snp_from_ncbi(rsid)
@@ -410,7 +502,6 @@ def rsid_to_descriptions(rsid, output):
                           % rsid)
         return []
 
-    for part in docsum.split('|'):
-        if part.startswith('HGVS='):
-            return part.split('=')[1].split(',')
-    return []
+    descriptions = _descriptions_from_docsum(docsum)
+    _cache_descriptions(rsid, descriptions)
+    return descriptions
@@ -0,0 +1,342 @@
+"""
+Streaming reader for GenBank flat files, reading only what
+:meth:`mutalyzer.parsers.genbank.GBparser.create_record` uses.
+
+BioPython's GenBank parser (`SeqIO.read(handle, 'genbank')`) builds a
+:class:`Bio.SeqFeature.SeqFeature` object with all qualifiers for every
+feature, including the many features we ignore (e.g., `variation`,
+`misc_feature`, `repeat_region`). Here, we only build feature objects for
+the feature types in :data:`FEATURE_TYPES` and only keep the values of the
+qualifiers in :data:`QUALIFIERS`. The sequence is read straight into a
+buffer.
+
+The result mimics the parts of a :class:`Bio.SeqRecord.SeqRecord` that are
+used by :meth:`create_record`, with the same values BioPython would give
+(feature locations are even parsed by BioPython). Records that cannot be
+read this way (e.g., contig records without sequence) raise a
+:exc:`ValueError`, the caller should use BioPython for those.
+"""
+
+
+from __future__ import unicode_literals
+
+import re
+import warnings
+
+from Bio.Alphabet import IUPAC
+from Bio import Alphabet
+from Bio import BiopythonParserWarning
+from Bio.GenBank import _FeatureConsumer
+from Bio.Seq import Seq
+from Bio.SeqFeature import SeqFeature
+
+
+#: Feature types that are read, other features are skipped.
+FEATURE_TYPES = frozenset(['source', 'gene', 'mRNA', 'misc_RNA', 'ncRNA',
+                           'rRNA', 'tRNA', 'tmRNA', 'CDS', 'exon'])
+
+#: Qualifiers of which the values are read. Other qualifiers are present in
+#: the `qualifiers` dictionary of the feature, but with no values.
+QUALIFIERS = frozenset(['gene', 'mol_type', 'organelle', 'locus_tag',
+                        'transcript_id', 'protein_id', 'product',
+                        'transl_table'])
+
+# Header keywords are in the first 12 columns, feature keys are in columns 6
+# to 21 and feature locations and qualifiers start at column 22.
+HEADER_WIDTH = 12
+HEADER_SPACER = b' ' * HEADER_WIDTH
+FEATURE_INDENT = 21
+FEATURE_SPACER = b' ' * FEATURE_INDENT
+
+# Keywords of the lines that end the feature table.
+SEQUENCE_HEADERS = frozenset([b'CONTIG', b'ORIGIN', b'BASE COUNT', b'WGS'])
+
+# Characters that are not part of the sequence on sequence lines.
+SEQUENCE_DELETE = b'0123456789 \t\r\n'
+
+
+class FlatRecord(object):
+    """
+    The parts of a GenBank record used by :meth:`create_record`. This
+    mimics a :class:`Bio.SeqRecord.SeqRecord`.
+    """
+    def __init__(self):
+        self.id = None
+        self.name = None
+        self.annotations = {}
+        self.features = []
+        self.seq = None
+
+
+def _decode(data):
+    return data.decode('utf-8')
+
+
+def _alphabet(seq_type, sequence):
+    """
+    Alphabet for a sequence type from the LOCUS line, like BioPython.
+    """
+    if not seq_type:
+        return Alphabet.generic_alphabet
+    if 'DNA' in seq_type.upper() or 'MRNA' in seq_type.upper():
+        return IUPAC.ambiguous_dna
+    if 'RNA' in seq_type.upper():
+        if b'T' in sequence and b'U' not in sequence:
+            return IUPAC.ambiguous_dna
+        return IUPAC.ambiguous_rna
+    if 'PROTEIN' in seq_type.upper():
+        return IUPAC.protein
+    if seq_type in ('circular', 'linear', 'unspecified'):
+        return Alphabet.generic_alphabet
+    raise ValueError('Could not determine alphabet for seq_type %s'
+                     % seq_type)
+
+
+def _locus(record, line):
+    """
+    Read the name, length and sequence type from the LOCUS line.
+    """
+    fields = _decode(line).split()
+    for index, field in enumerate(fields):
+        if field in ('bp', 'aa') and index >= 2:
+            break
+    else:
+        raise ValueError('Unsupported LOCUS line: %s' % line)
+
+    record.name = fields[1]
+    size = int(fields[index - 1])
+    if field == 'aa':
+        seq_type = 'PROTEIN'
+    elif index + 1 < len(fields):
+        seq_type = fields[index + 1]
+    else:
+        seq_type = ''
+    return size, seq_type
+
+
+def _accessions(record, value):
+    """
+    Add accession numbers from the ACCESSION or VERSION line.
+    """
+    accessions = value.replace(';', ' ').split()
+    if 'accessions' in record.annotations:
+        for accession in accessions:
+            if accession not in record.annotations['accessions']:
+                record.annotations['accessions'].append(accession)
+    else:
+        record.annotations['accessions'] = accessions
+    if not record.id and record.annotations['accessions']:
+        record.id = record.annotations['accessions'][0]
+
+
+def _header(record, lines):
+    """
+    Read the header until the feature table or the sequence.
+
+    :returns: The length and sequence type from the LOCUS line, the version,
+      and the line that ended the header.
+    """
+    line = next(lines, b'')
+    while line and not line.strip():
+        line = next(lines, b'')
+    if not line.startswith(b'LOCUS'):
+        raise ValueError('Record does not start with a LOCUS line')
+    size, seq_type = _locus(record, line)
+
+    version = None
+    line = next(lines, b'')
+    while line:
+        keyword = line[:HEADER_WIDTH].strip()
+        if keyword == b'FEATURES' or keyword in SEQUENCE_HEADERS:
+            break
+        if line.startswith(b'//'):
+            raise ValueError('Record has no sequence')
+
+        value = line[HEADER_WIDTH:].strip()
+        line = next(lines, b'')
+
+        if keyword == b'ACCESSION':
+            while line.startswith(HEADER_SPACER):
+                value += b' ' + line[HEADER_WIDTH:].strip()
+                line = next(lines, b'')
+            _accessions(record, _decode(value))
+        elif keyword == b'VERSION':
+            value = _decode(b' '.join(value.split())).split(' GI:')[0]
+            if value.count('.') == 1 and value.split('.')[1].isdigit():
+                _accessions(record, value.split('.')[0])
+                version = int(value.split('.')[1])
+            elif value:
+                record.id = value
+        elif keyword == b'ORGANISM':
+            organism = value
+            lineage = False
+            while line.startswith(HEADER_SPACER):
+                if lineage or b';' in line:
+                    lineage = True
+                elif line[HEADER_WIDTH:].strip() != b'.':
+                    organism += b' ' + line[HEADER_WIDTH:].strip()
+                line = next(lines, b'')
+            record.annotations['organism'] = _decode(organism)
+
+    return size, seq_type, version, line
+
+
+def _feature(key, feature_lines, consumer):
+    """
+    Create a feature from its lines, like BioPython does.
+    """
+    iterator = (x for x in feature_lines if x)
+    try:
+        location = next(iterator).strip()
+        while location[-1:] == b',' or \
+                location.count(b'(') > location.count(b')'):
+            location += next(iterator).strip()
+
+        qualifiers = {}
+        key_name = None
+        for line_number, line in enumerate(iterator):
+            if line_number == 0 and line.startswith(b')'):
+                location += line.strip()
+            elif line[:1] == b'/':
+                i = line.find(b'=')
+                if i == -1:
+                    # Qualifier without value, e.g. /pseudo.
+                    key_name = _decode(line[1:])
+                    value = None
+                else:
+                    key_name = _decode(line[1:i])
+                    value = line[i + 1:]
+                    if value[:1] == b' ' and value.lstrip()[:1] == b'"':
+                        value = value.lstrip()
+                    if value[:1] == b'"' and value != b'"':
+                        value_list = [value]
+                        while value_list[-1][-1:] != b'"':
+                            value_list.append(next(iterator))
+                        value = b'\n'.join(value_list)
+                if key_name not in QUALIFIERS:
+                    qualifiers.setdefault(key_name, [])
+                elif value is None:
+                    qualifiers.setdefault(key_name, [''])
+                else:
+                    qualifiers.setdefault(key_name, []).append(value)
+            else:
+                # Unquoted continuation.
+                if key_name is None:
+                    raise ValueError('Problem with %s feature' % key)
+                if key_name in QUALIFIERS:
+                    qualifiers[key_name][-1] += b'\n' + line
+    except StopIteration:
+        raise ValueError('Problem with %s feature' % key)
+
+    feature = SeqFeature(type=key)
+    for key_name, values in qualifiers.items():
+        feature.qualifiers[key_name] = [
+            re.sub('^"|"$', '', _decode(value).replace('\n', ' '))
+            .replace('""', '"') if isinstance(value, bytes) else value
+            for value in values]
+
+    consumer._cur_feature = feature
+    consumer.location(_decode(location))
+    return feature
+
+
+def _features(record, line, lines, consumer):
+    """
+    Read the feature table.
+
+    :returns: The line that ended the feature table.
+    """
+    line = next(lines, b'')
+    while True:
+        if not line:
+            raise ValueError('Premature end of line during features table')
+        if line[:HEADER_WIDTH].rstrip() in SEQUENCE_HEADERS:
+            return line
+        line = line.rstrip()
+        if line == b'//':
+            raise ValueError('Premature end of features table')
+        if not line[2:FEATURE_INDENT].strip() or \
+                len(line) < FEATURE_INDENT:
+            line = next(lines, b'')
+            continue
+        if line[FEATURE_INDENT:FEATURE_INDENT + 1] != b' ' and \
+                b' ' in line[FEATURE_INDENT:]:
+            raise ValueError('Over indented feature')
+
+        key = _decode(line[2:FEATURE_INDENT].strip())
+        feature_lines = [line[FEATURE_INDENT:]]
+        keep = key in FEATURE_TYPES
+        line = next(lines, b'')
+        while line.startswith(FEATURE_SPACER) or \
+                (line and not line.strip()):
+            if keep:
+                feature_lines.append(line[FEATURE_INDENT:].strip())
+            line = next(lines, b'')
+        if keep:
+            record.features.append(_feature(key, feature_lines, consumer))
+
+
+def _sequence(line, lines):
+    """
+    Read the sequence after the ORIGIN line.
+
+    :returns: The sequence (uppercased).
+    :rtype: str
+    """
+    while line and line[:HEADER_WIDTH].rstrip() != b'ORIGIN':
+        if line[:HEADER_WIDTH].rstrip() in (b'CONTIG', b'WGS') or \
+                line.startswith(b'//'):
+            raise ValueError('Record has no sequence')
+        line = next(lines, b'')
+    if not line:
+        raise ValueError('Premature end of file')
+
+    chunks = []
+    for line in lines:
+        if line.startswith(b'//'):
+            break
+        chunks.append(line.translate(None, SEQUENCE_DELETE))
+    else:
+        raise ValueError('Premature end of file')
+
+    return b''.join(chunks).upper()
+
+
+def read(handle):
+    """
+    Read a GenBank record.
+
+    :arg file handle: Open GenBank flat file (binary, UTF-8 encoded).
+
+    :raises ValueError: If the record cannot be read (BioPython may still be
+      able to read it).
+
+    :returns: The record.
+    :rtype: FlatRecord
+    """
+    record = FlatRecord()
+    lines = iter(handle)
+
+    size, seq_type, version, line = _header(record, lines)
+
+    consumer = _FeatureConsumer(use_fuzziness=1)
+    consumer._seq_type = seq_type
+    consumer._expected_size = size
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', BiopythonParserWarning)
+        if line[:HEADER_WIDTH].rstrip() == b'FEATURES':
+            line = _features(record, line, lines, consumer)
+
+    sequence = _sequence(line, lines)
+    if not sequence:
+        raise ValueError('Record has no sequence')
+
+    if not record.id:
+        record.id = record.name
+    elif '.' not in record.id and version is not None:
+        record.id += '.%i' % version
+
+    record.seq = Seq(sequence.decode('ascii'),
+                     _alphabet(seq_type, sequence))
+    return record
@@ -7,14 +7,16 @@ mutalyzer GenRecord. Record populated with data from a GenBank file.
 from __future__ import unicode_literals
 
 import codecs
+import functools
 import re
-import bz2
 from itertools import izip_longest
 
 from Bio import SeqIO
 from Bio.Alphabet import ProteinAlphabet
 
+from .. import compression
 from .. import ncbi
+from . import flatfile
 from ..GenRecord import PList, Locus, Gene, Record
 
 
@@ -448,21 +450,213 @@ class GBparser():
         #for
     #link
 
-    def create_record(self, filename):
+    def __addTranscripts(self, myGene, myRealGene):
+        """
+        Link the mRNA and CDS features of a gene and add the resulting
+        transcripts to its Gene object.
+
+        @arg myGene: The features of the gene
+        @type myGene: tempGene
+        @arg myRealGene: The Gene object
+        @type myRealGene: GenRecord.Gene
+        """
+        self.link(myGene.rnaList, myGene.cdsList)
+        for i in myGene.rnaList :
+            version = myRealGene.newLocusTag()
+            # TODO: Here we discard transcripts that are not complete
+            # in this reference, but it might be nicer to still keep
+            # them so that we can (for example) show them in the
+            # legend. Of course they should still not be allowed to be
+            # selected in the variant description.
+            # (Same for leftover CDS features below.)
+            if i.usable :
+                if i.locus_tag :
+                    # Note: We use the last three characters of the
+                    # locus_tag as a unique transcript version id.
+                    # This is also used to for the protein-transcript
+                    # link table.
+                    # Normally, locus_tag ends with three digits, but
+                    # for some (e.g. mobA on NC_011228, a plasmid) it
+                    # ends with two digits prepended with an
+                    # underscore. Or prepended with a letter. We
+                    # really want a number, so 'fix' this by only
+                    # looking for a numeric part.
+                    # (Same for leftover CDS features below.)
+                    try:
+                        version = LOCUS_TAG_VERSION.findall(
+                            i.locus_tag)[0].zfill(3)
+                    except IndexError:
+                        pass
+                myTranscript = Locus(version)
+                myTranscript.mRNA = PList()
+                myTranscript.mRNA.positionList = i.positionList
+                myTranscript.mRNA.location = i.location
+                myTranscript.transcribe = True
+                myTranscript.transcriptID = i.transcript_id
+                myTranscript.transcriptProduct = i.product
+                myTranscript.locusTag = i.locus_tag
+                if i.link :
+                    myTranscript.CDS = PList()
+                    myTranscript.CDS.positionList = i.link.positionList
+                    myTranscript.CDS.location = i.link.location
+                    myTranscript.translate = True
+                    myTranscript.proteinID = i.link.protein_id
+                    myTranscript.linkMethod = i.linkMethod
+                    myTranscript.proteinProduct = i.link.product
+                    if i.link.qualifiers.has_key("transl_table") :
+                        myTranscript.txTable = \
+                            int(i.qualifiers["transl_table"][0])
+                #if
+                myRealGene.transcriptList.append(myTranscript)
+            #if
+        #for
+
+        # We now look for leftover CDS entries that were not linked to
+        # any transcript. We add them and the RNA will be constructed
+        # for them later.
+        # This does mean that these transcripts always come last (and
+        # are shown last in for example the legend).
+        for i in myGene.cdsList :
+            if not i.linked:
+                version = myRealGene.newLocusTag()
+                if i.usable:
+                    if i.locus_tag :
+                        try:
+                            version = LOCUS_TAG_VERSION.findall(
+                                i.locus_tag)[0].zfill(3)
+                        except IndexError:
+                            pass
+                    myTranscript = Locus(version)
+                    myTranscript.CDS = PList()
+                    myTranscript.CDS.positionList = i.positionList
+                    myTranscript.CDS.location = i.location
+                    myTranscript.proteinID = i.protein_id
+                    myTranscript.proteinProduct = i.product
+                    if i.qualifiers.has_key("transl_table") :
+                        myTranscript.txTable = \
+                            int(i.qualifiers["transl_table"][0])
+                    myRealGene.transcriptList.append(myTranscript)
+                #if
+            #if
+        #for
+    #__addTranscripts
+
+    def __loadGenes(self, genes, geneDict, record, names):
+        """
+        Add the transcripts of indexed genes to their Gene objects and add
+        these to the gene list of the record (see GenRecord.Record.loadGenes).
+
+        @arg genes: All Gene objects of the record, in record order
+        @type genes: list(GenRecord.Gene)
+        @arg geneDict: The features of all genes, by name
+        @type geneDict: dict(unicode, tempGene)
+        @arg record: The record
+        @type record: GenRecord.Record
+        @arg names: Names of the genes to load
+        @type names: list(unicode)
+        """
+        for myRealGene in genes:
+            if myRealGene.name in names:
+                self.__addTranscripts(geneDict[myRealGene.name], myRealGene)
+
+        loaded = dict((gene.name, gene) for gene in record.geneList)
+        record.geneList = [loaded.get(gene.name, gene) for gene in genes
+                           if gene.name in loaded or
+                           (gene.name in names and gene.transcriptList)]
+    #__loadGenes
+
+    def __selectGenes(self, genes, geneDict, selection, region):
+        """
+        Names of the genes selected by name, transcript or protein accession
+        number, or location.
+
+        @arg genes: All Gene objects of the record
+        @type genes: list(GenRecord.Gene)
+        @arg geneDict: The features of all genes, by name
+        @type geneDict: dict(unicode, tempGene)
+        @arg selection: Gene names and accession numbers (with version)
+        @type selection: iterable(unicode)
+        @arg region: Start and stop position (one-based, inclusive)
+        @type region: tuple(int)
+
+        @return: The selected gene names
+        @rtype: set(unicode)
+        """
+        selection = set(selection or [])
+        selected = set()
+        for gene in genes:
+            if gene.name in selection or \
+               self.__accessions(geneDict[gene.name]) & selection:
+                selected.add(gene.name)
+            elif region and gene.location and \
+                 gene.location[0] <= region[1] and \
+                 region[0] <= gene.location[1]:
+                selected.add(gene.name)
+        return selected
+    #__selectGenes
+
+    def __accessions(self, myGene):
+        """
+        Accession numbers of the transcripts and proteins of a gene.
+
+        @arg myGene: The features of the gene
+        @type myGene: tempGene
+
+        @return: Accession numbers (with version)
+        @rtype: set(unicode)
+        """
+        accessions = set()
+        for i in myGene.rnaList + myGene.cdsList:
+            accessions.update(i.qualifiers.get("transcript_id", []))
+            accessions.update(i.qualifiers.get("protein_id", []))
+        return accessions
+    #__accessions
+
+    def create_record(self, filename, native=True, genes=None,
+                      region=None):
         """
         Create a GenRecord.Record from a GenBank file
 
+        Linking the transcripts and proteins of a gene can take some time
+        (it may need to query the NCBI), which adds up for records with many
+        genes. If only some genes are needed, they can be selected by name,
+        by accession number of one of their transcripts or proteins, or by
+        location. Only for the selected genes, transcripts are added to the
+        record. The other genes are indexed and added when they are looked up
+        or when all genes are listed (see GenRecord.Record.loadGenes).
+
         @arg filename: The full path to the compressed GenBank file
         @type filename: unicode
+        @arg native: Read the file with our own reader (see
+            mutalyzer.parsers.flatfile) instead of with BioPython. Files our
+            reader cannot read are always read with BioPython.
+        @type native: bool
+        @arg genes: Select genes by name or by accession number (with
+            version) of one of their transcripts or proteins. By default, all
+            genes are added.
+        @type genes: iterable(unicode)
+        @arg region: Select genes overlapping this region, given as start and
+            stop position (one-based, inclusive).
+        @type region: tuple(int)
 
         @return: A GenRecord.Record instance
         @rtype: object (record)
         """
-        # first create an intermediate genbank record with BioPython
-        file_handle = bz2.BZ2File(filename, "r")
-        file_handle = codecs.getreader('utf-8')(file_handle)
-        biorecord = SeqIO.read(file_handle, "genbank")
-        file_handle.close()
+        # first create an intermediate genbank record
+        biorecord = None
+        if native:
+            file_handle = compression.open(filename)
+            try:
+                biorecord = flatfile.read(file_handle)
+            except ValueError:
+                pass
+            finally:
+                file_handle.close()
+        if biorecord is None:
+            file_handle = compression.open(filename)
+            file_handle = codecs.getreader('utf-8')(file_handle)
+            biorecord = SeqIO.read(file_handle, "genbank")
+            file_handle.close()
 
         record = Record()
         record.seq = biorecord.seq
@@ -492,10 +686,10 @@ class GBparser():
             #     UD sliced from a chromosome. We can get the same information
             #     for NM references from our mapping database and that way
             #     also provide chromosomal variant descriptions for those.
-            region = accInfo[2]
-            if "complement" in region :
+            chromRegion = accInfo[2]
+            if "complement" in chromRegion :
                 record.orientation = -1
-                record.chromOffset = int(region.split('.')[2][:-1])
+                record.chromOffset = int(chromRegion.split('.')[2][:-1])
             #if
             else :
                 record.chromOffset = int(accInfo[2].split('.')[0])
@@ -557,90 +751,23 @@ class GBparser():
             #if
         #for
         if record.molType in ['g', 'm'] :
-            for j in geneDict.keys() :
-                myGene = geneDict[j]
-                self.link(myGene.rnaList, myGene.cdsList)
-                for i in myGene.rnaList :
-                    myRealGene = record.findGene(i.gene)
-                    version = myRealGene.newLocusTag()
-                    # TODO: Here we discard transcripts that are not complete
-                    # in this reference, but it might be nicer to still keep
-                    # them so that we can (for example) show them in the
-                    # legend. Of course they should still not be allowed to be
-                    # selected in the variant description.
-                    # (Same for leftover CDS features below.)
-                    if i.usable :
-                        if i.locus_tag :
-                            # Note: We use the last three characters of the
-                            # locus_tag as a unique transcript version id.
-                            # This is also used to for the protein-transcript
-                            # link table.
-                            # Normally, locus_tag ends with three digits, but
-                            # for some (e.g. mobA on NC_011228, a plasmid) it
-                            # ends with two digits prepended with an
-                            # underscore. Or prepended with a letter. We
-                            # really want a number, so 'fix' this by only
-                            # looking for a numeric part.
-                            # (Same for leftover CDS features below.)
-                            try:
-                                version = LOCUS_TAG_VERSION.findall(
-                                    i.locus_tag)[0].zfill(3)
-                            except IndexError:
-                                pass
-                        myTranscript = Locus(version)
-                        myTranscript.mRNA = PList()
-                        myTranscript.mRNA.positionList = i.positionList
-                        myTranscript.mRNA.location = i.location
-                        myTranscript.transcribe = True
-                        myTranscript.transcriptID = i.transcript_id
-                        myTranscript.transcriptProduct = i.product
-                        myTranscript.locusTag = i.locus_tag
-                        if i.link :
-                            myTranscript.CDS = PList()
-                            myTranscript.CDS.positionList = i.link.positionList
-                            myTranscript.CDS.location = i.link.location
-                            myTranscript.translate = True
-                            myTranscript.proteinID = i.link.protein_id
-                            myTranscript.linkMethod = i.linkMethod
-                            myTranscript.proteinProduct = i.link.product
-                            if i.link.qualifiers.has_key("transl_table") :
-                                myTranscript.txTable = \
-                                    int(i.qualifiers["transl_table"][0])
-                        #if
-                        myRealGene.transcriptList.append(myTranscript)
-                    #if
-                #for
-
-                # We now look for leftover CDS entries that were not linked to
-                # any transcript. We add them and the RNA will be constructed
-                # for them later.
-                # This does mean that these transcripts always come last (and
-                # are shown last in for example the legend).
-                for i in myGene.cdsList :
-                    if not i.linked:
-                        myRealGene = record.findGene(i.gene)
-                        version = myRealGene.newLocusTag()
-                        if i.usable:
-                            if i.locus_tag :
-                                try:
-                                    version = LOCUS_TAG_VERSION.findall(
-                                        i.locus_tag)[0].zfill(3)
-                                except IndexError:
-                                    pass
-                            myTranscript = Locus(version)
-                            myTranscript.CDS = PList()
-                            myTranscript.CDS.positionList = i.positionList
-                            myTranscript.CDS.location = i.location
-                            myTranscript.proteinID = i.protein_id
-                            myTranscript.proteinProduct = i.product
-                            if i.qualifiers.has_key("transl_table") :
-                                myTranscript.txTable = \
-                                    int(i.qualifiers["transl_table"][0])
-                            myRealGene.transcriptList.append(myTranscript)
-                        #if
-                    #if
-                #for
-            #for
+            if genes is None and region is None :
+                selected = set(geneDict)
+            else :
+                selected = self.__selectGenes(record.geneList, geneDict,
+                                              genes, region)
+                for myRealGene in record.geneList :
+                    if myRealGene.name not in selected :
+                        record.geneIndex[myRealGene.name] = \
+                            self.__accessions(geneDict[myRealGene.name])
+                        record.geneRegions[myRealGene.name] = \
+                            myRealGene.location
+                record.geneLoader = functools.partial(
+                    self.__loadGenes, list(record.geneList), geneDict)
+            for myRealGene in record.geneList :
+                if myRealGene.name in selected :
+                    self.__addTranscripts(geneDict[myRealGene.name],
+                                          myRealGene)
         #if
         else :
             if geneDict :
@@ -16,16 +16,18 @@ More information on LRG files:
     http://ftp.ebi.ac.uk/pub/databases/lrgex/LRG.rnc
     http://ftp.ebi.ac.uk/pub/databases/lrgex/docs/LRG.pdf
 
-This module is based on the result of the minidom xml parser.
-
-NOTE: A strong alternative to the minidom parser would be lxml, which is
-already employed by Mutalyzer in other circumstances.
+The file is parsed incrementally with lxml (`iterparse`). Each top-level
+part of the fixed and updatable sections (e.g., a transcript) is discarded
+after we have read what we need from it, so we never keep the complete
+document in memory.
 """
 
 
 from __future__ import unicode_literals
 
-import xml.dom.minidom
+import io
+
+from lxml import etree
 from Bio.Seq import Seq
 from Bio.Alphabet import IUPAC
 
@@ -34,28 +36,29 @@ from mutalyzer import GenRecord
 
 def _get_content(data, refname):
     """
-    Return string-content of an XML textnode.
+    Return string-content of an XML element.
 
-    @arg data:     a minidom object
+    @arg data:     an lxml element
     @type data:    object
-    @arg refname:  the name of a member of the minidom object
+    @arg refname:  the tag name of a descendant of the element
     @type refname: unicode
 
-    @return: The content of the textnode or an emtpy string
-    @rtype: string
+    @return: The content of the first descendant with this tag name or an
+        empty string
+    @rtype: unicode
     """
-    temp = data.getElementsByTagName(refname)
-    if temp:
-        return temp[0].lastChild.data
+    temp = data.find('.//' + refname)
+    if temp is not None and temp.text:
+        return unicode(temp.text)
     return ""
 #_get_content
 
 
 def _attr2dict(attr):
     """
-    Create a dictionary from the attributes of an XML node
+    Create a dictionary from the attributes of an XML element
 
-    @arg attr: a minidom node
+    @arg attr: the attributes of an lxml element
     @type attr: object
 
     @return: A dictionary with pairing of node-attribute names and values.
@@ -64,6 +67,7 @@ def _attr2dict(attr):
     """
     ret = {}
     for key, value in attr.items():
+        key, value = unicode(key), unicode(value)
         if value.isdigit():
             value = int(value)
         ret[key] = value
@@ -79,9 +83,9 @@ def _get_coordinates(data, system=None):
     defined.
     """
     result = None
-    coordinates = data.getElementsByTagName('coordinates')
+    coordinates = data.iter('coordinates')
     for coordinate in coordinates:
-        attributes = _attr2dict(coordinate.attributes)
+        attributes = _attr2dict(coordinate.attrib)
         if result and system and attributes.get('coord_system') != system:
             continue
         result = attributes
@@ -89,9 +93,10 @@ def _get_coordinates(data, system=None):
 #_get_coordinates
 
 
-def _get_gene_name(section):
+def _get_gene_name(annotation_set):
     """
-    Extract the gene name from the LRG record updatable section.
+    Extract the gene name from an annotation set in the LRG record updatable
+    section.
 
     NOTE: It is necessary to use the updatable section since there is no
     other way to identify the main gene directly from the LRG file.
@@ -99,106 +104,100 @@ def _get_gene_name(section):
     Another way would be to make use of the special file with genes to LRG:
     http://ftp.ebi.ac.uk/pub/databases/lrgex/list_LRGs_transcripts_GRCh38.txt
 
-    :param section: (updatable) section of the LRG file
-    :return: gene name present under the lrg annotation set
+    :param annotation_set: annotation set from the (updatable) section of
+      the LRG file
+    :return: gene name present under the lrg annotation set, or None if it
+      is another annotation set
     """
-    gene_name = ""
-    annotation_nodes = section.getElementsByTagName("annotation_set")
-    for anno in annotation_nodes:
-        if anno.getAttribute("type") == "lrg":
-            gene_name = _get_content(anno, "lrg_locus")
-    return gene_name
+    if annotation_set.get('type') == 'lrg':
+        return _get_content(annotation_set, 'lrg_locus')
+    return None
 #_get_gene_name
 
 
-def _get_transcripts(section):
+def _get_transcript(tdata, lrg_id):
     """
-    Extracts the transcripts present in the (fixed) section of the LRG file.
+    Extracts a transcript from the (fixed) section of the LRG file.
 
-    :param section: (fixed) section of the LRG file
-    :return: list of transcripts (GenRecord.Locus)
+    :param tdata: transcript element in the (fixed) section of the LRG file
+    :param lrg_id: the LRG identifier (the preferred coordinate system)
+    :return: the transcript (GenRecord.Locus)
     """
-    lrg_id = _get_content(section, 'id')
-
-    transcripts = []
-    for tdata in section.getElementsByTagName("transcript"):
-        # iterate over the transcripts in the fixed section.
-        # get the transcript from the updatable section and combine results
-        transcript_name = tdata.getAttribute("name")[1:]
-        transcription = GenRecord.Locus(transcript_name)
-
-        coordinates = tdata.getElementsByTagName('coordinates')[0]
-
-        # Set the locusTag, linkMethod (used in the output) and the location
-        # LRG file transcripts can (for now) always be linked via the locustag
-        transcription.locusTag = transcript_name and "t" + transcript_name
-        transcription.linkMethod = "Locus Tag"
-        transcription.location = [int(coordinates.getAttribute("start")),
-                                  int(coordinates.getAttribute("end"))]
-
-        # Get the transcript exons and store them in a position list.
-        exonPList = GenRecord.PList()
-        for exon in tdata.getElementsByTagName("exon"):
-            coordinates = _get_coordinates(exon, lrg_id)
-            exonPList.positionList.extend([int(coordinates["start"]),
-                                           int(coordinates["end"])])
-        exonPList.positionList.sort()
-
-        # Get the CDS of the transcript and store them in a position list.
-        # NOTE: up until now all CDSlists only consisted of a starting end
-        # ending position, keep the possibility in mind that multiple CDS
-        # regions are given
-        CDSPList = GenRecord.PList()
-        for cds_id, CDS in enumerate(tdata.getElementsByTagName("coding_region")):
-            if cds_id > 0:
-                # Todo: For now, we only support one CDS per transcript and
-                #   ignore all others.
-                #   By the way, I don't think the loop and sorting of CDS
-                #   positions makes any sense here, but I leave it in place
-                #   and just ignore everything except the first iteration.
-                #translationName = CDS.getElementsByTagName("translation")[0].getAttribute("name").encode("utf8")[1:]
-                #print 'Ignoring transcript %s translation %s' % (transcript_name, translationName)
-                continue
-            coordinates = _get_coordinates(CDS, lrg_id)
-            CDSPList.positionList.extend([int(coordinates["start"]),
-                                          int(coordinates["end"])])
-        CDSPList.positionList.sort()
-
-        # If there is a CDS position List set the transcriptflag to True
-        if CDSPList.positionList:
-            transcription.molType = 'c'
-            CDSPList.location = [CDSPList.positionList[0],
-                                 CDSPList.positionList[-1]]
-            # If we only got the flanking CDS positions, we clear it and let
-            # GenRecord.checkRecord reconstruct the correct CDS list
-            # from the mRNA list later on
-            if len(CDSPList.positionList) == 2:
-                CDSPList.positionList = []
-            transcription.translate = True
-        else:
-            transcription.molType = 'n'
-
-        # Note: Not all the transcripts contain a coding_region.
-        if tdata.getElementsByTagName('coding_region'):
-            transcription.transcribe = True
-            # Store CDS position lists in the transcription
-            transcription.CDS = CDSPList
-
-        # Store exon position list in the transcription
-        transcription.exon = exonPList
-
-        # Add the transcription to the transcripts list
-        transcripts.append(transcription)
-    return transcripts
-#_get_transcripts
+    transcript_name = unicode(tdata.get("name"))[1:]
+    transcription = GenRecord.Locus(transcript_name)
+
+    coordinates = next(tdata.iter('coordinates'))
+
+    # Set the locusTag, linkMethod (used in the output) and the location
+    # LRG file transcripts can (for now) always be linked via the locustag
+    transcription.locusTag = transcript_name and "t" + transcript_name
+    transcription.linkMethod = "Locus Tag"
+    transcription.location = [int(coordinates.get("start")),
+                              int(coordinates.get("end"))]
+
+    # Get the transcript exons and store them in a position list.
+    exonPList = GenRecord.PList()
+    for exon in tdata.iter("exon"):
+        coordinates = _get_coordinates(exon, lrg_id)
+        exonPList.positionList.extend([int(coordinates["start"]),
+                                       int(coordinates["end"])])
+    exonPList.positionList.sort()
+
+    # Get the CDS of the transcript and store them in a position list.
+    # NOTE: up until now all CDSlists only consisted of a starting end
+    # ending position, keep the possibility in mind that multiple CDS
+    # regions are given
+    CDSPList = GenRecord.PList()
+    for cds_id, CDS in enumerate(tdata.iter("coding_region")):
+        if cds_id > 0:
+            # Todo: For now, we only support one CDS per transcript and
+            #   ignore all others.
+            #   By the way, I don't think the loop and sorting of CDS
+            #   positions makes any sense here, but I leave it in place
+            #   and just ignore everything except the first iteration.
+            #translationName = CDS.getElementsByTagName("translation")[0].getAttribute("name").encode("utf8")[1:]
+            #print 'Ignoring transcript %s translation %s' % (transcript_name, translationName)
+            continue
+        coordinates = _get_coordinates(CDS, lrg_id)
+        CDSPList.positionList.extend([int(coordinates["start"]),
+                                      int(coordinates["end"])])
+    CDSPList.positionList.sort()
+
+    # If there is a CDS position List set the transcriptflag to True
+    if CDSPList.positionList:
+        transcription.molType = 'c'
+        CDSPList.location = [CDSPList.positionList[0],
+                             CDSPList.positionList[-1]]
+        # If we only got the flanking CDS positions, we clear it and let
+        # GenRecord.checkRecord reconstruct the correct CDS list
+        # from the mRNA list later on
+        if len(CDSPList.positionList) == 2:
+            CDSPList.positionList = []
+        transcription.translate = True
+    else:
+        transcription.molType = 'n'
+
+    # Note: Not all the transcripts contain a coding_region.
+    if tdata.find('.//coding_region') is not None:
+        transcription.transcribe = True
+        # Store CDS position lists in the transcription
+        transcription.CDS = CDSPList
+
+    # Store exon position list in the transcription
+    transcription.exon = exonPList
+
+    return transcription
+#_get_transcript
 
 
 def create_record(data):
     """
-    Create a GenRecord.Record of a LRG <xml> formatted string.
+    Create a GenRecord.Record of a LRG <xml> formatted string or file.
 
-    @arg data: Content of LRG file
-    @type data: byte string
+    @arg data: Content of LRG file, or an open LRG file
+    @type data: byte string or file object
+
+    @raise etree.XMLSyntaxError: If the file is not well-formed XML.
 
     @return: GenRecord.Record instance
     @rtype: object
@@ -206,23 +205,57 @@ def create_record(data):
     # Initiate the GenRecord.Record
     record = GenRecord.Record()
     record._sourcetype = "LRG"
+    record.molType = 'g'
+    record.organism = ""
 
-    # Parse the xml data string and extract the fixed and updatable section
-    data = xml.dom.minidom.parseString(data)
-    fixed = data.getElementsByTagName("fixed_annotation")[0]
-    updatable = data.getElementsByTagName("updatable_annotation")[0]
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
 
-    # Get the organism
-    record.organism = _get_content(data, 'organism')
+    lrg_id = None
+    organism = None
+    sequence = ""
+    gene_name = ""
+    transcripts = []
 
-    # Get the sequence from the fixed section
-    record.molType = 'g'
-    record.seq = Seq(_get_content(fixed, "sequence"), IUPAC.unambiguous_dna)
+    # The sequence can be larger than the default limit of libxml2 for text
+    # nodes.
+    for event, element in etree.iterparse(data, huge_tree=True):
+        parent = element.getparent()
+        if parent is None:
+            break
+        section = parent.tag
+
+        if element.tag == 'organism' and organism is None:
+            organism = element.text or ""
+
+        if section == 'fixed_annotation':
+            if element.tag == 'id' and lrg_id is None:
+                lrg_id = unicode(element.text or "")
+            elif element.tag == 'sequence' and not sequence:
+                # Get the sequence from the fixed section
+                sequence = element.text or ""
+            elif element.tag == 'transcript':
+                # Add transcripts information from the fixed section to the
+                # main gene.
+                transcripts.append(_get_transcript(element, lrg_id))
+        elif section == 'updatable_annotation':
+            name = _get_gene_name(element)
+            if name is not None:
+                gene_name = name
+        else:
+            continue
+
+        # We are done with this part of the section, discard it.
+        element.clear()
+        while element.getprevious() is not None:
+            del parent[0]
+
+    if organism is not None:
+        record.organism = unicode(organism)
+    record.seq = Seq(unicode(sequence), IUPAC.unambiguous_dna)
 
-    # Get the gene name
-    gene = GenRecord.Gene(_get_gene_name(updatable))
-    # Add transcripts information from the fixed section to the main gene.
-    gene.transcriptList = _get_transcripts(fixed)
+    gene = GenRecord.Gene(gene_name)
+    gene.transcriptList = transcripts
     record.geneList = [gene]
 
     return record
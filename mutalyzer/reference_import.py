@@ -0,0 +1,329 @@
+"""
+Importing reference files in bulk from local copies of RefSeq and LRG
+releases.
+
+Imported reference files are stored in the cache directory and registered in
+the database exactly like retrieved reference files, so
+:meth:`mutalyzer.Retriever.GenBankRetriever.loadrecord` and
+:meth:`mutalyzer.Retriever.LRGRetriever.loadrecord` find them without
+retrieving them from the NCBI or the LRG website.
+
+Importing a new release is incremental: references with the same checksum as
+before are not written again (unless their file is no longer in the cache).
+
+Imported reference files count towards the `CACHE_SIZE` setting like any
+other reference file (see :mod:`mutalyzer.cache`), so it should be large
+enough to hold the release.
+
+Reading the release and updating the database is done in the calling
+process, calculating checksums and compressing and writing the files is done
+by a pool of worker processes.
+"""
+
+
+from __future__ import unicode_literals
+
+import collections
+import gzip
+import hashlib
+import itertools
+import multiprocessing
+import os
+import re
+import tempfile
+
+from lxml import etree
+
+from mutalyzer import compression
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer.db.models import Reference
+from mutalyzer.parsers import lrg
+
+
+#: Number of records for which we look up existing references in one
+#: database query, and insert or update references in one transaction.
+CHUNK_SIZE = 500
+
+#: Outcome of importing a record, one of `added` (new reference),
+#: `updated` (reference with a changed checksum), `restored` (unchanged
+#: reference whose file was not in the cache), `unchanged`, `duplicate`
+#: (another reference has the same checksum), or `invalid` (record could not
+#: be parsed or contains no sequence).
+ImportResult = collections.namedtuple(
+    'ImportResult', ['accession', 'checksum', 'status'])
+
+
+def _open(filename):
+    """
+    Open a file for reading, decompressing it if it is gzipped.
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def genbank_records(handle):
+    """
+    Read the records from a multi-record GenBank flat file (e.g.,
+    `.gbff` files from a RefSeq release).
+
+    :arg file handle: Open GenBank flat file.
+
+    :returns: Accession number (with version) and raw data for each record,
+      or `None` for the accession number if the record has no VERSION line.
+    :rtype: generator(tuple(unicode, str))
+    """
+    lines = []
+    accession = None
+
+    for line in handle:
+        if not lines and not line.strip():
+            continue
+        lines.append(line)
+        if line.startswith(b'VERSION'):
+            fields = line.split()
+            if len(fields) > 1:
+                accession = fields[1].decode('ascii')
+        elif line.startswith(b'//'):
+            yield accession, b''.join(lines)
+            lines = []
+            accession = None
+
+
+LRG_FILE = re.compile(r'^(LRG_\d+)\.xml$')
+
+
+def lrg_records(directory):
+    """
+    Read the LRG files in a directory.
+
+    :arg unicode directory: Directory with `LRG_<number>.xml` files.
+
+    :returns: LRG identifier and raw data for each LRG file.
+    :rtype: generator(tuple(unicode, str))
+    """
+    for name in sorted(os.listdir(directory)):
+        match = LRG_FILE.match(name)
+        if match:
+            with open(os.path.join(directory, name), 'rb') as handle:
+                yield match.group(1), handle.read()
+
+
+def _valid_genbank(raw_data):
+    """
+    Check if a GenBank record contains a sequence. We don't parse the record
+    here, the sequence is what :meth:`GenBankRetriever.write` checks for
+    besides being parseable.
+    """
+    return b'\nORIGIN' in raw_data
+
+
+def _valid_lrg(raw_data):
+    """
+    Check if an LRG record can be parsed, like :meth:`LRGRetriever.write`
+    does.
+    """
+    try:
+        lrg.create_record(raw_data)
+    except etree.XMLSyntaxError:
+        return False
+    return True
+
+
+_VALIDATORS = {'gb': _valid_genbank, 'xml': _valid_lrg}
+
+
+def _store(task):
+    """
+    Store a record in the cache directory if needed. Run by the worker
+    processes.
+
+    :arg tuple task: A tuple with the file type (`gb` or `xml`), cache
+      directory, codec name (see :mod:`mutalyzer.compression`), accession
+      number, raw data, and current checksum of the reference (or `None` if
+      it is new).
+
+    :returns: The outcome, where `added` and `updated` are preliminary (the
+      reference is not yet in the database).
+    :rtype: ImportResult
+    """
+    file_type, cache_dir, codec, accession, raw_data, current = task
+
+    checksum = unicode(hashlib.md5(raw_data).hexdigest())
+    base = os.path.join(cache_dir, '{}.{}'.format(accession, file_type))
+    codec = compression.get(codec)
+
+    if checksum == current:
+        if compression.find(base):
+            return ImportResult(accession, checksum, 'unchanged')
+        status = 'restored'
+    elif current is None:
+        status = 'added'
+    else:
+        status = 'updated'
+
+    if not _VALIDATORS[file_type](raw_data):
+        return ImportResult(accession, checksum, 'invalid')
+
+    # Write under a temporary name and rename, so we never leave a partial
+    # file in the cache.
+    filename = compression.filename(base, codec)
+    compressor = codec.compressor()
+    handle, temp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as out_handle:
+            out_handle.write(compressor.compress(raw_data))
+            out_handle.write(compressor.flush())
+        os.rename(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.unlink(temp_filename)
+    compression.remove_others(filename)
+
+    return ImportResult(accession, checksum, status)
+
+
+def _tasks(file_type, records, current):
+    """
+    Create tasks for the worker processes.
+    """
+    for accession, raw_data in records:
+        yield (file_type, settings.CACHE_DIR, settings.CACHE_CODEC, accession,
+               raw_data, current.get(accession))
+
+
+def _register(results, file_type, source):
+    """
+    Add or update the references for the stored records.
+
+    A new reference with the same checksum as an existing one cannot be
+    added. Its status is changed to `duplicate`.
+
+    :arg list(ImportResult) results: Outcomes of one chunk of records.
+    :arg unicode file_type: File type of the records (`gb` or `xml`).
+    :arg unicode source: Source of the references (see
+      :attr:`mutalyzer.db.models.Reference.source`).
+
+    :returns: The final outcomes.
+    :rtype: list(ImportResult)
+    """
+    changed = [r.checksum for r in results
+               if r.status in ('added', 'updated')]
+    checksums = set()
+    if changed:
+        checksums.update(checksum for checksum, in
+                         session.query(Reference.checksum).filter(
+                             Reference.checksum.in_(changed)))
+
+    final = []
+    rows = []
+    for result in results:
+        if result.status in ('added', 'updated'):
+            if result.checksum in checksums:
+                # The file does not match the reference in the database, it
+                # is retrieved again when needed.
+                result = result._replace(status='duplicate')
+                os.unlink(compression.find(os.path.join(
+                    settings.CACHE_DIR,
+                    '{}.{}'.format(result.accession, file_type))))
+            else:
+                checksums.add(result.checksum)
+                if result.status == 'added':
+                    rows.append(Reference(result.accession, result.checksum,
+                                          source))
+                else:
+                    Reference.query \
+                        .filter_by(accession=result.accession) \
+                        .update({'checksum': result.checksum},
+                                synchronize_session=False)
+        final.append(result)
+
+    session.add_all(rows)
+    session.commit()
+    return final
+
+
+def _import(file_type, source, records, processes=None):
+    """
+    Import records into the cache and the database.
+
+    :arg unicode file_type: File type of the records (`gb` or `xml`).
+    :arg unicode source: Source of the references.
+    :arg iterable records: Accession number and raw data for each record.
+    :arg int processes: Number of worker processes (default: the number of
+      CPUs).
+
+    :returns: The outcome for each record.
+    :rtype: generator(ImportResult)
+    """
+    if not os.path.isdir(settings.CACHE_DIR):
+        os.mkdir(settings.CACHE_DIR)
+
+    pool = None
+    if processes is None or processes > 1:
+        pool = multiprocessing.Pool(processes)
+
+    try:
+        while True:
+            chunk = []
+            for accession, raw_data in itertools.islice(records, CHUNK_SIZE):
+                if accession is None:
+                    yield ImportResult(None, None, 'invalid')
+                else:
+                    chunk.append((accession, raw_data))
+            if not chunk:
+                break
+
+            current = dict(session.query(Reference.accession,
+                                         Reference.checksum)
+                           .filter(Reference.accession.in_(
+                               [accession for accession, _ in chunk])))
+            tasks = _tasks(file_type, chunk, current)
+            if pool is None:
+                results = map(_store, tasks)
+            else:
+                results = pool.map(_store, tasks)
+
+            for result in _register(results, file_type, source):
+                yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def import_genbank(filenames, processes=None):
+    """
+    Import the records from GenBank flat files (e.g., a RefSeq release).
+
+    :arg list(unicode) filenames: Multi-record GenBank flat files, optionally
+      gzipped (e.g., `.gbff.gz` files).
+    :arg int processes: Number of worker processes (default: the number of
+      CPUs).
+
+    :returns: The outcome for each record.
+    :rtype: generator(ImportResult)
+    """
+    def records():
+        for filename in filenames:
+            with _open(filename) as handle:
+                for record in genbank_records(handle):
+                    yield record
+
+    return _import('gb', 'ncbi', records(), processes=processes)
+
+
+def import_lrg(directory, processes=None):
+    """
+    Import the LRG files from a directory (e.g., a copy of the LRG website's
+    `fixed` directory).
+
+    :arg unicode directory: Directory with `LRG_<number>.xml` files.
+    :arg int processes: Number of worker processes (default: the number of
+      CPUs).
+
+    :returns: The outcome for each LRG file.
+    :rtype: generator(ImportResult)
+    """
+    return _import('xml', 'lrg', lrg_records(directory), processes=processes)
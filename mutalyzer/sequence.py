@@ -0,0 +1,245 @@
+"""
+Lazy sequences, read from memory-mapped files on demand.
+
+The parsed record cache (see :mod:`mutalyzer.Retriever`) keeps the sequence
+of a large parsed record in a separate file with just the raw sequence. When
+such a parsed record is loaded from the cache, its sequence is a
+:class:`MappedSequence` on that file. Only the parts of the sequence that are
+actually used are read (by the operating system, a page at a time), and the
+pages are shared by all processes using the same record.
+
+Slicing a lazy sequence gives a :class:`Bio.Seq.Seq` object with the slice,
+so code working on slices of a sequence does not need to know about lazy
+sequences. Reverse complementing a lazy sequence or replacing part of it (see
+:func:`replace`) gives another lazy sequence without reading it.
+"""
+
+
+from __future__ import unicode_literals
+
+import io
+import mmap
+
+from Bio import Alphabet
+from Bio.Seq import Seq
+
+from mutalyzer import util
+
+
+class LazySequence(object):
+    """
+    Base class for lazy sequences. Subclasses implement :meth:`__len__` and
+    :meth:`_read`.
+
+    Lazy sequences support the parts of the :class:`Bio.Seq.Seq` interface
+    that Mutalyzer uses: `len`, indexing, slicing, concatenation, conversion
+    to a string, and reverse complementing.
+    """
+    #: Alphabet of the sequence (see :mod:`Bio.Alphabet`).
+    alphabet = Alphabet.generic_alphabet
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def _read(self, start, stop):
+        """
+        Read part of the sequence.
+
+        :arg int start: Start position (zero-based, inclusive).
+        :arg int stop: End position (zero-based, exclusive). We must have
+          `0 <= start <= stop <= len(self)`.
+
+        :returns: The sequence from `start` to `stop`.
+        :rtype: unicode
+        """
+        raise NotImplementedError()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return Seq(self._read(0, len(self)), self.alphabet)[index]
+            return Seq(self._read(start, max(start, stop)), self.alphabet)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('sequence index out of range')
+        return self._read(index, index + 1)
+
+    def __unicode__(self):
+        return self._read(0, len(self))
+
+    def __str__(self):
+        return self._read(0, len(self)).encode('ascii')
+
+    def __repr__(self):
+        return '{}({} bp)'.format(self.__class__.__name__, len(self))
+
+    def __add__(self, other):
+        return self[:] + other
+
+    def __radd__(self, other):
+        return other + self[:]
+
+    def reverse_complement(self):
+        """
+        The reverse complement of the sequence, without reading it.
+
+        :returns: Lazy reverse complement.
+        :rtype: LazySequence
+        """
+        return ReverseComplement(self)
+
+
+class MappedSequence(LazySequence):
+    """
+    Sequence read from a memory-mapped file with the raw (ASCII) sequence.
+
+    The file is mapped on construction, so it can be removed afterwards
+    (e.g., by :func:`mutalyzer.cache.evict`). Pickling only stores the
+    filename and alphabet, unpickling maps the file again.
+    """
+    def __init__(self, filename, alphabet=Alphabet.generic_alphabet):
+        """
+        :arg unicode filename: File with the raw sequence.
+        :arg object alphabet: Alphabet of the sequence.
+
+        :raises IOError: If the file cannot be read.
+        """
+        self.filename = filename
+        self.alphabet = alphabet
+        self._map()
+
+    def _map(self):
+        with io.open(self.filename, 'rb') as handle:
+            handle.seek(0, io.SEEK_END)
+            if handle.tell():
+                self._data = mmap.mmap(handle.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            else:
+                # Empty files cannot be mapped.
+                self._data = b''
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'alphabet': self.alphabet}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def __deepcopy__(self, memo):
+        # Immutable, and the memory map cannot be copied.
+        return self
+
+    def __len__(self):
+        return len(self._data)
+
+    def _read(self, start, stop):
+        return self._data[start:stop].decode('ascii')
+
+
+class ReverseComplement(LazySequence):
+    """
+    Reverse complement of a lazy sequence.
+    """
+    def __init__(self, sequence):
+        """
+        :arg LazySequence sequence: The sequence.
+        """
+        self._sequence = sequence
+        self.alphabet = sequence.alphabet
+
+    def __len__(self):
+        return len(self._sequence)
+
+    def _read(self, start, stop):
+        length = len(self._sequence)
+        return util.reverse_complement(
+            self._sequence._read(length - stop, length - start))
+
+    def reverse_complement(self):
+        return self._sequence
+
+
+class EditedSequence(LazySequence):
+    """
+    Concatenation of parts of other sequences.
+
+    Parts are tuples `(sequence, start, stop)` where `sequence` is a lazy
+    sequence or a unicode string, and `start` and `stop` are zero-based and
+    half-open.
+    """
+    def __init__(self, parts, alphabet=Alphabet.generic_alphabet):
+        """
+        :arg list(tuple) parts: The parts.
+        :arg object alphabet: Alphabet of the sequence.
+        """
+        self._parts = [part for part in parts if part[1] < part[2]]
+        self._length = sum(stop - start for _, start, stop in self._parts)
+        self.alphabet = alphabet
+
+    def __len__(self):
+        return self._length
+
+    def parts(self, start, stop):
+        """
+        The parts from `start` to `stop` (zero-based, half-open).
+        """
+        result = []
+        offset = 0
+        for sequence, part_start, part_stop in self._parts:
+            part_length = part_stop - part_start
+            if offset < stop and start < offset + part_length:
+                result.append(
+                    (sequence,
+                     part_start + max(start - offset, 0),
+                     part_start + min(stop - offset, part_length)))
+            offset += part_length
+            if offset >= stop:
+                break
+        return result
+
+    def _read(self, start, stop):
+        return ''.join(
+            sequence._read(part_start, part_stop)
+            if isinstance(sequence, LazySequence)
+            else unicode(sequence[part_start:part_stop])
+            for sequence, part_start, part_stop in self.parts(start, stop))
+
+
+def _parts(sequence, start, stop):
+    """
+    Parts of a lazy sequence from `start` to `stop`, for use in an
+    :class:`EditedSequence`.
+    """
+    if isinstance(sequence, EditedSequence):
+        return sequence.parts(start, stop)
+    return [(sequence, start, stop)]
+
+
+def replace(sequence, start, stop, insertion):
+    """
+    Replace part of a sequence, like `sequence[:start] + insertion +
+    sequence[stop:]` but without reading lazy sequences.
+
+    :arg object sequence: The sequence, a lazy sequence or anything that
+      supports slicing and concatenation (e.g., :class:`Bio.Seq.Seq`).
+    :arg int start: Start of the replaced part (zero-based).
+    :arg int stop: End of the replaced part (zero-based, exclusive).
+    :arg unicode insertion: Inserted sequence.
+
+    :returns: The new sequence, which is lazy if `sequence` is lazy.
+    :rtype: object
+    """
+    if not isinstance(sequence, LazySequence):
+        return sequence[:start] + insertion + sequence[stop:]
+
+    length = len(sequence)
+    start = slice(None, start).indices(length)[1]
+    stop = slice(stop, None).indices(length)[0]
+    insertion = unicode(insertion)
+
+    return EditedSequence(_parts(sequence, 0, start) +
+                          [(insertion, 0, len(insertion))] +
+                          _parts(sequence, stop, length),
+                          alphabet=sequence.alphabet)
@@ -32,7 +32,7 @@ from mutalyzer.config import settings
 from mutalyzer.db import session
 from mutalyzer.db import session as sessiongb
 from mutalyzer.db.models import (Assembly, Chromosome, BatchJob,
-                                 BatchQueueItem, TranscriptMapping)
+                                 TranscriptMapping)
 from mutalyzer.output import Output
 from mutalyzer.grammar import Grammar
 from mutalyzer.sync import CacheSync
@@ -146,9 +146,9 @@ class MutalyzerService(ServiceBase):
             batch_file.write(d)
 
         job, columns = file_instance.parseBatchFile(batch_file)
-        batch_file.close()
 
         if job is None:
+            batch_file.close()
             raise Fault('EPARSE', 'Could not parse input file, please check your file format.')
 
         if not email:
@@ -161,8 +161,12 @@ class MutalyzerService(ServiceBase):
                 address = 'localhost'
             email = '%s@webservice.mutalyzer' % address
 
-        result_id = scheduler.addJob(email, job, columns,
-                                     batch_types[process], argument)
+        # The entries are read from the batch file while they are added.
+        try:
+            result_id = scheduler.addJob(email, job, columns,
+                                         batch_types[process], argument)
+        finally:
+            batch_file.close()
         return result_id
 
     @srpc(Mandatory.Unicode, _returns=Integer)
@@ -177,7 +181,41 @@ class MutalyzerService(ServiceBase):
 
         @return: Number of entries left.
         """
-        return BatchQueueItem.query.join(BatchJob).filter_by(result_id=job_id).count()
+        batch_job = BatchJob.query.filter_by(result_id=job_id).first()
+
+        if batch_job is None:
+            return 0
+
+        # Entries are added in chunks, so the job may not be finished even if
+        # all entries added so far are processed.
+        return max(batch_job.batch_queue_items.count(), 1)
+
+    @srpc(Mandatory.Unicode, _returns=Integer)
+    def estimateBatchJob(job_id):
+        """
+        Get the estimated number of seconds left until a batch job is
+        finished.
+
+        This is a rough estimate, based on the expected processing time of
+        the remaining entries of this job and of the jobs of other users,
+        which share the batch processor.
+
+        On error an exception is raised:
+          - detail: Human readable description of the error.
+          - faultstring: A code to indicate the type of error.
+              - EBATCHNOTFOUND: The batch job could not be found (it may be
+                finished already).
+
+        @arg job_id: Batch job identifier.
+
+        @return: Estimated number of seconds left.
+        """
+        batch_job = BatchJob.query.filter_by(result_id=job_id).first()
+
+        if batch_job is None:
+            raise Fault('EBATCHNOTFOUND', 'Batch job could not be found.')
+
+        return int(round(Scheduler.estimate_job(batch_job)))
 
     @srpc(Mandatory.Unicode, _returns=ByteArray)
     def getBatchJob(job_id):
@@ -196,9 +234,8 @@ class MutalyzerService(ServiceBase):
 
         @return: Batch job result file (UTF-8, base64 encoded).
         """
-        left = BatchQueueItem.query.join(BatchJob).filter_by(result_id=job_id).count()
-
-        if left > 0:
+        # Finished jobs are removed from the database.
+        if BatchJob.query.filter_by(result_id=job_id).count():
             raise Fault('EBATCHNOTREADY', 'Batch job result is not yet ready.')
 
         filename = 'batch-job-%s.txt' % job_id
@@ -1288,7 +1325,9 @@ class MutalyzerService(ServiceBase):
             "Received request getGeneAndTranscript(%s, %s)" % (
             genomicReference, transcriptReference))
         retriever = Retriever.GenBankRetriever(O)
-        record = retriever.loadrecord(genomicReference)
+        # We only need the gene of the transcript.
+        record = retriever.loadrecord(genomicReference,
+                                      genes=[transcriptReference])
 
         GenRecordInstance = GenRecord.GenRecord(O)
         GenRecordInstance.record = record
@@ -1369,7 +1408,8 @@ class MutalyzerService(ServiceBase):
 
         if record is None:
             retriever = Retriever.GenBankRetriever(O)
-            record = retriever.loadrecord(genomicReference)
+            record = retriever.loadrecord(
+                genomicReference, genes=[geneName] if geneName else None)
 
         if record is None:
             raise Fault("EARG",
@@ -30,17 +30,17 @@ INTERVALS = [('minute', '%Y-%m-%d_%H:%M', 60 * 60),
              ('day', '%Y-%m-%d', 60 * 60 * 24 * 30)]
 
 
-def increment_counter(counter):
+def increment_counter(counter, amount=1):
     """
-    Increment the specified counter.
+    Increment the specified counter (by `amount`).
     """
     pipe = redis.pipeline(transaction=False)
-    pipe.incr('counter:%s:total' % counter)
+    pipe.incr('counter:%s:total' % counter, amount)
 
     for label, bucket, expire in INTERVALS:
         key = 'counter:%s:%s:%s' % (counter, label,
                                     unicode(time.strftime(bucket)))
-        pipe.incr(key)
+        pipe.incr(key, amount)
 
         # It's safe to just keep on expiring the counter, even if it already
         # had an expiration, since it is bounded by the current day. We don't
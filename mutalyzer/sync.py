@@ -15,6 +15,7 @@ import urllib2
 from sqlalchemy.orm.exc import NoResultFound
 from suds.client import Client
 
+from mutalyzer import compression
 from mutalyzer.config import settings
 from mutalyzer.db import session
 from mutalyzer.db.models import Reference
@@ -64,8 +65,8 @@ class CacheSync(object):
             # But we are only really interested in manually uploaded files
             # anyway, which can currently only be Genbank files.
             cached = None
-            if os.path.isfile(os.path.join(settings.CACHE_DIR,
-                                           '%s.gb.bz2' % reference.accession)):
+            if compression.find(os.path.join(settings.CACHE_DIR,
+                                             '%s.gb' % reference.accession)):
                 cached = '%s.gb' % reference.accession
             cache.append({'name':                  reference.accession,
                           'source':                reference.source,
@@ -1592,38 +1592,44 @@ def process_variant(mutator, description, record, output):
                             ", ".join(gene.listLoci())))
 
         else:
-            # Not an LRG, find our gene manually.
-            genes = record.record.listGenes()
+            # Not an LRG, find our gene manually. We only list all genes if
+            # we need them, since that loads all genes of records created for
+            # a selection of genes.
             transcript_id = transcript_id and "%.3i" % int(transcript_id)
 
-            if gene_symbol in genes:
-                # We found our gene.
+            if gene_symbol:
                 gene = record.record.findGene(gene_symbol)
-            elif not gene_symbol:
-                if len(genes) == 1:
-                    # No gene given and there is only one gene in the record.
-                    # Todo: message?
-                    gene = record.record.geneList[0]
+
+            if gene is None:
+                genes = record.record.listGenes()
+
+                if not gene_symbol:
+                    if len(genes) == 1:
+                        # No gene given and there is only one gene in the
+                        # record.
+                        # Todo: message?
+                        gene = record.record.geneList[0]
+                    else:
+                        if len(genes) < 10:
+                            output.addMessage(__file__, 4, "EINVALIDGENE",
+                                "No gene specified. Please choose from: %s" %
+                                              ", ".join(genes))
+                        else:
+                            output.addMessage(__file__, 4, "EINVALIDGENE",
+                                "No gene specified. Specify one of the %s "
+                                "genes that are present the reference." %
+                                len(genes))
+
                 else:
                     if len(genes) < 10:
                         output.addMessage(__file__, 4, "EINVALIDGENE",
-                            "No gene specified. Please choose from: %s" %
-                                          ", ".join(genes))
+                            "Gene %s not found. Please choose from: %s" % (
+                            gene_symbol, ", ".join(genes)))
                     else:
                         output.addMessage(__file__, 4, "EINVALIDGENE",
-                            "No gene specified. Specify one of the %s genes "
-                            "that are present the reference." % len(genes))
-
-            else:
-                if len(genes) < 10:
-                    output.addMessage(__file__, 4, "EINVALIDGENE",
-                        "Gene %s not found. Please choose from: %s" % (
-                        gene_symbol, ", ".join(genes)))
-                else:
-                    output.addMessage(__file__, 4, "EINVALIDGENE",
-                        "Gene %s not found. Specify one of the %s genes that "
-                        "are present in the reference. " % (
-                        gene_symbol, len(genes)))
+                            "Gene %s not found. Specify one of the %s genes "
+                            "that are present in the reference. " % (
+                            gene_symbol, len(genes)))
 
             if gene:
                 # Find transcript.
@@ -1722,7 +1728,7 @@ def process_variant(mutator, description, record, output):
 #process_variant
 
 
-def check_variant(description, output):
+def check_variant(description, output, records=None):
     """
     Check the variant described by {description} according to the HGVS variant
     nomenclature and populate the {output} object with various information
@@ -1732,6 +1738,9 @@ def check_variant(description, output):
     @type description: string
     @arg output: An output object.
     @type output: Modules.Output.Output
+    @kwarg records: Optional cache of parsed records to load the reference
+        from.
+    @type records: Retriever.RecordCache
 
     @todo: Documentation.
     @todo: Raise exceptions on failure instead of just return.
@@ -1771,6 +1780,10 @@ def check_variant(description, output):
 
     gene_symbol = transcript_id = ''
 
+    # Only the selected gene is parsed completely, other genes are added to
+    # the record when they are near the variant (see GenRecord.name).
+    genes = None
+
     if parsed_description.LrgAcc:
         filetype = 'LRG'
         transcript_id = parsed_description.LRGTranscriptID or ''
@@ -1783,6 +1796,10 @@ def check_variant(description, output):
             if parsed_description.Gene.ProtIso:
                 output.addMessage(__file__, 4, 'EPROT',
                     'Indexing by protein isoform is not supported.')
+        if gene_symbol:
+            genes = [gene_symbol]
+        elif parsed_description.AccNoTransVar:
+            genes = ['.'.join(parsed_description.AccNoTransVar)]
         retriever = Retriever.GenBankRetriever(output)
 
     # We first check if NC retrieval works, just for speed considerations.
@@ -1795,7 +1812,13 @@ def check_variant(description, output):
         retrieved_record = None
 
     if retrieved_record is None:
-        retrieved_record = retriever.loadrecord(record_id)
+        if records is not None:
+            retrieved_record = records.loadrecord(retriever, record_id,
+                                                  genes=genes)
+        elif genes is not None:
+            retrieved_record = retriever.loadrecord(record_id, genes=genes)
+        else:
+            retrieved_record = retriever.loadrecord(record_id)
     else:
         # To remove the download link text from the name checker page.
         filetype = 'GB_NC'
@@ -1910,6 +1933,11 @@ def check_variant(description, output):
     for gene in record.record.geneList:
         for transcript in gene.transcriptList:
 
+            if record.record.description and not transcript.description:
+                # The transcript is not near the variant, so it is not
+                # described (see GenRecord.name).
+                continue
+
             if not (transcript.CDS and transcript.translate) \
                    or ';' in transcript.description \
                    or transcript.description == '?':
@@ -2029,6 +2057,10 @@ def check_variant(description, output):
     for gene in record.record.geneList:
         for transcript in sorted(gene.transcriptList, key=attrgetter('name')):
 
+            if record.record.description and not transcript.description:
+                # Not described (see above).
+                continue
+
             # Note: I don't think genomic_id is ever used, because it is
             # always ''.
             coding_description = ''
@@ -5,7 +5,6 @@ Mutalyzer website views.
 
 from __future__ import unicode_literals
 
-import bz2
 import os
 import pkg_resources
 import re
@@ -24,8 +23,8 @@ from sqlalchemy.orm.exc import NoResultFound
 import extractor
 
 import mutalyzer
-from mutalyzer import (announce, backtranslator, File, ncbi, Retriever,
-                       Scheduler, stats, util, variantchecker)
+from mutalyzer import (announce, backtranslator, compression, File, ncbi,
+                       Retriever, Scheduler, stats, util, variantchecker)
 from mutalyzer.config import settings
 from mutalyzer.db.models import BATCH_JOB_TYPES
 from mutalyzer.db.models import Assembly, BatchJob
@@ -854,12 +853,19 @@ def reference(filename):
     """
     Download reference file from cache.
     """
-    file_path = os.path.join(settings.CACHE_DIR, '%s.bz2' % filename)
+    if not filename.endswith(('.gb', '.xml')):
+        abort(404)
+
+    file_path = compression.find(os.path.join(settings.CACHE_DIR, filename))
 
-    if not os.path.isfile(file_path):
+    if file_path is None:
         abort(404)
 
-    response = make_response(bz2.BZ2File(file_path, 'r').read())
+    handle = compression.open(file_path)
+    try:
+        response = make_response(handle.read())
+    finally:
+        handle.close()
 
     response.headers['Content-Type'] = 'text/plain; charset=utf-8'
     response.headers['Content-Disposition'] = ('attachment; filename="%s"'
@@ -983,17 +989,23 @@ def batch_job_progress():
             if json:
                 return jsonify(items_left=1, complete=True)
             return render_template('batch-job-progress.html',
-                                   result_id=result_id)
+                                   result_id=result_id,
+                                   compressed=os.path.isfile(path + '.gz'))
         else:
             return render_template('batch-job-progress.html')
 
     items_left = batch_job.batch_queue_items.count()
+    if batch_job.loading:
+        # Entries are added in chunks, so the job is not finished even if
+        # all entries added so far are processed.
+        items_left = max(items_left, 1)
 
     if json:
         return jsonify(items_left=items_left, complete=False)
     return render_template('batch-job-progress.html',
                            result_id=result_id,
-                           items_left=items_left)
+                           items_left=items_left,
+                           compressed=settings.BATCH_RESULT_GZIP)
 
 
 @website.route('/batch-job-result/batch-job-<string:result_id>.txt')
@@ -1015,6 +1027,28 @@ def batch_job_result(result_id):
                                as_attachment=True)
 
 
+@website.route('/batch-job-result/batch-job-<string:result_id>.txt.gz')
+def batch_job_result_compressed(result_id):
+    """
+    Batch job result file download (gzip-compressed).
+
+    Only available if the `BATCH_RESULT_GZIP` configuration setting was
+    enabled while the batch job was processed.
+    """
+    if not result_id:
+        abort(404)
+
+    batch_job = BatchJob.query.filter_by(result_id=result_id).first()
+    if batch_job:
+        # If the batch job exists, it is not done yet.
+        abort(404)
+
+    return send_from_directory(settings.CACHE_DIR,
+                               'batch-job-%s.txt.gz' % result_id,
+                               mimetype='application/gzip',
+                               as_attachment=True)
+
+
 # Todo: Is this obsolete?
 @website.route('/getGS')
 def lovd_get_gs():
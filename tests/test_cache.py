@@ -0,0 +1,176 @@
+"""
+Tests for the mutalyzer.cache module.
+"""
+
+
+from __future__ import unicode_literals
+
+import fcntl
+import os
+
+from mock import patch
+import pytest
+
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer import cache
+from mutalyzer import Retriever
+
+from fixtures import with_references
+
+
+pytestmark = pytest.mark.usefixtures('db')
+
+
+def _set_sources(references, source):
+    """
+    Pretend the references were not uploaded.
+    """
+    for reference in references:
+        reference.source = source
+    session.commit()
+
+
+def _configure_size(size):
+    """
+    Set `CACHE_SIZE` and return the previous settings.
+    """
+    defaults = {'CACHE_SIZE': settings.CACHE_SIZE}
+    settings.configure({'CACHE_SIZE': size})
+    return defaults
+
+
+@with_references('NM_003002.2', 'NM_004006.2', 'DPYD')
+def test_evict(references):
+    """
+    Least recently used reference files are removed, except uploaded ones.
+    """
+    _set_sources(references[:2], 'ncbi')
+    paths = [os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % r.accession)
+             for r in references]
+
+    # The uploaded reference was least recently used.
+    os.utime(paths[0], (2000, 2000))
+    os.utime(paths[1], (3000, 3000))
+    os.utime(paths[2], (1000, 1000))
+
+    size = sum(os.path.getsize(path) for path in paths)
+    defaults = _configure_size(size - 1)
+    try:
+        with patch.object(cache, 'EVICTION_TARGET', 1):
+            assert cache.evict() == 1
+    finally:
+        settings.configure(defaults)
+
+    assert [os.path.isfile(path) for path in paths] == [False, True, True]
+
+
+@with_references('NM_003002.2', 'NM_004006.2')
+def test_evict_touched(references, output):
+    """
+    Loading a reference marks it as recently used.
+    """
+    _set_sources(references, 'ncbi')
+    paths = [os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % r.accession)
+             for r in references]
+    os.utime(paths[0], (1000, 1000))
+    os.utime(paths[1], (2000, 2000))
+
+    retriever = Retriever.GenBankRetriever(output)
+    retriever.loadrecord('NM_003002.2')
+
+    size = sum(f.size for f in cache.scan())
+    defaults = _configure_size(size - 1)
+    try:
+        with patch.object(cache, 'EVICTION_TARGET', 1):
+            cache.evict()
+    finally:
+        settings.configure(defaults)
+
+    assert [os.path.isfile(path) for path in paths] == [True, False]
+
+
+@with_references('NM_003002.2', 'DPYD')
+def test_add_evicts(references, output):
+    """
+    Adding files to a full cache removes parsed records and reference files
+    that can be retrieved again.
+    """
+    _set_sources(references[:1], 'ncbi')
+
+    defaults = _configure_size(1)
+    try:
+        retriever = Retriever.GenBankRetriever(output)
+        retriever.loadrecord('NM_003002.2')
+    finally:
+        settings.configure(defaults)
+
+    assert set(f.category for f in cache.scan()) == {'upload'}
+
+
+def test_add_over_size():
+    """
+    If files that cannot be removed exceed the cache size, adding files does
+    not scan the cache directory every time.
+    """
+    with open(os.path.join(settings.CACHE_DIR, 'other.txt'), 'wb') as f:
+        f.write(b'x' * 1000)
+
+    defaults = _configure_size(500)
+    try:
+        with patch.object(cache, 'scan', wraps=cache.scan) as scan:
+            for i in range(5):
+                path = os.path.join(settings.CACHE_DIR, 'other-%d.txt' % i)
+                with open(path, 'wb') as f:
+                    f.write(b'x' * 10)
+                cache.add(path)
+            assert scan.call_count == 1
+
+            # Another 10% of the cache size was written.
+            with open(path, 'wb') as f:
+                f.write(b'x' * 50)
+            cache.add(path)
+            assert scan.call_count == 2
+    finally:
+        settings.configure(defaults)
+
+
+def test_evict_locks():
+    """
+    Lock files that are not in use are removed.
+    """
+    lock_dir = os.path.join(settings.CACHE_DIR, 'locks')
+    os.mkdir(lock_dir)
+    paths = [os.path.join(lock_dir, name)
+             for name in ('AB026906.1.gb.lock', 'LRG_1.xml.lock')]
+    for path in paths:
+        open(path, 'w').close()
+
+    defaults = _configure_size(1000)
+    try:
+        with open(paths[1], 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            cache.evict()
+    finally:
+        settings.configure(defaults)
+
+    assert [os.path.isfile(path) for path in paths] == [False, True]
+
+
+@with_references('NM_003002.2', 'DPYD')
+def test_report(references, output):
+    """
+    The report lists the number of files and bytes per reference source.
+    """
+    _set_sources(references[:1], 'ncbi')
+    retriever = Retriever.GenBankRetriever(output)
+    retriever.loadrecord('NM_003002.2')
+    with open(os.path.join(settings.CACHE_DIR, 'batch-job-1.txt'), 'w') as f:
+        f.write('Input\tErrors\n')
+
+    sizes, _ = cache.report()
+
+    assert sorted(sizes) == ['batch-result', 'ncbi', 'parsed', 'upload']
+    assert sizes['ncbi'] == (1, os.path.getsize(
+        os.path.join(settings.CACHE_DIR, 'NM_003002.2.gb.bz2')))
+    assert sizes['batch-result'] == (1, 13)
@@ -0,0 +1,101 @@
+"""
+Tests for the mutalyzer.compression module.
+"""
+
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+
+import pytest
+
+from mutalyzer.config import settings
+from mutalyzer import cache
+from mutalyzer import compression
+from mutalyzer import Retriever
+
+from fixtures import with_references
+
+
+def _data_file(filename):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        'data', filename)
+
+
+@pytest.fixture
+def codec(request, settings):
+    """
+    Fixture configuring a codec for the cache directory.
+    """
+    name = getattr(request, 'param', 'gzip')
+    defaults = {'CACHE_CODEC': settings.CACHE_CODEC}
+    settings.configure({'CACHE_CODEC': name})
+    try:
+        yield compression.get(name)
+    finally:
+        settings.configure(defaults)
+
+
+@pytest.mark.parametrize('codec', list(compression.CODECS), indirect=True)
+def test_recompress(codec, tmpdir):
+    """
+    Files can be recompressed with every codec and opened by extension.
+    """
+    path = unicode(tmpdir.join('AB026906.1.gb.bz2'))
+    shutil.copy(_data_file('AB026906.1.gb.bz2'), path)
+    data = compression.open(path).read()
+
+    new_path = compression.recompress(path)
+    assert new_path == unicode(tmpdir.join('AB026906.1.gb')) + \
+        codec.extension
+    assert compression.split(new_path) == (
+        unicode(tmpdir.join('AB026906.1.gb')), codec)
+    assert compression.open(new_path).read() == data
+    assert compression.find(unicode(tmpdir.join('AB026906.1.gb'))) == \
+        new_path
+    assert os.path.isfile(path) == (codec.name == 'bz2')
+
+
+def test_unknown_codec():
+    """
+    Unavailable codecs are refused.
+    """
+    with pytest.raises(ValueError):
+        compression.get('rar')
+
+
+@pytest.mark.usefixtures('db')
+@with_references('AB026906.1')
+def test_loadrecord_other_codec(references, codec, output):
+    """
+    Reference files compressed with another codec than the configured one
+    are used, and new files are written with the configured one.
+    """
+    retriever = Retriever.GenBankRetriever(output)
+    record = retriever.loadrecord('AB026906.1')
+    assert record.id == 'AB026906.1'
+
+    filename = retriever._write(b'LOCUS       UD_1\n//\n', 'UD_1')
+    assert filename == os.path.join(settings.CACHE_DIR, 'UD_1.gb.gz')
+    assert compression.open(filename).read() == b'LOCUS       UD_1\n//\n'
+
+
+@pytest.mark.usefixtures('db')
+@with_references('AB026906.1', 'LRG_1')
+def test_migrate(references, codec, output):
+    """
+    The cache can be converted to the configured codec.
+    """
+    assert cache.migrate() == 2
+    assert cache.migrate() == 0
+
+    assert os.path.isfile(os.path.join(settings.CACHE_DIR,
+                                       'AB026906.1.gb.gz'))
+    assert not os.path.isfile(os.path.join(settings.CACHE_DIR,
+                                           'AB026906.1.gb.bz2'))
+
+    record = Retriever.GenBankRetriever(output).loadrecord('AB026906.1')
+    assert record.id == 'AB026906.1'
+    record = Retriever.LRGRetriever(output).loadrecord('LRG_1')
+    assert record.id == 'LRG_1'
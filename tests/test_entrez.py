@@ -0,0 +1,230 @@
+"""
+Tests for the mutalyzer.entrez module.
+"""
+
+
+from __future__ import unicode_literals
+
+import BaseHTTPServer
+import inspect
+import io
+import SocketServer
+import threading
+import time
+import urllib2
+import urlparse
+
+from Bio import Entrez
+from mock import Mock, patch
+import pytest
+
+from mutalyzer.config import settings
+from mutalyzer import entrez
+
+
+@pytest.fixture
+def stub_server(settings):
+    """
+    Fixture running a local Entrez stub server. The efetch endpoint returns
+    the `id` query parameter with version 1 (like `rettype=acc`).
+
+    Returns a list with the client port of each request.
+    """
+    ports = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            ports.append(self.client_address[1])
+            path, query = self.path.split('?', 1)
+            if not path.endswith('/efetch.fcgi'):
+                self.send_error(404)
+                return
+            params = dict(p.split('=', 1) for p in query.split('&'))
+            body = '{}.1\n'.format(params['id']).encode('ascii')
+            self.send_response(200)
+            self.send_header('Content-Length', unicode(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        # Kept-alive connections should not block the server shutdown.
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    settings.configure({
+        'ENTREZ_URL': 'http://127.0.0.1:{}/entrez/eutils/'.format(
+            server.server_port)})
+    try:
+        yield ports
+    finally:
+        settings.configure({'ENTREZ_URL': None})
+        # Close kept-alive connections to the stub server.
+        entrez._session.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_stub_server(stub_server):
+    """
+    Requests are sent to the configured Entrez URL and reuse connections.
+    """
+    for accession in ('NM_003002', 'NM_004006'):
+        handle = entrez.efetch(db='nuccore', id=accession, rettype='acc',
+                               retmode='text')
+        assert handle.read() == '{}.1\n'.format(accession)
+        handle.close()
+
+    assert len(stub_server) == 2
+    assert stub_server[0] == stub_server[1]
+
+
+def test_stub_server_client_error(stub_server):
+    """
+    Client errors are raised and not retried.
+    """
+    with pytest.raises(urllib2.HTTPError):
+        entrez.esearch(db='nuccore', term='NM_003002')
+    assert len(stub_server) == 1
+
+
+def test_stub_server_no_delay(stub_server, settings):
+    """
+    Requests are only delayed by our own rate limiting, not by
+    :mod:`Bio.Entrez`.
+    """
+    settings.configure({'ENTREZ_REQUESTS_PER_SECOND': 100})
+    try:
+        start = time.time()
+        for _ in range(5):
+            entrez.efetch(db='nuccore', id='NM_003002', rettype='acc',
+                          retmode='text').read()
+        assert time.time() - start < 0.37
+    finally:
+        settings.configure({'ENTREZ_REQUESTS_PER_SECOND': None})
+    assert len(stub_server) == 5
+
+
+def test_open_replaced():
+    """
+    The :mod:`Bio.Entrez` query functions open URLs with the private
+    :func:`Bio.Entrez._open`, which we replace.
+    """
+    assert Entrez.efetch.__globals__ is vars(Entrez)
+    assert '_open(cgi, variables' in inspect.getsource(Entrez.efetch)
+
+    entrez._configure()
+    assert Entrez._open is entrez._open
+
+
+def test_open_params(settings):
+    """
+    Requests identify us and include the API key.
+    """
+    defaults = {'EMAIL': settings.EMAIL,
+                'ENTREZ_API_KEY': settings.ENTREZ_API_KEY}
+    settings.configure({'EMAIL': 'test@example.com',
+                        'ENTREZ_API_KEY': 'abc'})
+
+    response = Mock(status_code=200, content=b'NM_003002.2')
+    try:
+        with patch.object(entrez._session, 'get',
+                          return_value=response) as get:
+            handle = entrez.efetch(db='nuccore',
+                                   id=['NM_003002', 'NM_004006'])
+            assert handle.read() == b'NM_003002.2'
+    finally:
+        settings.configure(defaults)
+
+    url = get.call_args[0][0]
+    assert url.startswith(entrez.DEFAULT_URL + 'efetch.fcgi?')
+    params = urlparse.parse_qs(url.split('?', 1)[1])
+    assert params == {'db': ['nuccore'], 'id': ['NM_003002,NM_004006'],
+                      'tool': [Entrez.tool], 'email': ['test@example.com'],
+                      'api_key': ['abc']}
+
+
+def test_retry():
+    """
+    Requests failing with a network error are retried.
+    """
+    with patch.object(Entrez, 'efetch',
+                      side_effect=[IOError(), io.BytesIO(b'NM_003002.2')]) \
+            as efetch, patch.object(entrez, 'RETRY_DELAY', 0):
+        handle = entrez.efetch(db='nuccore', id='NM_003002')
+        assert handle.read() == b'NM_003002.2'
+        assert efetch.call_count == 2
+
+
+def test_retry_give_up():
+    """
+    Requests are tried at most `ENTREZ_MAX_TRIES` times.
+    """
+    with patch.object(Entrez, 'efetch', side_effect=IOError()) as efetch, \
+            patch.object(entrez, 'RETRY_DELAY', 0):
+        with pytest.raises(IOError):
+            entrez.efetch(db='nuccore', id='NM_003002')
+        assert efetch.call_count == settings.ENTREZ_MAX_TRIES
+
+
+def test_retry_no_tries(settings):
+    """
+    Requests are tried at least once.
+    """
+    defaults = {'ENTREZ_MAX_TRIES': settings.ENTREZ_MAX_TRIES}
+    settings.configure({'ENTREZ_MAX_TRIES': 0})
+
+    try:
+        with patch.object(Entrez, 'efetch', side_effect=IOError()) as efetch:
+            with pytest.raises(IOError):
+                entrez.efetch(db='nuccore', id='NM_003002')
+            assert efetch.call_count == 1
+    finally:
+        settings.configure(defaults)
+
+
+def test_token_bucket():
+    """
+    The token bucket allows one second worth of requests at once, and limits
+    the rate after that.
+    """
+    bucket = entrez.TokenBucket()
+
+    start = time.time()
+    for _ in range(2):
+        bucket.acquire(4)
+    assert time.time() - start < 0.1
+
+    # Two tokens left, the other four take a quarter of a second each.
+    start = time.time()
+    for _ in range(6):
+        bucket.acquire(4)
+    assert time.time() - start >= 0.9
+
+
+def test_shared_token_bucket(tmpdir):
+    """
+    Token buckets with the same state file share their tokens, like they
+    would in different processes.
+    """
+    buckets = [entrez.SharedTokenBucket('test', unicode(tmpdir))
+               for _ in range(2)]
+
+    start = time.time()
+    for _ in range(4):
+        buckets[0].acquire(4)
+    assert time.time() - start < 0.1
+
+    # The other bucket has no tokens left either.
+    start = time.time()
+    for _ in range(4):
+        buckets[1].acquire(4)
+    assert time.time() - start >= 0.9
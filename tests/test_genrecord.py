@@ -0,0 +1,167 @@
+"""
+Tests for the mutalyzer.GenRecord module.
+"""
+
+
+from __future__ import unicode_literals
+
+import random
+
+from mock import patch
+
+from mutalyzer.GenRecord import GenRecord, Gene, Locus, Record, TranscriptIndex
+from mutalyzer import Crossmap
+from mutalyzer.output import Output
+
+
+def _transcript(name, sites, cds=None, orientation=1):
+    transcript = Locus(name)
+    transcript.transcriptID = 'NM_%s.1' % name
+    transcript.CM = Crossmap.Crossmap(sites, cds or [], orientation)
+    return transcript
+
+
+def test_transcript_index_overlapping():
+    """
+    The transcript index finds the same transcripts as checking all of
+    them.
+    """
+    rng = random.Random(42)
+    transcripts = []
+    for i in range(200):
+        start = rng.randint(1, 100000)
+        sites = sorted(rng.sample(range(start, start + 20000), 6))
+        cds = [sites[1], sites[4]] if i % 2 else None
+        transcripts.append(
+            _transcript('%03i' % i, sites, cds, rng.choice([1, -1])))
+    index = TranscriptIndex(transcripts)
+
+    for _ in range(100):
+        start = rng.randint(1, 130000)
+        stop = start + rng.randint(0, 2000)
+        expected = set(
+            t for t in transcripts
+            if min(t.CM.RNA + t.CM.CDS) <= stop and
+            max(t.CM.RNA + t.CM.CDS) >= start)
+        assert index.overlapping(start, stop) == expected
+
+    assert transcripts[0] in index
+    assert _transcript('new', [1, 10]) not in index
+    assert index.overlapping(200000, 300000) == set()
+
+
+def test_record_lookup():
+    """
+    Genes and transcripts are found by name and accession number, also after
+    changes to the record.
+    """
+    record = Record()
+    for name in 'ABC':
+        gene = Gene(name)
+        gene.transcriptList.append(_transcript(name, [1, 100]))
+        record.geneList.append(gene)
+
+    assert record.findGene('B') is record.geneList[1]
+    assert record.get_transcript_selector('NM_C.1') == ('C', 'C')
+    assert record.findGene('D') is None
+
+    gene = Gene('D')
+    record.geneList.append(gene)
+    assert record.findGene('D') is gene
+
+    gene.transcriptList.append(_transcript('E', [1, 100]))
+    assert record.get_transcript_selector('NM_E.1') == ('D', 'E')
+
+    record.geneList = record.geneList[2:]
+    assert record.findGene('A') is None
+    assert record.get_transcript_selector('NM_A.1') is None
+    assert record.findGene('C') is record.geneList[0]
+
+
+def test_name_near_transcripts():
+    """
+    Variants are only described on transcripts near them, with all variants
+    of the allele. Transcripts outside the window are never described.
+    """
+    record = Record()
+    for name, sites in (('A', [100, 200]), ('B', [1000, 1100]),
+                        ('C', [50000, 50100])):
+        gene = Gene(name)
+        gene.transcriptList.append(_transcript(name, sites))
+        record.geneList.append(gene)
+    record.indexTranscripts()
+    a, b, c = [gene.transcriptList[0] for gene in record.geneList]
+
+    instance = GenRecord(Output('test'))
+    instance.record = record
+    with patch.object(c.CM, 'g2c') as g2c:
+        instance.name(150, 150, 'subst', 'A', 'T', None)
+        assert a.description == '51A>T'
+        assert b.description == ''
+
+        # The first variant is added to the description of B as well.
+        instance.name(1050, 1050, 'subst', 'C', 'G', None)
+        assert a.description == '51A>T;*850C>G'
+        assert b.description == '-850A>T;51C>G'
+
+    assert c.description == ''
+    assert not g2c.called
+
+
+def test_find_locus():
+    """
+    Transcripts are found by name and by number, also after changes to the
+    transcript list.
+    """
+    gene = Gene('A')
+    for name in ('001', '002'):
+        gene.transcriptList.append(_transcript(name, [1, 100]))
+
+    assert gene.findLocus('002') is gene.transcriptList[1]
+    assert gene.findLocus('1') is gene.transcriptList[0]
+    assert gene.findLocus('003') is None
+
+    gene.transcriptList.append(_transcript('003', [1, 100]))
+    assert gene.findLocus('3') is gene.transcriptList[2]
+
+    gene.transcriptList = gene.transcriptList[1:]
+    assert gene.findLocus('1') is None
+    assert gene.findLocus('2') is gene.transcriptList[0]
+
+
+def test_name_loads_near_genes():
+    """
+    Genes that are not selected are loaded and checked when they are near
+    a variant.
+    """
+    record = Record()
+    for name, sites in (('A', [100, 200]), ('B', [1000, 1100]),
+                        ('C', [50000, 50100])):
+        gene = Gene(name)
+        gene.location = sites
+        gene.transcriptList.append(_transcript(name, sites))
+        record.geneList.append(gene)
+    a, b, c = record.geneList
+
+    record.selectGenes(['NM_A.1'])
+    assert record.geneList == [a]
+    assert sorted(record.geneIndex) == ['B', 'C']
+    record.indexTranscripts()
+
+    instance = GenRecord(Output('test'))
+    instance.record = record
+    # Checking the genes also rebuilds the transcript index.
+    with patch.object(instance, 'checkRecord',
+                      side_effect=lambda genes: record.indexTranscripts()) \
+            as checkRecord:
+        instance.name(150, 150, 'subst', 'A', 'T', None)
+        assert not checkRecord.called
+
+        instance.name(1050, 1050, 'subst', 'C', 'G', None)
+        checkRecord.assert_called_once_with([b])
+
+    assert record.geneList == [a, b]
+    assert sorted(record.geneIndex) == ['C']
+    assert b.transcriptList[0].description == '-850A>T;51C>G'
+    assert record.findGene('C') is c
+    assert record.geneList == [a, b, c]
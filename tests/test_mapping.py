@@ -10,6 +10,7 @@ import os
 
 import pytest
 
+from mutalyzer.db import session
 from mutalyzer.db.models import TranscriptMapping
 from mutalyzer import mapping
 
@@ -120,6 +121,33 @@ def test_hla_cluster(converter):
     assert 'NM_000500.5:c.92C>T' in coding
 
 
+def test_converter_cache(output, hg19):
+    """
+    Converters sharing a cache give the same results as a converter without
+    cache, also after the session is committed.
+    """
+    cache = mapping.ConverterCache(hg19)
+
+    for variant in ['NM_003002.2:c.274G>T', 'NM_003002.2:c.274G>T',
+                    'NM_000500.5:c.92C>T', 'NM_003002.1:c.274G>T']:
+        converter = mapping.Converter(hg19, output, cache=cache)
+        genomic = converter.c2chrom(variant)
+        expected = mapping.Converter(hg19, output).c2chrom(variant)
+        assert genomic == expected
+
+        if genomic:
+            coding = converter.chrom2c(genomic, 'list')
+            assert coding == mapping.Converter(hg19, output).chrom2c(
+                genomic, 'list')
+
+        session.commit()
+
+    corrected = mapping.Converter(hg19, output, cache=cache).correctChrVariant(
+        'chr11:g.111959695G>T')
+    assert corrected == 'NC_000011.9:g.111959695G>T'
+    assert len(cache._mappings) == 2
+
+
 def test_converter_del_length_reverse(converter):
     """
     Position converter on deletion (denoted by length) on transcripts
@@ -10,6 +10,7 @@ import random
 from Bio.Seq import Seq
 
 from mutalyzer.mutator import Mutator
+from mutalyzer.sequence import MappedSequence
 
 
 @pytest.fixture
@@ -18,9 +19,15 @@ def length():
     return 30
 
 
-@pytest.fixture
-def sequence(length):
-    return Seq(''.join(random.choice('ACGT') for _ in range(length)))
+@pytest.fixture(params=['memory', 'mapped'])
+def sequence(request, length, tmpdir):
+    data = ''.join(random.choice('ACGT') for _ in range(length))
+    if request.param == 'memory':
+        return Seq(data)
+    # Lazy sequence read from a memory-mapped file.
+    path = tmpdir.join('sequence.seq')
+    path.write(data)
+    return MappedSequence(unicode(path))
 
 
 @pytest.fixture
@@ -5,15 +5,24 @@ Tests for the mutalyzer.parsers.genbank module.
 
 from __future__ import unicode_literals
 
+import glob
 import os
 
+from Bio.Seq import Seq
+from mock import patch
 import pytest
 
+from mutalyzer import compression
+from mutalyzer import ncbi
+from mutalyzer.parsers import flatfile
 from mutalyzer.parsers.genbank import GBparser
 
 from fixtures import with_references
 
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
+
+
 @pytest.fixture
 def parser():
     return GBparser()
@@ -153,3 +162,107 @@ def test_mrna_and_cds_addition_to_genes(settings, references, parser):
            [None]
     assert [t.proteinID for t in record.geneList[1].transcriptList] == \
            ['NP_000454.1']
+
+
+def _dump(value):
+    """
+    Convert a parsed record to nested built-in values for comparison.
+    """
+    if isinstance(value, (list, tuple)):
+        return [_dump(item) for item in value]
+    if isinstance(value, Seq):
+        return unicode(value), type(value.alphabet).__name__
+    if hasattr(value, '__dict__'):
+        return type(value).__name__, dict((key, _dump(item)) for key, item
+                                          in vars(value).items())
+    return value
+
+
+@pytest.mark.parametrize('filename', sorted(
+    os.path.basename(path) for path in
+    glob.glob(os.path.join(DATA_DIR, '*.gb.bz2'))))
+def test_native_reader(parser, filename):
+    """
+    Records created with our own GenBank reader are the same as those created
+    with BioPython.
+    """
+    path = os.path.join(DATA_DIR, filename)
+    with compression.open(path) as handle:
+        flatfile.read(handle)
+
+    # We don't have the transcript-protein links for all these references.
+    with patch.object(ncbi, 'transcript_to_protein',
+                      side_effect=ncbi.NoLinkError()):
+        assert (_dump(parser.create_record(path)) ==
+                _dump(parser.create_record(path, native=False)))
+
+
+def _genes(record):
+    return [(gene.name, [t.transcriptID for t in gene.transcriptList])
+            for gene in record.geneList]
+
+
+@with_references('UD_144413132067')
+def test_select_genes(settings, references, parser):
+    """
+    Only selected genes are linked, other genes are loaded on demand.
+    """
+    accession = references[0].accession
+    filename = os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % accession)
+    full = parser.create_record(filename)
+
+    with patch.object(ncbi, 'transcript_to_protein',
+                      side_effect=ncbi.transcript_to_protein) as link:
+        record = parser.create_record(filename, genes=['PANDAR'])
+        assert [call[0][0] for call in link.call_args_list] == ['NR_109836']
+
+    assert [gene.name for gene in record.geneList] == ['PANDAR']
+    assert sorted(record.geneIndex) == ['CDKN1A', 'LAP3P2']
+    assert 'NM_000389.4' in record.geneIndex['CDKN1A']
+
+    assert record.findGene('CDKN1A').name == 'CDKN1A'
+    assert record.geneIndex.keys() == ['LAP3P2']
+    assert record.listGenes() == full.listGenes()
+    assert not record.geneIndex
+    assert _genes(record) == _genes(full)
+
+
+@with_references('UD_144413132067')
+def test_select_genes_by_accession(settings, references, parser):
+    """
+    Genes can be selected by transcript accession number.
+    """
+    accession = references[0].accession
+    filename = os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % accession)
+    full = parser.create_record(filename)
+
+    record = parser.create_record(filename, genes=['NM_078467.2'])
+    assert [gene.name for gene in record.geneList] == ['CDKN1A']
+    assert record.get_transcript_selector('NM_078467.2') == \
+        full.get_transcript_selector('NM_078467.2')
+
+    assert record.get_transcript_selector('NR_109836.1') == \
+        full.get_transcript_selector('NR_109836.1')
+    assert record.listGenes() == full.listGenes()
+    assert _genes(record) == _genes(full)
+
+
+@with_references('UD_144413132067')
+def test_select_genes_by_region(settings, references, parser):
+    """
+    Genes can be selected by location.
+    """
+    accession = references[0].accession
+    filename = os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % accession)
+    full = parser.create_record(filename)
+    gene = full.findGene('CDKN1A')
+    position = gene.location[0]
+
+    record = parser.create_record(filename, region=(position, position))
+    assert _genes(record) == [
+        (g.name, [t.transcriptID for t in g.transcriptList])
+        for g in full.geneList
+        if g.location[0] <= position <= g.location[1]]
+
+    record.loadGenes()
+    assert _genes(record) == _genes(full)
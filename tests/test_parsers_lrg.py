@@ -8,6 +8,9 @@ from __future__ import unicode_literals
 import os
 import bz2
 
+from lxml import etree
+import pytest
+
 from mutalyzer.parsers.lrg import create_record
 
 from fixtures import with_references
@@ -55,3 +58,37 @@ def test_lrg_no_coding_sequence(settings, references):
 
     assert len(record.geneList[0].transcriptList) == 1
     assert record.geneList[0].transcriptList[0].CDS is None
+
+
+@with_references('LRG_1')
+def test_lrg_file_handle(settings, references):
+    """
+    Records can be created from an open file.
+    """
+    accession = references[0].accession
+    filename = os.path.join(settings.CACHE_DIR, '%s.xml.bz2' % accession)
+    file_handle = bz2.BZ2File(filename, 'r')
+    record = create_record(file_handle.read())
+    file_handle.close()
+
+    file_handle = bz2.BZ2File(filename, 'r')
+    streamed = create_record(file_handle)
+    file_handle.close()
+
+    assert unicode(streamed.seq) == unicode(record.seq)
+    assert isinstance(unicode(streamed.seq), unicode)
+    assert [g.name for g in streamed.geneList] == ['COL1A1']
+    transcript = streamed.geneList[0].transcriptList[0]
+    assert transcript.location == [5001, 22544]
+    assert transcript.CDS.location == [5127, 21138]
+    assert transcript.exon.positionList[:2] == [5001, 5229]
+    assert (transcript.exon.positionList ==
+            record.geneList[0].transcriptList[0].exon.positionList)
+
+
+def test_lrg_invalid():
+    """
+    Files that are not well-formed XML raise an error.
+    """
+    with pytest.raises(etree.XMLSyntaxError):
+        create_record(b'<lrg><fixed_annotation></lrg>')
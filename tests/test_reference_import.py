@@ -0,0 +1,106 @@
+"""
+Tests for the mutalyzer.reference_import module.
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import gzip
+import os
+
+from Bio import Entrez
+from mock import patch
+import pytest
+
+from mutalyzer.config import settings
+from mutalyzer.db.models import Reference
+from mutalyzer import reference_import
+from mutalyzer import Retriever
+
+
+pytestmark = pytest.mark.usefixtures('db')
+
+
+def _data(filename):
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        'data', filename)
+    return bz2.BZ2File(path).read()
+
+
+@pytest.fixture
+def release(tmpdir):
+    """
+    Fixture creating a gzipped multi-record GenBank flat file.
+    """
+    path = unicode(tmpdir.join('release.gbff.gz'))
+    handle = gzip.open(path, 'wb')
+    for accession in ('NM_003002.2', 'NM_004006.2'):
+        handle.write(_data('%s.gb.bz2' % accession))
+    handle.close()
+    return path
+
+
+def test_genbank_records(release):
+    """
+    Records are read from a multi-record GenBank flat file.
+    """
+    with gzip.open(release) as handle:
+        records = list(reference_import.genbank_records(handle))
+
+    assert [accession for accession, _ in records] == ['NM_003002.2',
+                                                       'NM_004006.2']
+    assert records[0][1] == _data('NM_003002.2.gb.bz2').strip() + b'\n'
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_import_genbank(release, output, processes):
+    """
+    Imported references are loaded without retrieving them.
+    """
+    results = list(reference_import.import_genbank([release],
+                                                   processes=processes))
+    assert [(r.accession, r.status) for r in results] == [
+        ('NM_003002.2', 'added'), ('NM_004006.2', 'added')]
+    assert Reference.query.filter_by(accession='NM_003002.2').one() \
+        .source == 'ncbi'
+
+    with patch.object(Entrez, 'efetch') as efetch:
+        record = Retriever.GenBankRetriever(output).loadrecord('NM_003002.2')
+        assert not efetch.called
+    assert record.id == 'NM_003002.2'
+
+
+def test_import_genbank_incremental(release):
+    """
+    Importing again only writes changed or missing references.
+    """
+    list(reference_import.import_genbank([release], processes=1))
+    os.unlink(os.path.join(settings.CACHE_DIR, 'NM_004006.2.gb.bz2'))
+
+    results = list(reference_import.import_genbank([release], processes=1))
+    assert [(r.accession, r.status) for r in results] == [
+        ('NM_003002.2', 'unchanged'), ('NM_004006.2', 'restored')]
+
+    Reference.query.filter_by(accession='NM_003002.2').update(
+        {'checksum': '0' * 32})
+    results = list(reference_import.import_genbank([release], processes=1))
+    assert results[0].status == 'updated'
+    assert Reference.query.filter_by(accession='NM_003002.2').one() \
+        .checksum == results[0].checksum
+
+
+def test_import_lrg(tmpdir, output):
+    """
+    Imported LRG files are loaded without retrieving them.
+    """
+    tmpdir.join('LRG_1.xml').write(_data('LRG_1.xml.bz2'), mode='wb')
+    tmpdir.join('README.txt').write('Not an LRG file.')
+
+    results = list(reference_import.import_lrg(unicode(tmpdir), processes=1))
+    assert [(r.accession, r.status) for r in results] == [('LRG_1', 'added')]
+
+    with patch.object(Retriever.LRGRetriever, 'fetch') as fetch:
+        record = Retriever.LRGRetriever(output).loadrecord('LRG_1')
+        assert not fetch.called
+    assert record.id == 'LRG_1'
@@ -0,0 +1,427 @@
+"""
+Tests for the mutalyzer.Retriever module.
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import hashlib
+import os
+import threading
+import time
+
+from mock import call, patch
+import pytest
+
+from mutalyzer.config import settings
+from mutalyzer import GenRecord
+from mutalyzer.parsers import genbank
+from mutalyzer.parsers import lrg
+from mutalyzer import Retriever
+from mutalyzer import stats
+from mutalyzer.sequence import MappedSequence
+
+from fixtures import with_references
+
+
+pytestmark = pytest.mark.usefixtures('db')
+
+
+@pytest.fixture
+def retriever(output):
+    return Retriever.GenBankRetriever(output)
+
+
+@with_references('NM_003002.2')
+def test_parsed_record_cache(references, retriever):
+    """
+    Loading a record for the second time uses the parsed record cache.
+    """
+    checksum = references[0].checksum
+    record = retriever.loadrecord('NM_003002.2')
+    assert os.path.isfile(retriever._parsed_record_file(checksum))
+
+    # Make sure we load from the file and not from memory.
+    Retriever.shared_records.clear()
+
+    with patch.object(genbank.GBparser, 'create_record') as create_record:
+        cached = retriever.loadrecord('NM_003002.2')
+        assert not create_record.called
+
+    assert cached.id == record.id == 'NM_003002.2'
+    assert unicode(cached.seq) == unicode(record.seq)
+    assert ([gene.name for gene in cached.geneList] ==
+            [gene.name for gene in record.geneList])
+    assert ([t.CDS.location for t in cached.geneList[0].transcriptList] ==
+            [t.CDS.location for t in record.geneList[0].transcriptList])
+
+
+@with_references('NM_003002.2')
+def test_parsed_record_cache_version(references, retriever):
+    """
+    Parsed record cache files of another format version are not used.
+    """
+    retriever.loadrecord('NM_003002.2')
+    Retriever.shared_records.clear()
+
+    with patch.object(Retriever, 'PARSED_RECORD_VERSION',
+                      Retriever.PARSED_RECORD_VERSION + 1):
+        with patch.object(genbank.GBparser, 'create_record',
+                          autospec=True,
+                          side_effect=genbank.GBparser.create_record) \
+                as create_record:
+            record = retriever.loadrecord('NM_003002.2')
+            assert create_record.call_count == 1
+
+        # The file was replaced with the new format version.
+        assert retriever._load_parsed_record(
+            references[0].checksum) is not None
+
+    assert record.id == 'NM_003002.2'
+
+
+@with_references('NM_003002.2')
+def test_shared_record_cache(references, retriever):
+    """
+    Records are shared between retrievers, but modifying a loaded record does
+    not affect the cached record.
+    """
+    record = retriever.loadrecord('NM_003002.2')
+    name = record.geneList[0].name
+    record.geneList[0].name = 'modified'
+
+    with patch.object(Retriever.GenBankRetriever,
+                      '_load_parsed_record') as load_parsed_record, \
+            patch.object(stats, 'increment_counter') as increment_counter:
+        other = Retriever.GenBankRetriever(retriever._output)
+        cached = other.loadrecord('NM_003002.2')
+        assert not load_parsed_record.called
+        assert [c for c in increment_counter.call_args_list
+                if c[0][0].startswith('record-cache/')] == \
+            [call('record-cache/hit')]
+
+    assert cached is not record
+    assert cached.geneList[0].name == name
+    assert cached.seq is record.seq
+
+
+@with_references('NM_003002.2', 'NM_004006.2')
+def test_shared_record_cache_size(references, retriever):
+    """
+    Least recently used records are discarded from the shared record cache
+    if it grows too large.
+    """
+    size = max(Retriever._record_size(retriever.loadrecord(accession))
+               for accession in ('NM_003002.2', 'NM_004006.2'))
+    Retriever.shared_records.clear()
+
+    defaults = {'SHARED_RECORD_CACHE_SIZE':
+                settings.SHARED_RECORD_CACHE_SIZE}
+    settings.configure({'SHARED_RECORD_CACHE_SIZE': size})
+    try:
+        retriever.loadrecord('NM_003002.2')
+        retriever.loadrecord('NM_004006.2')
+        assert Retriever.shared_records.get(
+            ('gb', references[0].checksum)) is None
+        assert Retriever.shared_records.get(
+            ('gb', references[1].checksum)) is not None
+    finally:
+        settings.configure(defaults)
+
+
+def test_single_flight(retriever):
+    """
+    Retrievals of the same record wait for each other.
+    """
+    events = []
+
+    def retrieve():
+        with retriever._single_flight('NM_003002.2') as waited:
+            events.append(('retrieve', waited))
+
+    with retriever._single_flight('NM_003002.2') as waited:
+        assert not waited
+        thread = threading.Thread(target=retrieve)
+        thread.start()
+        time.sleep(0.5)
+        events.append(('first', waited))
+
+    thread.join()
+    assert events == [('first', False), ('retrieve', True)]
+
+
+def test_single_flight_timeout(retriever):
+    """
+    Retrievals stop waiting for each other after a timeout.
+    """
+    defaults = {'FETCH_LOCK_TIMEOUT': settings.FETCH_LOCK_TIMEOUT}
+    settings.configure({'FETCH_LOCK_TIMEOUT': 0.2})
+    try:
+        with retriever._single_flight('NM_003002.2'):
+            with retriever._single_flight('NM_003002.2') as waited:
+                assert waited
+    finally:
+        settings.configure(defaults)
+
+
+@with_references('NM_003002.2')
+def test_fetch_single_flight(references, retriever):
+    """
+    Fetching a record does not download it again if another fetch stored it
+    while we were waiting.
+    """
+    filename = retriever._name_to_file('NM_003002.2')
+    os.rename(filename, filename + '.fetched')
+
+    with patch.object(Retriever.GenBankRetriever, '_fetch') as fetch:
+        with retriever._single_flight('NM_003002.2'):
+            result = []
+            thread = threading.Thread(
+                target=lambda: result.append(retriever.fetch('NM_003002.2')))
+            thread.start()
+            time.sleep(0.5)
+            os.rename(filename + '.fetched', filename)
+
+        thread.join()
+        assert not fetch.called
+
+    assert result == [filename]
+
+
+def test_write_chunks(retriever):
+    """
+    Data is converted to UTF-8 in chunks, also if the encoding changes after
+    the prefix used to detect the encoding.
+    """
+    raw_data = b'LOCUS' * 20 + 'Caf\xe9, '.encode('latin-1') * 20
+
+    with patch.object(Retriever, 'ENCODING_PREFIX_SIZE', 50), \
+            patch.object(Retriever, 'WRITE_CHUNK_SIZE', 7):
+        filename = retriever._write(raw_data, 'AB026906.1')
+
+    with bz2.BZ2File(filename) as handle:
+        assert handle.read() == raw_data.decode('latin-1').encode('utf-8')
+
+    # The retriever does not keep the data.
+    assert raw_data not in vars(retriever).values()
+    assert retriever._calculate_hash(raw_data) == \
+        hashlib.md5(raw_data).hexdigest()
+
+
+def test_write_decode_error(retriever):
+    """
+    Data that cannot be decoded is not written, not even partially.
+    """
+    raw_data = b'LOCUS' * 20 + 'Caf\xe9, '.encode('latin-1') * 20
+
+    with patch.object(Retriever, '_detect_encoding', return_value='ascii'):
+        assert retriever._write(raw_data, 'AB026906.1') is None
+
+    assert os.listdir(settings.CACHE_DIR) == []
+
+
+@pytest.mark.parametrize('orientation', [1, 2])
+@with_references('MARK1')
+def test_retrieveslice_crop(references, retriever, orientation):
+    """
+    A slice contained in a larger slice we have is cropped from it instead
+    of retrieved.
+    """
+    references[0].source = 'ncbi_slice'
+    references[0].source_data = 'NC_000001.10:220696568:220839800:forward'
+    parent = retriever.loadrecord('UD_139015213982')
+
+    with patch.object(Retriever.entrez, 'efetch') as efetch:
+        ud = retriever.retrieveslice('NC_000001.10', 220700568, 220838800,
+                                     orientation)
+        assert not efetch.called
+    assert ud and ud != 'UD_139015213982'
+
+    record = retriever.loadrecord(ud)
+    sequence = parent.seq[4000:142233]
+    if orientation == 1:
+        assert record.chromOffset == 220700568
+        assert record.orientation == 1
+    else:
+        sequence = sequence.reverse_complement()
+        assert record.chromOffset == 220838800
+        assert record.orientation == -1
+    assert unicode(record.seq) == unicode(sequence)
+    assert (sorted(gene.name for gene in record.geneList) ==
+            sorted(gene.name for gene in parent.geneList))
+
+    gene = record.findGene('MARK1')
+    if orientation == 1:
+        assert gene.location == [1001, 137232]
+    else:
+        assert gene.location == [1002, 137233]
+
+    # The second time we get the same slice.
+    with patch.object(Retriever.entrez, 'efetch') as efetch:
+        assert retriever.retrieveslice('NC_000001.10', 220700568, 220838800,
+                                       orientation) == ud
+        assert not efetch.called
+
+
+@with_references('MARK1')
+def test_retrieveslice_crop_partial_feature(references, retriever):
+    """
+    A slice contained in a larger slice we have is retrieved if it contains
+    part of a feature.
+    """
+    references[0].source = 'ncbi_slice'
+    references[0].source_data = 'NC_000001.10:220696568:220839800:forward'
+
+    with patch.object(Retriever.entrez, 'efetch',
+                      side_effect=IOError()) as efetch:
+        assert retriever.retrieveslice('NC_000001.10', 220796568, 220806568,
+                                       1) is None
+        assert efetch.called
+
+
+@with_references('NM_003002.2')
+def test_parsed_record_cache_sequence(references, retriever):
+    """
+    Sequences of cached parsed records are read from a raw sequence file.
+    """
+    checksum = references[0].checksum
+    with patch.object(Retriever, 'MAPPED_SEQUENCE_SIZE', 1):
+        record = retriever.loadrecord('NM_003002.2')
+    sequence_file = retriever._parsed_sequence_file(checksum)
+    assert isinstance(record.seq, MappedSequence)
+    assert record.seq.filename == sequence_file
+
+    # Without the raw sequence file, the reference is parsed again.
+    Retriever.shared_records.clear()
+    os.unlink(sequence_file)
+    assert retriever._load_parsed_record(checksum) is None
+    with patch.object(Retriever, 'MAPPED_SEQUENCE_SIZE', 1):
+        cached = retriever.loadrecord('NM_003002.2')
+    assert os.path.isfile(sequence_file)
+    assert unicode(cached.seq) == unicode(record.seq)
+
+
+@with_references('NM_003002.2')
+def test_parsed_record_cache_short_sequence(references, retriever):
+    """
+    Short sequences of cached parsed records are kept in memory.
+    """
+    checksum = references[0].checksum
+    record = retriever.loadrecord('NM_003002.2')
+    assert not isinstance(record.seq, MappedSequence)
+    assert not os.path.exists(retriever._parsed_sequence_file(checksum))
+
+    Retriever.shared_records.clear()
+    cached = retriever._load_parsed_record(checksum)
+    assert not isinstance(cached.seq, MappedSequence)
+    assert unicode(cached.seq) == unicode(record.seq)
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'),
+                    reason='requires /proc/self/fd')
+def test_shared_record_cache_mapped(tmpdir):
+    """
+    The number of records with a memory-mapped sequence in the shared record
+    cache, and thereby the number of open files, is bounded.
+    """
+    Retriever.shared_records.clear()
+    open_files = len(os.listdir('/proc/self/fd'))
+
+    defaults = {'SHARED_RECORD_CACHE_MAPPED':
+                settings.SHARED_RECORD_CACHE_MAPPED}
+    settings.configure({'SHARED_RECORD_CACHE_MAPPED': 5})
+    try:
+        for i in range(50):
+            path = tmpdir.join('%d.seq' % i)
+            path.write(b'ACGT')
+            record = GenRecord.Record()
+            record.seq = MappedSequence(unicode(path))
+            Retriever.shared_records.add(('gb', '%d' % i), record)
+            record = None
+            assert len(os.listdir('/proc/self/fd')) <= open_files + 5
+
+        # The most recently added records are kept.
+        assert Retriever.shared_records.get(('gb', '0')) is None
+        assert Retriever.shared_records.get(('gb', '49')) is not None
+    finally:
+        settings.configure(defaults)
+        Retriever.shared_records.clear()
+
+
+@with_references('UD_144413132067')
+def test_loadrecord_select_genes(references, retriever):
+    """
+    Records loaded for selected genes are only kept in memory, by
+    selection. The same selection is made on fully parsed records if they
+    are cached.
+    """
+    checksum = references[0].checksum
+    record = retriever.loadrecord('UD_144413132067', genes=['PANDAR'])
+    assert [gene.name for gene in record.geneList] == ['PANDAR']
+    assert sorted(record.geneIndex) == ['CDKN1A', 'LAP3P2']
+    assert not os.path.isfile(retriever._parsed_record_file(checksum))
+
+    with patch.object(genbank.GBparser, 'create_record') as create_record:
+        record = retriever.loadrecord('UD_144413132067', genes=['PANDAR'])
+        assert not create_record.called
+    assert [gene.name for gene in record.geneList] == ['PANDAR']
+
+    retriever.loadrecord('UD_144413132067')
+    record = retriever.loadrecord('UD_144413132067', genes=['PANDAR'])
+    assert [gene.name for gene in record.geneList] == ['PANDAR']
+    assert sorted(record.geneIndex) == ['CDKN1A']
+    assert record.findGene('CDKN1A') is not None
+    assert sorted(record.listGenes()) == ['CDKN1A', 'PANDAR']
+
+
+@with_references('UD_144413132067')
+def test_record_cache_select_genes(references, retriever):
+    """
+    Records loaded for selected genes are cached by selection, the same
+    selection is made on the complete record if we have it.
+    """
+    records = Retriever.RecordCache(10)
+    record = records.loadrecord(retriever, 'UD_144413132067',
+                                genes=['PANDAR'])
+    assert [gene.name for gene in record.geneList] == ['PANDAR']
+
+    with patch.object(retriever, 'loadrecord') as loadrecord:
+        record = records.loadrecord(retriever, 'UD_144413132067',
+                                    genes=['PANDAR'])
+        assert not loadrecord.called
+    assert [gene.name for gene in record.geneList] == ['PANDAR']
+
+    record = records.loadrecord(retriever, 'UD_144413132067')
+    assert sorted(gene.name for gene in record.geneList) == \
+        ['CDKN1A', 'PANDAR']
+
+    with patch.object(retriever, 'loadrecord') as loadrecord:
+        record = records.loadrecord(retriever, 'UD_144413132067',
+                                    genes=['CDKN1A'])
+        assert not loadrecord.called
+    assert [gene.name for gene in record.geneList] == ['CDKN1A']
+    assert sorted(record.geneIndex) == ['PANDAR']
+
+
+@with_references('LRG_1')
+def test_parsed_record_cache_lrg(references, output):
+    """
+    Loading an LRG record for the second time uses the parsed record cache.
+    """
+    retriever = Retriever.LRGRetriever(output)
+    checksum = references[0].checksum
+    record = retriever.loadrecord('LRG_1')
+    assert os.path.isfile(retriever._parsed_record_file(checksum))
+
+    # Make sure we load from the file and not from memory.
+    Retriever.shared_records.clear()
+
+    with patch.object(lrg, 'create_record') as create_record:
+        cached = retriever.loadrecord('LRG_1')
+        assert not create_record.called
+
+    assert cached.id == record.id == 'LRG_1'
+    assert unicode(cached.seq) == unicode(record.seq)
+    assert ([t.name for t in cached.geneList[0].transcriptList] ==
+            [t.name for t in record.geneList[0].transcriptList])
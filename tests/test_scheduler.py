@@ -6,8 +6,10 @@ Tests for the mutalyzer.Scheduler module.
 from __future__ import unicode_literals
 
 import bz2
+from datetime import datetime, timedelta
 import os
 import io
+import time
 
 import pytest
 import httplib
@@ -15,10 +17,13 @@ from Bio import Entrez
 from mock import patch
 
 from mutalyzer.config import settings
-from mutalyzer.db.models import BatchJob
+from mutalyzer.db import queries, session
+from mutalyzer.db.models import BatchJob, BatchQueueItem
+from mutalyzer import entrez
 from mutalyzer import File
 from mutalyzer import output
 from mutalyzer import Scheduler
+from mutalyzer.parsers import genbank
 
 from fixtures import with_references
 
@@ -119,6 +124,51 @@ def test_snp_converter_rs1():
         _batch_job_plain_text(snps, expected, 'snp-converter')
 
 
+def test_snp_converter_prefetch():
+    """
+    SNP converter batch job - dbSNP records are retrieved for the entire
+    block in one request.
+    """
+    snps = ['rs9919552', 'rs1', 'rs9919552']
+    descriptions = '|'.join(['NC_000011.10:g.112088901C>T',
+                             'NC_000011.9:g.111959625C>T',
+                             'NG_012337.3:g.7055C>T',
+                             'NM_003002.4:c.204C>T',
+                             'NM_003002.3:c.204C>T',
+                             'NM_001276506.2:c.204C>T',
+                             'NM_001276506.1:c.204C>T',
+                             'NM_001276504.2:c.87C>T',
+                             'NM_001276504.1:c.87C>T',
+                             'NR_077060.1:n.288C>T',
+                             'NG_033145.1:g.2898G>A'])
+    expected = [['rs9919552', descriptions],
+                ['rs1',
+                 '',
+                 '(ncbi): Non existing rs1 in the DB or no root element.'],
+                ['rs9919552', descriptions]]
+
+    # Patch Bio.Entrez.efetch to return the dbSNP record for rs9919552 if it
+    # was requested and an empty result otherwise.
+    requested = []
+
+    def mock_efetch(*args, **kwargs):
+        requested.append(kwargs['id'])
+        if '9919552' in kwargs['id'].split(','):
+            filename = 'rs9919552.xml.bz2'
+        else:
+            filename = 'rs1.xml.bz2'
+        path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'data',
+                            filename)
+        return bz2.BZ2File(path)
+
+    with patch.object(Entrez, 'efetch', mock_efetch):
+        _batch_job_plain_text(snps, expected, 'snp-converter')
+
+    # The non-existing rs1 is requested again separately to report the error.
+    assert requested == ['9919552,1', '1']
+
+
 def test_snp_converter_rs0_io_error():
     """
     SNP converter batch job - check Entrez.fetch IOError exception (rsid=0).
@@ -145,6 +195,55 @@ def test_snp_converter_rs0_http_error():
         _batch_job_plain_text(snps, expected, 'snp-converter')
 
 
+def test_snp_converter_transient_error():
+    """
+    SNP converter batch job - a communication error for an entry is not
+    reused for identical entries.
+    """
+    snps = ['rs9919552', 'rs9919552']
+    expected = [['rs9919552',
+                 '',
+                 '(ncbi): An error occured while communicating with dbSNP.'],
+                ['rs9919552',
+                 '|'.join(['NC_000011.10:g.112088901C>T',
+                           'NC_000011.9:g.111959625C>T',
+                           'NG_012337.3:g.7055C>T',
+                           'NM_003002.4:c.204C>T',
+                           'NM_003002.3:c.204C>T',
+                           'NM_001276506.2:c.204C>T',
+                           'NM_001276506.1:c.204C>T',
+                           'NM_001276504.2:c.87C>T',
+                           'NM_001276504.1:c.87C>T',
+                           'NR_077060.1:n.288C>T',
+                           'NG_033145.1:g.2898G>A'])]]
+
+    # Patch Bio.Entrez.efetch to fail for the prefetch and the first entry,
+    # and to return the dbSNP record for rs9919552 after that.
+    calls = []
+
+    def mock_efetch(*args, **kwargs):
+        calls.append(kwargs['id'])
+        if len(calls) <= 2:
+            raise IOError()
+        path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'data',
+                            'rs9919552.xml.bz2')
+        return bz2.BZ2File(path)
+
+    defaults = {'ENTREZ_MAX_TRIES': settings.ENTREZ_MAX_TRIES,
+                'BATCH_DEDUPLICATE_WINDOW': settings.BATCH_DEDUPLICATE_WINDOW}
+    settings.configure({'ENTREZ_MAX_TRIES': 1,
+                        'BATCH_DEDUPLICATE_WINDOW': 60})
+
+    try:
+        with patch.object(Entrez, 'efetch', mock_efetch):
+            _batch_job_plain_text(snps, expected, 'snp-converter')
+    finally:
+        settings.configure(defaults)
+
+    assert len(calls) == 3
+
+
 def test_large_input():
     """
     Simple batch job with large input.
@@ -210,6 +309,81 @@ def test_name_checker():
     _batch_job_plain_text(variants, expected, 'name-checker')
 
 
+@with_references('AB026906.1', 'NM_000059.3')
+def test_name_checker_parse_once():
+    """
+    Name checker batch job with several entries on the same reference. Each
+    reference is parsed only once.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'NM_000059.3:c.670G>T',
+                'AB026906.1(SDHD_v001):c.274G>T']
+    expected = [['AB026906.1:c.274G>T',
+                 '(GenRecord): No mRNA field found for gene SDHD, '
+                 'transcript variant 001 in record, constructing it from '
+                 'CDS. Please note that descriptions exceeding CDS '
+                 'boundaries are invalid.',
+                 'AB026906.1',
+                 'SDHD_v001',
+                 'c.274G>T',
+                 'g.7872G>T',
+                 'c.274G>T',
+                 'p.(Asp92Tyr)',
+                 'SDHD_v001:c.274G>T',
+                 'SDHD_v001:p.(Asp92Tyr)',
+                 '',
+                 '',
+                 'BAA81889.1',
+                 'AB026906.1(SDHD_v001):c.274G>T',
+                 'AB026906.1(SDHD_i001):p.(Asp92Tyr)',
+                 'CviQI,RsaI',
+                 'BccI'],
+                ['NM_000059.3:c.670G>T',
+                 '',
+                 'NM_000059.3',
+                 'BRCA2_v001',
+                 'c.670G>T',
+                 'n.897G>T',
+                 'c.670G>T',
+                 'p.(Asp224Tyr)',
+                 'BRCA2_v001:c.670G>T',
+                 'BRCA2_v001:p.(Asp224Tyr)',
+                 '',
+                 'NM_000059.3',
+                 'NP_000050.2',
+                 'NM_000059.3(BRCA2_v001):c.670G>T',
+                 'NM_000059.3(BRCA2_i001):p.(Asp224Tyr)',
+                 '',
+                 'BspHI,CviAII,FatI,Hpy188III,NlaIII'],
+                ['AB026906.1(SDHD_v001):c.274G>T',
+                 '(GenRecord): No mRNA field found for gene SDHD, '
+                 'transcript variant 001 in record, constructing it from '
+                 'CDS. Please note that descriptions exceeding CDS '
+                 'boundaries are invalid.',
+                 'AB026906.1',
+                 'SDHD_v001',
+                 'c.274G>T',
+                 'g.7872G>T',
+                 'c.274G>T',
+                 'p.(Asp92Tyr)',
+                 'SDHD_v001:c.274G>T',
+                 'SDHD_v001:p.(Asp92Tyr)',
+                 '',
+                 '',
+                 'BAA81889.1',
+                 'AB026906.1(SDHD_v001):c.274G>T',
+                 'AB026906.1(SDHD_i001):p.(Asp92Tyr)',
+                 'CviQI,RsaI',
+                 'BccI']]
+
+    create_record = genbank.GBparser.create_record
+    with patch.object(genbank.GBparser, 'create_record', autospec=True,
+                      side_effect=create_record) as mock_create_record:
+        _batch_job_plain_text(variants, expected, 'name-checker')
+
+    assert mock_create_record.call_count == 2
+
+
 def test_name_checker_altered():
     """
     Name checker job with altered entries.
@@ -417,6 +591,187 @@ def test_name_checker_skipped():
         _batch_job_plain_text(variants, expected, 'name-checker')
 
 
+@with_references('NM_000059.3')
+def test_name_checker_prefetch_skipped(references):
+    """
+    Name checker job with entries skipped after their reference could not be
+    retrieved in the background.
+    """
+    variants = ['NM_000059.3:c.670G>T',
+                'NM_1234567890.3:c.670G>T',
+                'NM_1234567890.3:c.570G>T',
+                'NM_1234567890.3(BRCA2_v001):c.470G>T']
+    expected = [['NM_000059.3:c.670G>T',
+                 '',
+                 'NM_000059.3',
+                 'BRCA2_v001',
+                 'c.670G>T',
+                 'n.897G>T',
+                 'c.670G>T',
+                 'p.(Asp224Tyr)',
+                 'BRCA2_v001:c.670G>T',
+                 'BRCA2_v001:p.(Asp224Tyr)',
+                 '',
+                 'NM_000059.3',
+                 'NP_000050.2',
+                 'NM_000059.3(BRCA2_v001):c.670G>T',
+                 'NM_000059.3(BRCA2_i001):p.(Asp224Tyr)',
+                 '',
+                 'BspHI,CviAII,FatI,Hpy188III,NlaIII'],
+                ['NM_1234567890.3:c.670G>T',
+                 '(Retriever): Could not retrieve NM_1234567890.3.|'
+                 '(Scheduler): All further occurrences with '
+                 '\'NM_1234567890.3\' will be skipped'],
+                ['NM_1234567890.3:c.570G>T',
+                 '(Scheduler): Skipping entry'],
+                ['NM_1234567890.3(BRCA2_v001):c.470G>T',
+                 '(Scheduler): Skipping entry']]
+
+    requested = []
+
+    def mock_efetch(*args, **kwargs):
+        requested.append(kwargs.get('id'))
+        raise IOError()
+
+    # Entries are processed only after the prefetcher is done.
+    prefetch_reference = Scheduler._prefetch_reference
+
+    def mock_prefetch_reference(reference):
+        try:
+            return prefetch_reference(reference)
+        finally:
+            prefetched.append(reference)
+
+    prefetched = []
+    process = Scheduler.Scheduler._Scheduler__processBlock
+
+    def mock_process(self, *args, **kwargs):
+        while len(prefetched) < 2:
+            time.sleep(0.1)
+        return process(self, *args, **kwargs)
+
+    with patch.object(Entrez, 'efetch', mock_efetch), \
+            patch.object(entrez, 'RETRY_DELAY', 0), \
+            patch.object(Scheduler, '_prefetch_reference',
+                         mock_prefetch_reference), \
+            patch.object(Scheduler.Scheduler, '_Scheduler__processBlock',
+                         mock_process):
+        _batch_job_plain_text(variants, expected, 'name-checker')
+
+    # The cached reference was not retrieved again and the failing reference
+    # was tried once in the background and once by the first entry.
+    assert sorted(prefetched) == ['NM_000059.3', 'NM_1234567890.3']
+    assert requested == ['NM_1234567890.3'] * (2 * settings.ENTREZ_MAX_TRIES)
+
+
+def test_prefetcher():
+    """
+    References that could not be retrieved are reported by the prefetcher.
+    """
+    prefetcher = Scheduler.Prefetcher(2)
+
+    with patch.object(Scheduler, '_prefetch_reference',
+                      side_effect=lambda reference: reference != 'AB026906.2'):
+        prefetcher.add(1, [('AB026906.1', 1), ('AB026906.2', 2),
+                           ('LRG_1', 3)])
+        failed = []
+        for _ in range(50):
+            failed.extend(prefetcher.failed())
+            if failed:
+                break
+            time.sleep(0.1)
+        prefetcher.stop()
+
+    assert failed == [(1, 'AB026906.2', 2)]
+    assert prefetcher.failed() == []
+
+
+def test_prefetch_reference():
+    """
+    Only references that can be retrieved from the NCBI or the LRG website
+    are prefetched.
+    """
+    for reference in ('NM_003002.2', 'AB026906.1', 'NG_012337.1', 'LRG_1'):
+        assert Scheduler.PREFETCH_REFERENCE.match(reference)
+    for reference in ('NM_003002', 'NC_000011.9', 'UD_144413132067',
+                      'chr11'):
+        assert not Scheduler.PREFETCH_REFERENCE.match(reference)
+
+
+def test_prefetcher_exception():
+    """
+    References of which the retrieval raised an exception are not reported
+    as failed by the prefetcher.
+    """
+    prefetcher = Scheduler.Prefetcher(1)
+
+    with patch.object(Scheduler, '_prefetch_reference',
+                      side_effect=ValueError()) as prefetch_reference:
+        prefetcher.add(1, [('AB026906.1', 1)])
+        for _ in range(50):
+            if prefetch_reference.called:
+                break
+            time.sleep(0.1)
+        prefetcher.stop()
+
+    assert prefetch_reference.called
+    assert prefetcher.failed() == []
+
+
+def test_prefetch_open_job():
+    """
+    References of a job that is still open when processing returns are
+    retrieved in the background and not queued again by the next call.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'NM_000059.3:c.670G>T',
+                'AL449423.14(CDKN2A_v002):c.5_400del']
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+
+    # With one thread, the other references are still queued when
+    # processing returns.
+    defaults = {'BATCH_PREFETCH_THREADS': settings.BATCH_PREFETCH_THREADS}
+    settings.configure({'BATCH_PREFETCH_THREADS': 1})
+    try:
+        file_instance = File.File(output.Output('test'))
+        scheduler = Scheduler.Scheduler('test-worker')
+    finally:
+        settings.configure(defaults)
+
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'name-checker')
+    batch_job = BatchJob.query.filter_by(result_id=result_id).one()
+
+    # Another worker leases all items, so there is nothing for us to do.
+    leased = queries.lease_batch_queue_items(batch_job, 'other-worker', 3)
+
+    prefetched = []
+
+    def mock_prefetch_reference(reference):
+        time.sleep(0.5)
+        prefetched.append(reference)
+        return True
+
+    with patch.object(Scheduler, '_prefetch_reference',
+                      mock_prefetch_reference):
+        scheduler.process()
+        for _ in range(50):
+            if len(prefetched) == 3:
+                break
+            time.sleep(0.1)
+        assert sorted(prefetched) == ['AB026906.1', 'AL449423.14',
+                                      'NM_000059.3']
+
+        queries.complete_batch_queue_items(
+            'other-worker', [(item_id, '%s\tOK\n' % item)
+                             for item_id, item, _ in leased])
+        scheduler.process()
+
+    assert batch_job.batch_queue_items.count() == 0
+    assert len(prefetched) == 3
+
+
 @pytest.mark.usefixtures('hg19_transcript_mappings')
 def test_position_converter():
     """
@@ -510,6 +865,32 @@ def test_invalid_zip_file():
     assert job is None
 
 
+def test_old_style_input():
+    """
+    Old style batch input file with a header and some invalid lines. The
+    entries are produced lazily.
+    """
+    lines = (['AccNo\tGenesymbol\tMutation'] +
+             ['AB026906.1\tSDHD\tg.7872G>T'] * 20 +
+             ['',
+              'NM_003002.2\t\tc.3_4insG',
+              'AB026906.1\t\t'])
+    batch_file = io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    O = output.Output('test')
+    file_instance = File.File(O)
+    job, columns = file_instance.parseBatchFile(batch_file)
+    assert not isinstance(job, list)
+    assert columns == 1
+    assert list(job) == (['AB026906.1(SDHD):g.7872G>T'] * 20 +
+                         ['~!',
+                          'NM_003002.2:c.3_4insG',
+                          '~!InputFields: AB026906.1||'])
+
+    # One message for the invalid line and one for accepting the file.
+    assert len(O.getMessagesWithErrorCode('EBPARSE')) == 2
+
+
 def test_unicode_input():
     """
     Simple input with some non-ASCII unicode characters.
@@ -540,3 +921,332 @@ def test_windows_1252_input():
                  'OK']]
 
     _batch_job(batch_file, expected, 'syntax-checker')
+
+
+def test_leased_item():
+    """
+    Batch job with an item leased by another worker. Results are written in
+    input order once the other worker completes its item.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'AL449423.14(CDKN2A_v002):c.5_400del',
+                'AB026906.1:c.274G>A']
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler('test-worker')
+
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'syntax-checker')
+    batch_job = BatchJob.query.filter_by(result_id=result_id).one()
+    filename = os.path.join(settings.CACHE_DIR, 'batch-job-%s.txt' % result_id)
+
+    # Another worker leases the first item.
+    [(item_id, item, flags)] = queries.lease_batch_queue_items(
+        batch_job, 'other-worker', 1)
+    assert item == variants[0]
+
+    # The other items are processed, but their results can only be written
+    # after the first item is completed.
+    scheduler.process()
+    assert batch_job.batch_queue_items.count() == 3
+    assert not os.path.exists(filename)
+
+    queries.complete_batch_queue_items('other-worker',
+                                       [(item_id, '%s\tOK\n' % item)])
+    scheduler.process()
+    assert batch_job.batch_queue_items.count() == 0
+
+    result = io.open(filename, encoding='utf-8')
+    next(result)  # Header.
+    assert [line.strip().split('\t') for line in result] == [
+        ['AB026906.1:c.274G>T', 'OK'],
+        ['AL449423.14(CDKN2A_v002):c.5_400del', 'OK'],
+        ['AB026906.1:c.274G>A', 'OK']]
+
+
+def test_expired_lease():
+    """
+    Batch job with an item leased by a worker that died. The item is
+    processed after the lease has expired.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'AL449423.14(CDKN2A_v002):c.5_400del']
+    expected = [['AB026906.1:c.274G>T',
+                 'OK'],
+                ['AL449423.14(CDKN2A_v002):c.5_400del',
+                 'OK']]
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler('test-worker')
+
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'syntax-checker')
+    batch_job = BatchJob.query.filter_by(result_id=result_id).one()
+
+    [(item_id, _, _)] = queries.lease_batch_queue_items(
+        batch_job, 'dead-worker', 1)
+    BatchQueueItem.query.filter_by(id=item_id).update(
+        {'lease_expires': datetime.now() - timedelta(seconds=1)})
+    session.commit()
+
+    scheduler.process()
+    assert batch_job.batch_queue_items.count() == 0
+
+    result = io.open(os.path.join(settings.CACHE_DIR,
+                                  'batch-job-%s.txt' % result_id),
+                     encoding='utf-8')
+    next(result)  # Header.
+    assert expected == [line.strip().split('\t') for line in result]
+
+
+def test_lease_block():
+    """
+    Lease blocks of batch queue items for different workers.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'AL449423.14(CDKN2A_v002):c.5_400del',
+                'AB026906.1:c.274G>A']
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler()
+
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'syntax-checker')
+    batch_job = BatchJob.query.filter_by(result_id=result_id).one()
+
+    block_a = queries.lease_batch_queue_items(batch_job, 'worker-a', 2)
+    assert [item for _, item, _ in block_a] == variants[:2]
+
+    block_b = queries.lease_batch_queue_items(batch_job, 'worker-b', 2)
+    assert [item for _, item, _ in block_b] == variants[2:]
+
+    assert queries.lease_batch_queue_items(batch_job, 'worker-b', 2) == []
+
+    # Released items can be leased again.
+    queries.release_batch_queue_items('worker-a',
+                                      [item_id for item_id, _, _ in block_a])
+    block_b = queries.lease_batch_queue_items(batch_job, 'worker-b', 5)
+    assert [item for _, item, _ in block_b] == variants[:2]
+
+
+def test_lease_renewal():
+    """
+    Leases on a block are renewed while it is processed, so items are not
+    leased by another worker when the block takes longer than the lease
+    duration.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'AL449423.14(CDKN2A_v002):c.5_400del',
+                'AB026906.1:c.274G>A']
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler('test-worker')
+
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'syntax-checker')
+    batch_job = BatchJob.query.filter_by(result_id=result_id).one()
+
+    process = Scheduler.Scheduler._processSyntaxCheck
+    stolen = []
+
+    def mock_process(self, *args):
+        time.sleep(0.8)
+        stolen.extend(queries.lease_batch_queue_items(
+            batch_job, 'other-worker', 3))
+        return process(self, *args)
+
+    defaults = {'BATCH_LEASE_DURATION': settings.BATCH_LEASE_DURATION}
+    settings.configure({'BATCH_LEASE_DURATION': 2})
+
+    try:
+        with patch.object(Scheduler.Scheduler, '_processSyntaxCheck',
+                          mock_process):
+            scheduler.process()
+    finally:
+        settings.configure(defaults)
+
+    assert stolen == []
+    assert batch_job.batch_queue_items.count() == 0
+
+
+def test_duplicate_entries():
+    """
+    Identical entries in a batch job are processed only once and their
+    results are written with the correct separators.
+    """
+    variants = ['AB026906.1:c.274G>T\tAB026906.1:c.274G>T',
+                'AB026906.1:c.274G>T\tNM_003002.2:c.3_4insG',
+                'NM_003002.2:c.3_4insG\tAB026906.1:c.274G>T']
+    expected = [['AB026906.1:c.274G>T', 'OK', 'AB026906.1:c.274G>T', 'OK'],
+                ['AB026906.1:c.274G>T', 'OK', 'NM_003002.2:c.3_4insG', 'OK'],
+                ['NM_003002.2:c.3_4insG', 'OK', 'AB026906.1:c.274G>T', 'OK']]
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+
+    file_instance = File.File(output.Output('test'))
+    job, columns = file_instance.parseBatchFile(batch_file)
+
+    # Process one entry at a time, so results are fanned out to the other
+    # entries in the database.
+    defaults = {'BATCH_BLOCK_SIZES': settings.BATCH_BLOCK_SIZES}
+    settings.configure({'BATCH_BLOCK_SIZES': {'syntax-checker': 1}})
+    try:
+        scheduler = Scheduler.Scheduler()
+        result_id = scheduler.addJob('test@test.test', job, columns,
+                                     'syntax-checker')
+
+        process = Scheduler.Scheduler._processSyntaxCheck
+        with patch.object(Scheduler.Scheduler, '_processSyntaxCheck',
+                          autospec=True,
+                          side_effect=process) as mock_process:
+            scheduler.process()
+    finally:
+        settings.configure(defaults)
+
+    assert mock_process.call_count == 2
+
+    result = io.open(os.path.join(settings.CACHE_DIR,
+                                  'batch-job-%s.txt' % result_id),
+                     encoding='utf-8')
+    next(result)  # Header.
+    assert expected == [line.strip().split('\t') for line in result]
+
+
+def test_add_job_chunks():
+    """
+    Batch job entries are added in chunks and the job is not finished while
+    entries are still being added.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'AL449423.14(CDKN2A_v002):c.5_400del',
+                'AB026906.1:c.274G>A',
+                'NM_003002.2:c.3_4insG',
+                'NM_003002.2:c.3_4delG']
+
+    scheduler = Scheduler.Scheduler()
+
+    defaults = {'BATCH_INSERT_CHUNK_SIZE': settings.BATCH_INSERT_CHUNK_SIZE}
+    settings.configure({'BATCH_INSERT_CHUNK_SIZE': 2})
+    try:
+        result_id = scheduler.addJob('test@test.test', variants, 1,
+                                     'syntax-checker')
+    finally:
+        settings.configure(defaults)
+
+    batch_job = BatchJob.query.filter_by(result_id=result_id).one()
+    assert not batch_job.loading
+    assert [item.item for item in batch_job.batch_queue_items] == variants
+
+    # Pretend the job is still loading.
+    batch_job.loading = True
+    session.commit()
+
+    scheduler.process()
+    assert BatchJob.query.filter_by(result_id=result_id).count() == 1
+    assert batch_job.batch_queue_items.count() == 0
+
+    batch_job.loading = False
+    session.commit()
+
+    scheduler.process()
+    assert BatchJob.query.filter_by(result_id=result_id).count() == 0
+
+    result = io.open(os.path.join(settings.CACHE_DIR,
+                                  'batch-job-%s.txt' % result_id),
+                     encoding='utf-8')
+    next(result)  # Header.
+    assert [line.strip().split('\t')[0] for line in result] == variants
+
+
+def test_abandoned_job():
+    """
+    Jobs of which the entries are still being added after the loading
+    deadline are removed, other loading jobs are kept.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'AL449423.14(CDKN2A_v002):c.5_400del']
+
+    scheduler = Scheduler.Scheduler()
+    result_ids = [scheduler.addJob('test@test.test', variants, 1,
+                                   'syntax-checker')
+                  for _ in range(2)]
+
+    # Pretend the first job was abandoned while loading, and the second job
+    # is still loading.
+    BatchJob.query.filter_by(result_id=result_ids[0]).update(
+        {'loading': True,
+         'loading_expires': datetime.now() - timedelta(seconds=1)})
+    BatchJob.query.filter_by(result_id=result_ids[1]).update(
+        {'loading': True,
+         'loading_expires': datetime.now() + timedelta(seconds=60)})
+    session.commit()
+
+    scheduler.process()
+
+    assert BatchJob.query.filter_by(result_id=result_ids[0]).count() == 0
+    assert BatchQueueItem.query.count() == 0
+    assert not os.path.exists(os.path.join(
+        settings.CACHE_DIR, 'batch-job-%s.txt' % result_ids[0]))
+    assert BatchJob.query.filter_by(result_id=result_ids[1]).count() == 1
+
+
+def test_deficit_round_robin():
+    """
+    Processing time is divided equally over email addresses, so more entries
+    of a job with cheap entries are scheduled per round.
+    """
+    cheap = Scheduler.JobInfo(1, 'a@test.test', 'syntax-checker', None,
+                              'a', 0.01)
+    expensive = Scheduler.JobInfo(2, 'b@test.test', 'name-checker', None,
+                                  'b', 1.0)
+    later = Scheduler.JobInfo(3, 'a@test.test', 'name-checker', None,
+                              'c', 1.0)
+
+    defaults = {'BATCH_SCHEDULING_QUANTUM': settings.BATCH_SCHEDULING_QUANTUM,
+                'BATCH_BLOCK_SIZES': settings.BATCH_BLOCK_SIZES}
+    settings.configure({'BATCH_SCHEDULING_QUANTUM': 2,
+                        'BATCH_BLOCK_SIZES': {'syntax-checker': 100,
+                                              'name-checker': 10}})
+    try:
+        policy = Scheduler.DeficitRoundRobinPolicy()
+        assert policy.schedule([cheap, expensive, later]) == [(cheap, 100),
+                                                              (expensive, 2)]
+        policy.processed(cheap, 100)
+        policy.processed(expensive, 2)
+        assert policy.schedule([cheap, expensive, later]) == [(cheap, 100),
+                                                              (expensive, 2)]
+        policy.processed(cheap, 30)
+        policy.processed(expensive, 2)
+        # Unused credit of an email address carries over to its next job.
+        assert policy.schedule([expensive, later]) == [(expensive, 2),
+                                                       (later, 4)]
+    finally:
+        settings.configure(defaults)
+
+
+def test_estimate_job():
+    """
+    Estimate the time left for batch jobs of different email addresses.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'AL449423.14(CDKN2A_v002):c.5_400del',
+                'AB026906.1:c.274G>A']
+
+    scheduler = Scheduler.Scheduler()
+    item_cost = Scheduler.ITEM_COSTS['syntax-checker']
+
+    result_ids = [scheduler.addJob(email, variants, 1, 'syntax-checker')
+                  for email in ('a@test.test', 'b@test.test', 'a@test.test')]
+    a_1, b, a_2 = [BatchJob.query.filter_by(result_id=result_id).one()
+                   for result_id in result_ids]
+
+    assert Scheduler.estimate_job(a_1) == pytest.approx(6 * item_cost)
+    assert Scheduler.estimate_job(b) == pytest.approx(6 * item_cost)
+    assert Scheduler.estimate_job(a_2) == pytest.approx(9 * item_cost)
@@ -0,0 +1,101 @@
+"""
+Tests for the mutalyzer.sequence module.
+"""
+
+
+from __future__ import unicode_literals
+
+import cPickle
+
+from Bio.Alphabet import IUPAC
+from Bio.Seq import Seq
+import pytest
+
+from mutalyzer import sequence
+from mutalyzer import util
+
+
+DATA = 'ATGCGTAACGGTTAGCATAGC'
+
+
+@pytest.fixture
+def mapped(tmpdir):
+    """
+    Fixture creating a lazy sequence on a raw sequence file.
+    """
+    path = tmpdir.join('sequence.seq')
+    path.write(DATA)
+    return sequence.MappedSequence(unicode(path), IUPAC.unambiguous_dna)
+
+
+def test_mapped(mapped):
+    """
+    Lazy sequences can be used like Seq objects.
+    """
+    assert len(mapped) == len(DATA)
+    assert unicode(mapped) == DATA
+    assert str(mapped) == DATA.encode('ascii')
+    assert mapped[3] == DATA[3]
+    assert mapped[-1] == DATA[-1]
+    assert isinstance(mapped[2:8], Seq)
+    assert unicode(mapped[2:8]) == DATA[2:8]
+    assert unicode(mapped[8:2]) == ''
+    assert unicode(mapped[::3]) == DATA[::3]
+    assert mapped[2:8].alphabet == IUPAC.unambiguous_dna
+    assert unicode(mapped + 'AA') == DATA + 'AA'
+    assert unicode(util.splice(mapped, [2, 4, 7, 10])) == \
+        util.splice(DATA, [2, 4, 7, 10])
+
+    with pytest.raises(IndexError):
+        mapped[len(DATA)]
+
+
+def test_mapped_empty(tmpdir):
+    """
+    Empty sequence files can be used.
+    """
+    path = tmpdir.join('sequence.seq')
+    path.write('')
+    assert unicode(sequence.MappedSequence(unicode(path))) == ''
+
+
+def test_mapped_pickle(mapped):
+    """
+    Pickled lazy sequences only contain the filename.
+    """
+    data = cPickle.dumps(mapped, cPickle.HIGHEST_PROTOCOL)
+    assert DATA.encode('ascii') not in data
+
+    unpickled = cPickle.loads(data)
+    assert unicode(unpickled) == DATA
+    assert isinstance(unpickled.alphabet, IUPAC.IUPACUnambiguousDNA)
+
+
+def test_reverse_complement(mapped):
+    """
+    Reverse complements of lazy sequences are lazy.
+    """
+    reverse = mapped.reverse_complement()
+    assert isinstance(reverse, sequence.LazySequence)
+    assert unicode(reverse) == unicode(Seq(DATA).reverse_complement())
+    assert unicode(reverse[2:8]) == \
+        unicode(Seq(DATA).reverse_complement()[2:8])
+    assert reverse.reverse_complement() is mapped
+
+
+@pytest.mark.parametrize('start,stop,insertion', [
+    (0, 0, 'GG'), (3, 5, ''), (3, 3, 'TTT'), (5, 3, 'C'), (19, 30, 'A')])
+def test_replace(mapped, start, stop, insertion):
+    """
+    Replacing part of a lazy sequence gives a lazy sequence.
+    """
+    edited = sequence.replace(mapped, start, stop, insertion)
+    expected = DATA[:start] + insertion + DATA[stop:]
+    assert isinstance(edited, sequence.LazySequence)
+    assert len(edited) == len(expected)
+    assert unicode(edited) == expected
+
+    edited = sequence.replace(edited, 1, 4, 'CC')
+    expected = expected[:1] + 'CC' + expected[4:]
+    assert unicode(edited) == expected
+    assert unicode(edited[2:12]) == expected[2:12]
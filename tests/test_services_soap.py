@@ -766,6 +766,30 @@ def test_batchjob(api):
     assert len(result.decode('base64').strip().split('\n')) - 1 == len(variants)
 
 
+@pytest.mark.usefixtures('db')
+def test_batchjob_estimate(api):
+    """
+    Estimate the time left for a batch job.
+    """
+    variants = ['AB026906.1(SDHD):g.7872G>T',
+                'NM_003002.2:c.3_4insG',
+                'AL449423.14(CDKN2A_v002):c.5_400del']
+    data = '\n'.join(variants) + '\n'
+
+    result = api('submitBatchJob', data.encode('utf-8'), 'NameChecker')
+    job_id = unicode(result)
+
+    result = api('estimateBatchJob', job_id)
+    assert int(result) > 0
+
+    scheduler = Scheduler.Scheduler()
+    scheduler.process()
+
+    with pytest.raises(Fault) as excinfo:
+        api('estimateBatchJob', job_id)
+    assert excinfo.value.faultcode == 'EBATCHNOTFOUND'
+
+
 @pytest.mark.usefixtures('db')
 def test_batchjob_newlines_unix(api):
     """
@@ -5,8 +5,12 @@ Tests for the mutalyzer.variantchecker module.
 
 from __future__ import unicode_literals
 
+from mock import patch
 import pytest
 
+from mutalyzer import GenRecord
+from mutalyzer import Retriever
+from mutalyzer.output import Output
 from mutalyzer.variantchecker import check_variant
 
 from fixtures import with_references
@@ -1358,8 +1362,9 @@ def test_wnomrna_other(output, checker):
     Warning for no mRNA field on other than currently selected transcript
     should give WNOMRNA_OTHER warning.
     """
-    # Contains mtmC2 and mtmB2, both without mRNA
-    checker('AF230870.1(mtmC2_v001):c.13del')
+    # Contains mtmC2 and mtmB2, both without mRNA. Other genes are only
+    # checked if they are near the variant, mtmB2 starts at c.*20.
+    checker('AF230870.1(mtmC2_v001):c.*20del')
     wnomrna_other = output.getMessagesWithErrorCode('WNOMRNA_OTHER')
     assert len(wnomrna_other) == 1
 
@@ -1370,12 +1375,13 @@ def test_wnomrna(output, checker):
     Warning for no mRNA field on currently selected transcript should give
     WNOMRNA warning.
     """
-    # Contains mtmC2 and mtmB2, both without mRNA
+    # Contains mtmC2 and mtmB2, both without mRNA. Other genes are only
+    # checked if they are near the variant, mtmB2 is not.
     checker('AF230870.1(mtmC2_v001):c.13del')
     wnomrna = output.getMessagesWithErrorCode('WNOMRNA')
     wnomrna_other = output.getMessagesWithErrorCode('WNOMRNA_OTHER')
     assert len(wnomrna) == 1
-    assert len(wnomrna_other) == 1
+    assert len(wnomrna_other) == 0
 
 
 @with_references('L41870.1')
@@ -2422,3 +2428,60 @@ def test_ex_multiple_operations(output, checker):
     errorcount, warncount, summary = output.Summary()
     assert errorcount == 0
     assert output.getOutput('gDescription')[0] == u'g.[4823del;2954_4952del]'
+
+
+def _check_output(description):
+    output = Output('test')
+    check_variant(description, output)
+    return ([(m.code, m.description) for m in output.getMessages()],
+            output.getOutput('descriptions'),
+            output.getOutput('protDescriptions'),
+            output.getOutput('legends'))
+
+
+@with_references('AL449423.14')
+def test_transcript_index(output):
+    """
+    Using the transcript index, only transcripts near the variant are
+    described. This does not change the messages or the descriptions on
+    these transcripts, also for variants around transcript boundaries and
+    splice sites.
+    """
+    record = Retriever.GenBankRetriever(output).loadrecord('AL449423.14')
+    instance = GenRecord.GenRecord(output)
+    instance.record = record
+    instance.checkRecord()
+
+    positions = set()
+    regions = {}
+    for gene in record.geneList:
+        for transcript in gene.transcriptList:
+            if transcript.CM:
+                sites = transcript.CM.RNA
+                for site in sites[:2] + sites[-1:]:
+                    positions.update([site - 6, site, site + 5])
+                regions['%s_v%s' % (gene.name, transcript.name)] = (
+                    min(sites + transcript.CM.CDS),
+                    max(sites + transcript.CM.CDS))
+
+    def near(position, description):
+        name = description.split('(')[1].split(')')[0]
+        start, stop = regions[name.replace('_i', '_v')]
+        return (start <= position + 1 + GenRecord.SPLICE_WARN and
+                stop >= position - GenRecord.SPLICE_WARN)
+
+    codes = set()
+    for position in sorted(positions):
+        description = 'AL449423.14:g.%i_%idel' % (position, position + 1)
+        with patch.object(GenRecord.Record, 'indexTranscripts',
+                          lambda self: None):
+            messages, descriptions, proteins, legends = \
+                _check_output(description)
+        assert _check_output(description) == (
+            messages,
+            [d for d in descriptions if near(position, d)],
+            [p for p in proteins if near(position, p)],
+            legends)
+        codes.update(code for code, _ in messages)
+
+    assert 'WSPLICE_OTHER' in codes
@@ -6,9 +6,11 @@ Tests for the mutalyzer.website module.
 from __future__ import unicode_literals
 
 import bz2
+import gzip
 from mock import patch
 import os
 from io import BytesIO
+import json
 import re
 import urlparse
 
@@ -17,6 +19,7 @@ import lxml.html
 import pytest
 
 from mutalyzer import announce, Scheduler
+from mutalyzer.db import session
 from mutalyzer.db.models import BatchJob
 from mutalyzer.website import create_app
 
@@ -323,7 +326,7 @@ def test_check_noninteractive_links(website):
     non-interactive.
     """
     r = website.get('/name-checker',
-                    query_string={'description': 'NG_012772.1:g.128del',
+                    query_string={'description': 'NG_012772.1:g.18964del',
                                   'standalone': '1'})
     assert '0 Errors' in r.data
 
@@ -339,7 +342,7 @@ def test_check_interactive_links(website):
     interactive.
     """
     r = website.get('/name-checker',
-                    query_string={'description': 'NG_012772.1:g.128del'})
+                    query_string={'description': 'NG_012772.1:g.18964del'})
     assert '0 Errors' in r.data
 
     links = get_links(r.data, path='/name-checker')
@@ -655,6 +658,57 @@ def test_batch_syntaxchecker_oldstyle(website):
            header='Input\tStatus')
 
 
+@pytest.mark.usefixtures('db')
+def test_batch_syntaxchecker_compressed(website, settings):
+    """
+    Submit the batch syntax checker form and download the compressed result.
+    """
+    settings.configure({'BATCH_RESULT_GZIP': True})
+
+    variants = ['AB026906.1(SDHD):g.7872G>T',
+                'NM_003002.1:c.3_4insG',
+                'AL449423.14(CDKN2A_v002):c.5_400del']
+    try:
+        result = _batch(website,
+                        'syntax-checker',
+                        file='\n'.join(variants),
+                        size=len(variants),
+                        header='Input\tStatus')
+    finally:
+        settings.configure({'BATCH_RESULT_GZIP': False})
+
+    [filename] = [f for f in os.listdir(settings.CACHE_DIR)
+                  if f.endswith('.txt.gz')]
+
+    r = website.get('/batch-job-result/' + filename)
+    assert r.headers['Content-Type'] == 'application/gzip'
+    assert gzip.GzipFile(fileobj=BytesIO(r.data)).read() == result
+
+
+@pytest.mark.usefixtures('db')
+def test_batch_job_progress_loading(website):
+    """
+    A batch job of which the entries are still being added is not reported
+    as complete, even if all entries added so far are processed.
+    """
+    batch_job = BatchJob('syntax-checker', email='test@test.test')
+    batch_job.loading = True
+    session.add(batch_job)
+    session.commit()
+    result_id = batch_job.result_id
+
+    r = website.get('/batch-job-progress',
+                    query_string={'result_id': result_id, 'json': 'true'})
+    assert json.loads(r.data) == {'items_left': 1, 'complete': False}
+
+    BatchJob.query.filter_by(result_id=result_id).update({'loading': False})
+    session.commit()
+
+    r = website.get('/batch-job-progress',
+                    query_string={'result_id': result_id, 'json': 'true'})
+    assert json.loads(r.data) == {'items_left': 0, 'complete': False}
+
+
 @with_references('AB026906.1')
 def test_batch_namechecker_restriction_sites(website):
     """